@@ -1,22 +1,119 @@
 import os
+import json
+import base64
+import io
+import re
+import csv
+import time
+import hashlib
+import bisect
+import threading
 import datetime # Para fechas y deltas
-from flask import Flask, jsonify, request
+import gzip
+import zlib
+import sqlite3
+import unicodedata
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from types import MappingProxyType
+from flask import Flask, Blueprint, current_app, g, has_request_context, jsonify, request, Response, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import MultiDict
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, extract # Para funciones SQL como SUM, COUNT, y extract para partes de fechas
+from sqlalchemy import func, extract, cast, or_, and_, case, true, literal, type_coerce, text, event, DDL, bindparam, inspect, create_engine # Para funciones SQL como SUM, COUNT, y extract para partes de fechas
+from sqlalchemy.orm import selectinload, joinedload, lazyload, load_only, Session
+from sqlalchemy.pool import NullPool
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert # Para upserts (INSERT ... ON CONFLICT)
 from flask_cors import CORS
 
-# Crear la carpeta 'instance' si no existe, ya que ahí vivirá el SQLite
-instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
-os.makedirs(instance_path, exist_ok=True)
+try:
+    import fcntl # Solo Unix: lock entre workers al rehacer la copia para estadísticas
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson # Opcional: si está instalado, serializa JSON varias veces más rápido que el módulo json
+except ImportError:
+    orjson = None
+
+# Configuración por defecto. create_app() la completa con variables de entorno (ver README):
+# DATABASE_URL, JSON_ENCODER y cualquier clave con prefijo FLASK_ (ej. FLASK_CATALOG_CACHE_SIZE=512).
+DEFAULT_CONFIG = {
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'CATALOG_CACHE_SIZE': 256, # Máximo de respuestas del catálogo en caché (LRU)
+    # Feed de cambios (SSE): eventos pendientes por conexión antes de pedirle al cliente que
+    # resincronice, y segundos sin eventos tras los que se envía un heartbeat. Con varios workers, cada
+    # cuántos segundos cada uno lee los eventos que los demás dejaron en CHANGE_FEED_FILE.
+    'CHANGE_FEED_QUEUE_SIZE': 100,
+    'CHANGE_FEED_HEARTBEAT_SECONDS': 15,
+    'CHANGE_FEED_POLL_SECONDS': 0.5,
+    # Compresión de respuestas: solo cuerpos de al menos COMPRESS_MIN_SIZE bytes (en los más chicos
+    # no compensa) y de estos tipos. Nivel de 1 (más rápido) a 9 (más chico).
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_LEVEL': 6,
+    'COMPRESS_MIMETYPES': ('application/json', 'text/csv', 'text/plain', 'text/html'),
+    # 'orjson' (si está instalado) o 'json' (módulo estándar) para las respuestas JSON
+    'JSON_ENCODER': 'orjson',
+    # Métricas (/metrics): cada cuántos segundos cada worker guarda las suyas en METRICS_DIR.
+    # SLOW_REQUEST_SECONDS (ej. 0.5) registra en el log las peticiones más lentas con sus consultas; None lo desactiva.
+    'METRICS_FLUSH_SECONDS': 5,
+    'SLOW_REQUEST_SECONDS': None,
+    # Copia de la base de datos para las estadísticas: cada cuántos segundos se rehace (None la desactiva
+    # y las estadísticas leen la base principal) y antigüedad máxima aceptada antes de leer la base principal.
+    'ANALYTICS_SNAPSHOT_SECONDS': 60,
+    'ANALYTICS_MAX_STALENESS_SECONDS': 300,
+    # Reportes en segundo plano (/api/reports): hilos por worker que los generan y segundos que se
+    # conserva cada resultado (un pedido igual dentro de ese plazo recibe el resultado guardado).
+    'REPORT_WORKERS': 2,
+    'REPORT_RESULT_TTL_SECONDS': 600,
+    # Nivel de cliente automático: la primera regla que cumple el cliente define su nivel (si no cumple
+    # ninguna, 'Nuevo'). Cada regla combina condiciones sobre sus compras no canceladas: min_orders,
+    # min_total_spent, min_average_ticket y max_days_since_last_purchase. Vacío (por defecto) = nivel
+    # cargado a mano. Ej.: FLASK_CLIENT_LEVEL_RULES='[{"level": "VIP", "min_orders": 10, "min_total_spent": 1000},
+    # {"level": "Frecuente", "min_orders": 3}]' y después `flask reclassify-clients`.
+    'CLIENT_LEVEL_RULES': (),
+    # Perfil de almacenamiento de SQLite, aplicado a cada conexión nueva:
+    # - WAL: los lectores no bloquean a los escritores ni viceversa (evita "database is locked" en ferias).
+    # - synchronous=NORMAL: con WAL es seguro ante caídas de la aplicación y mucho más rápido que FULL.
+    # - busy_timeout: un escritor espera al otro (también de otro worker) en lugar de fallar de inmediato.
+    # - cache_size (negativo = KiB) y mmap_size: más páginas en memoria para las lecturas.
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 10000, # ms
+        'cache_size': -32000, # ~32 MB por conexión
+        'mmap_size': 268435456, # 256 MB
+        'temp_store': 'MEMORY',
+    },
+    # Las rutas por defecto de DATABASE_URL, CONFIG_VERSION_FILE, CATALOG_VERSION_FILE, METRICS_DIR, REPORTS_DIR y CHANGE_FEED_FILE dependen
+    # de la carpeta 'instance' de la app, y la de ANALYTICS_SNAPSHOT_FILE de la base de datos: se completan en create_app().
+}
+
+def sqlite_engine_options(database_uri, pragmas):
+    """Pool de conexiones para SQLite en archivo. Las bases en memoria usan el pool por defecto de SQLAlchemy."""
+    if not database_uri.startswith('sqlite') or ':memory:' in database_uri or database_uri in ('sqlite://', 'sqlite:///'):
+        return {}
+    return {
+        'pool_size': 10, # Conexiones abiertas reutilizables (una por hilo activo)
+        'max_overflow': 10, # Conexiones extra en picos
+        'pool_timeout': 30, # Segundos esperando una conexión libre antes de fallar
+        'connect_args': {'timeout': pragmas['busy_timeout'] / 1000},
+    }
 
-app = Flask(__name__)
-CORS(app) # Habilitar CORS para todas las rutas
+def analytics_snapshot_path(database_uri):
+    """Archivo por defecto de la copia para estadísticas, junto a la base (None si no es SQLite en archivo)."""
+    url = make_url(database_uri)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return os.path.splitext(os.path.abspath(url.database))[0] + '-analytics.db'
 
-# Configuración de la base de datos SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(instance_path, 'database.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy()
 
-db = SQLAlchemy(app)
+# Todas las rutas y comandos de la aplicación. create_app() los registra en la app.
+bp = Blueprint('api', __name__, cli_group=None)
 
 # --- Modelos de la Base de Datos ---
 
@@ -52,10 +149,10 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     # Relación muchos a muchos con Category
-    categories = db.relationship('Category', secondary=product_categories_table, lazy='subquery',
+    categories = db.relationship('Category', secondary=product_categories_table, lazy='selectin',
                                  backref=db.backref('products', lazy=True))
     # Relación muchos a muchos con Tag
-    tags = db.relationship('Tag', secondary=product_tags_table, lazy='subquery',
+    tags = db.relationship('Tag', secondary=product_tags_table, lazy='selectin',
                            backref=db.backref('products', lazy=True))
     priceRevista = db.Column(db.Float, nullable=True) # Precio de revista/catálogo oficial
     priceShowroom = db.Column(db.Float, nullable=False) # Precio normal (-20% aprox)
@@ -66,10 +163,15 @@ class Product(db.Model):
     # Campo para el catálogo (si se quiere sobreescribir imagen/precio solo para catálogo)
     catalogImageUrl = db.Column(db.String(255), nullable=True)
     catalogPrice = db.Column(db.Float, nullable=True)
+    # Código del producto en la revista/proveedor (ej. código Natura). Permite re-importar sin duplicar.
+    externalCode = db.Column(db.String(50), nullable=True, unique=True, index=True)
 
     # Relación con SaleItem
     sale_items = db.relationship('SaleItem', backref='product', lazy=True)
 
+    # Índice para la paginación por cursor (orden por nombre, desempate por id)
+    __table_args__ = (db.Index('ix_product_name_id', 'name', 'id'),)
+
 class Category(db.Model):
     __tablename__ = 'category'
     id = db.Column(db.Integer, primary_key=True)
@@ -96,6 +198,11 @@ class Client(db.Model):
     profileImageUrl = db.Column(db.String(255), nullable=True)
     # Historial de compras
     sales = db.relationship('Sale', backref='client', lazy=True)
+    # Totales de compras (agregado que mantienen las rutas de ventas); None si nunca compró
+    purchase_stats = db.relationship('ClientSalesTotal', uselist=False, viewonly=True)
+
+    # Índice para la paginación por cursor (orden por nombre, desempate por id)
+    __table_args__ = (db.Index('ix_client_name_id', 'name', 'id'),)
 
 class Sale(db.Model):
     __tablename__ = 'sale'
@@ -107,34 +214,739 @@ class Sale(db.Model):
     # Relación con SaleItem
     items = db.relationship('SaleItem', backref='sale', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Paginación por cursor (más recientes primero, desempate por id) y filtros por fecha
+        db.Index('ix_sale_saleDate_id', 'saleDate', 'id'),
+        # Filtros por estado o por cliente, que además se listan ordenados por fecha
+        db.Index('ix_sale_status_saleDate_id', 'status', 'saleDate', 'id'),
+        db.Index('ix_sale_client_id_saleDate_id', 'client_id', 'saleDate', 'id'),
+    )
+
 class SaleItem(db.Model):
     __tablename__ = 'sale_item'
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price_at_sale = db.Column(db.Float, nullable=False) # Precio del producto al momento de la venta (puede ser priceFeria o priceShowroom)
     subtotal = db.Column(db.Float, nullable=False, default=0.0) # quantity * price_at_sale
 
+class SaleStatusCounter(db.Model):
+    """Cantidad y monto total de ventas por estado. Se actualiza en la misma transacción que cada venta."""
+    __tablename__ = 'sale_status_counter'
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    totalAmount = db.Column(db.Float, nullable=False, default=0.0)
+
+class SalesDailyRollup(db.Model):
+    """Pedidos y monto vendido por día (UTC, igual que saleDate), sin contar ventas canceladas."""
+    __tablename__ = 'sales_daily_rollup'
+    date = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_sales = db.Column(db.Float, nullable=False, default=0.0)
+
+# Rankings de productos y clientes (sin ventas canceladas). Los totales históricos se leen como top-K
+# por índice; las tablas por día responden los rankings de un rango de fechas (from/to).
+
+class ProductSalesTotal(db.Model):
+    __tablename__ = 'product_sales_total'
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    units_sold = db.Column(db.Integer, nullable=False, default=0, index=True)
+    revenue = db.Column(db.Float, nullable=False, default=0.0, index=True)
+
+class ProductDailySales(db.Model):
+    __tablename__ = 'product_daily_sales'
+    date = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+class ClientSalesTotal(db.Model):
+    __tablename__ = 'client_sales_total'
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    total_spent = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    # Días de la primera y la última compra (no cancelada); se recalculan desde client_daily_sales
+    first_purchase = db.Column(db.Date, nullable=True)
+    last_purchase = db.Column(db.Date, nullable=True)
+
+class ClientDailySales(db.Model):
+    __tablename__ = 'client_daily_sales'
+    date = db.Column(db.Date, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Primera y última compra de un cliente sin recorrer la tabla (incluye order_count: no lee las filas)
+    __table_args__ = (db.Index('ix_client_daily_sales_client_date', 'client_id', 'date', 'order_count'),)
+
+# Índice de búsqueda full-text (FTS5) del catálogo. rowid = product.id.
+# unicode61 con remove_diacritics 2 hace la búsqueda insensible a mayúsculas y acentos
+# ("crema" encuentra "Crema Ekos", "perfume" encuentra "Perfúme"). Los índices de prefijo
+# aceleran las búsquedas mientras se escribe ("cre" -> "crema").
+# create_all() no crea tablas virtuales, por eso se crea con un DDL al crear el esquema.
+PRODUCT_SEARCH_TABLE = 'product_search'
+event.listen(db.metadata, 'after_create', DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_SEARCH_TABLE} USING fts5("
+    "name, tags, categories, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+))
+
+# Índice de búsqueda de clientes (FTS5 con tokenizer trigram). rowid = client.id.
+# Los textos se guardan normalizados (minúsculas, sin acentos) y cada palabra con la marca de
+# comienzo '^' ("^ana ^gomez"): así buscar el prefijo "an" es buscar la subcadena "^an", que ya
+# tiene 3 caracteres y puede usar el índice de trigramas. phone guarda solo los dígitos del WhatsApp.
+CLIENT_SEARCH_TABLE = 'client_search'
+event.listen(db.metadata, 'after_create', DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {CLIENT_SEARCH_TABLE} USING fts5("
+    "name, nickname, email, phone, tokenize = 'trigram')"
+))
+event.listen(db.metadata, 'before_drop', DDL(f"DROP TABLE IF EXISTS {PRODUCT_SEARCH_TABLE}"))
+event.listen(db.metadata, 'before_drop', DDL(f"DROP TABLE IF EXISTS {CLIENT_SEARCH_TABLE}"))
+
 # --- Rutas y Lógica de la Aplicación ---
 
-@app.route('/')
+@bp.route('/')
 def hello():
     return "Backend del Showroom Natura OjitOs funcionando!"
 
 # --- API Endpoints ---
 
-# Endpoint para la Configuración
-@app.route('/api/config', methods=['GET'])
-def get_config():
-    config = Config.query.first()
-    if not config:
-        # Si no hay configuración, crear una por defecto y guardarla
-        config = Config()
-        db.session.add(config)
-        db.session.commit()
+# --- Métricas de peticiones (/metrics) ---
+# Por cada endpoint de Flask y método HTTP se registra: histograma de latencia, peticiones por
+# código de estado, cantidad y tiempo de consultas SQL (eventos del engine de SQLAlchemy) y bytes
+# de respuesta. /metrics las expone en el formato de texto de Prometheus.
+# Cada worker acumula sus métricas en memoria y cada METRICS_FLUSH_SECONDS las guarda en un archivo
+# propio en METRICS_DIR; /metrics suma los archivos de todos los workers. Los archivos de workers
+# que ya terminaron se conservan (los contadores no retroceden) hasta que se reinicia el servidor.
+# Con SLOW_REQUEST_SECONDS se registra en el log cada petición más lenta que ese umbral, con sus
+# consultas agrupadas (una consulta repetida muchas veces suele ser un N+1).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # segundos
+SQL_QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250) # consultas por petición
+SLOW_LOG_MAX_QUERIES = 10 # Consultas distintas que se muestran por petición lenta (las de más tiempo)
+
+def new_metrics_series():
+    return {
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1), # El último es +Inf
+        'latency_sum': 0.0,
+        'sql_buckets': [0] * (len(SQL_QUERY_BUCKETS) + 1),
+        'sql_queries': 0,
+        'sql_seconds': 0.0,
+        'response_bytes': 0,
+        'statuses': {},
+    }
 
-    return jsonify({
+class RequestMetrics:
+    """Métricas de las peticiones atendidas por este proceso, por (endpoint, método)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._last_flush = 0.0
+
+    def observe(self, endpoint, method, status, seconds, sql_queries, sql_seconds, response_bytes):
+        with self._lock:
+            series = self._series.get((endpoint, method))
+            if series is None:
+                series = self._series[(endpoint, method)] = new_metrics_series()
+            series['latency_buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            series['latency_sum'] += seconds
+            series['sql_buckets'][bisect.bisect_left(SQL_QUERY_BUCKETS, sql_queries)] += 1
+            series['sql_queries'] += sql_queries
+            series['sql_seconds'] += sql_seconds
+            series['response_bytes'] += response_bytes
+            status = str(status)
+            series['statuses'][status] = series['statuses'].get(status, 0) + 1
+
+    def to_json(self):
+        with self._lock:
+            return [{**series, 'endpoint': endpoint, 'method': method,
+                     'latency_buckets': list(series['latency_buckets']), 'sql_buckets': list(series['sql_buckets']),
+                     'statuses': dict(series['statuses'])}
+                    for (endpoint, method), series in self._series.items()]
+
+    def flush(self, directory, min_interval=0):
+        """Guarda las métricas en el archivo de este proceso (como mucho una vez cada `min_interval` segundos)."""
+        now = time.monotonic()
+        if now - self._last_flush < min_interval:
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_json(), f)
+        os.replace(path + '.tmp', path) # Reemplazo atómico: /metrics nunca lee un archivo a medio escribir
+
+request_metrics = RequestMetrics()
+
+def reset_metrics_files(directory):
+    """Borra las métricas guardadas por los workers (ej. al arrancar el servidor)."""
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(directory, name))
+
+def collect_metrics(directory):
+    """Suma las métricas guardadas por todos los workers, por (endpoint, método)."""
+    merged = {}
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                worker_series = json.load(f)
+        except (OSError, ValueError):
+            continue # El worker lo está reemplazando justo ahora o ya no existe
+        for series in worker_series:
+            total = merged.setdefault((series['endpoint'], series['method']), new_metrics_series())
+            for key in ('latency_buckets', 'sql_buckets'):
+                total[key] = [a + b for a, b in zip(total[key], series[key])]
+            for key in ('latency_sum', 'sql_queries', 'sql_seconds', 'response_bytes'):
+                total[key] += series[key]
+            for status, count in series['statuses'].items():
+                total['statuses'][status] = total['statuses'].get(status, 0) + count
+    return merged
+
+def prometheus_labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def render_prometheus_metrics(merged):
+    lines = []
+    def histogram(name, help_text, buckets, counts_key, sum_key):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} histogram'])
+        for (endpoint, method), series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], series[counts_key]):
+                cumulative += count
+                lines.append(f'{name}_bucket{prometheus_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+            labels = prometheus_labels(endpoint=endpoint, method=method)
+            lines.append(f'{name}_sum{labels} {series[sum_key]}')
+            lines.append(f'{name}_count{labels} {cumulative}')
+    def counter(name, help_text, key):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+        for (endpoint, method), series in sorted(merged.items()):
+            lines.append(f'{name}{prometheus_labels(endpoint=endpoint, method=method)} {series[key]}')
+
+    histogram('http_request_duration_seconds', 'Duración de las peticiones en segundos.',
+              LATENCY_BUCKETS, 'latency_buckets', 'latency_sum')
+    lines.extend(['# HELP http_requests_total Peticiones atendidas por código de estado.',
+                  '# TYPE http_requests_total counter'])
+    for (endpoint, method), series in sorted(merged.items()):
+        for status, count in sorted(series['statuses'].items()):
+            lines.append(f'http_requests_total{prometheus_labels(endpoint=endpoint, method=method, status=status)} {count}')
+    histogram('http_request_sql_queries', 'Consultas SQL por petición.',
+              SQL_QUERY_BUCKETS, 'sql_buckets', 'sql_queries')
+    counter('http_request_sql_seconds_total', 'Tiempo total en consultas SQL en segundos.', 'sql_seconds')
+    counter('http_response_bytes_total', 'Bytes de respuesta enviados (después de comprimir; 0 en respuestas en streaming).',
+            'response_bytes')
+    return '\n'.join(lines) + '\n'
+
+def record_sql_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+def record_sql_end(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_request_context() or 'request_started_at' not in g:
+        return # Consultas fuera de una petición (ej. comandos de la CLI)
+    g.sql_queries += 1
+    g.sql_seconds += seconds
+    if g.sql_statements is not None:
+        stats = g.sql_statements.setdefault(statement, [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started_at = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+    # Las consultas individuales solo se guardan si está activo el log de peticiones lentas
+    g.sql_statements = {} if current_app.config['SLOW_REQUEST_SECONDS'] is not None else None
+
+def log_slow_request(response, seconds):
+    lines = [f'Petición lenta: {request.method} {request.full_path.rstrip("?")} -> {response.status_code} '
+             f'en {seconds:.3f} s (SQL: {g.sql_queries} consultas, {g.sql_seconds:.3f} s)']
+    statements = sorted(g.sql_statements.items(), key=lambda item: (item[1][1], item[1][0]), reverse=True)
+    for statement, (count, statement_seconds) in statements[:SLOW_LOG_MAX_QUERIES]:
+        lines.append(f'  {count}x {statement_seconds:.3f} s  ' + ' '.join(statement.split())[:300])
+    if len(statements) > SLOW_LOG_MAX_QUERIES:
+        lines.append(f'  ... y {len(statements) - SLOW_LOG_MAX_QUERIES} consultas distintas más')
+    current_app.logger.warning('\n'.join(lines))
+
+# Se registra antes que compress_response: los after_request se ejecutan en orden inverso, así que
+# esta función corre última y mide los bytes ya comprimidos.
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'request_started_at' not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started_at
+    response_bytes = 0 if response.is_streamed else (response.content_length or 0)
+    request_metrics.observe(request.endpoint or 'sin_ruta', request.method, response.status_code,
+                            seconds, g.sql_queries, g.sql_seconds, response_bytes)
+    slow_threshold = current_app.config['SLOW_REQUEST_SECONDS']
+    if slow_threshold is not None and seconds >= slow_threshold:
+        log_slow_request(response, seconds)
+    request_metrics.flush(current_app.config['METRICS_DIR'], current_app.config['METRICS_FLUSH_SECONDS'])
+    return response
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    directory = current_app.config['METRICS_DIR']
+    request_metrics.flush(directory) # Incluye lo último de este worker
+    return Response(render_prometheus_metrics(collect_metrics(directory)),
+                    mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Serialización JSON y compresión de respuestas ---
+# jsonify usa el proveedor JSON de la app. Con orjson instalado, create_app() lo reemplaza por uno
+# que lo usa (JSON_ENCODER=json fuerza el módulo estándar). Las fechas y demás tipos especiales
+# pasan por el mismo `default` de Flask, así la respuesta es la misma con ambos.
+
+class OrjsonJSONProvider(DefaultJSONProvider):
+    def _options(self):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options()) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+@bp.after_app_request
+def compress_response(response):
+    """Comprime con gzip o deflate (según Accept-Encoding) las respuestas grandes de texto/JSON."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in current_app.config['COMPRESS_MIMETYPES']):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+    if encoding is None or (response.content_length or 0) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    body = response.get_data()
+    level = current_app.config['COMPRESS_LEVEL']
+    response.set_data(gzip.compress(body, compresslevel=level) if encoding == 'gzip' else zlib.compress(body, level))
+    response.headers['Content-Encoding'] = encoding
+    # El cuerpo comprimido es otra representación: el ETag pasa a ser débil (W/"...")
+    etag, is_weak = response.get_etag()
+    if etag and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# --- Acciones post-commit ---
+# Algunas estructuras en memoria (ej. la caché del catálogo) solo deben actualizarse cuando el
+# cambio en la base de datos quedó confirmado. Las rutas registran callbacks con run_after_commit()
+# y se ejecutan después del commit; si la transacción se descarta, los callbacks también.
+
+def run_after_commit(callback):
+    """Ejecuta `callback()` cuando la sesión actual confirme su transacción."""
+    db.session.info.setdefault('after_commit_callbacks', []).append(callback)
+
+@event.listens_for(db.session, 'after_commit')
+def _run_after_commit_callbacks(session):
+    callbacks = session.info.pop('after_commit_callbacks', [])
+    for callback in callbacks:
+        callback()
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_after_commit_callbacks(session):
+    session.info.pop('after_commit_callbacks', None)
+
+# --- Feed de cambios en vivo (Server-Sent Events) ---
+# Las rutas de ventas, productos y configuración publican eventos compactos (ej. venta creada,
+# cambio de estado, stock, contadores del dashboard) en un broker en memoria que los reparte a
+# todas las conexiones abiertas de /api/events. Cada conexión tiene una cola acotada: si un
+# cliente lento la llena, se descartan sus eventos pendientes y recibe un evento 'resync' para
+# recargar los datos completos, sin frenar a las rutas que publican ni crecer sin límite.
+# El broker es por proceso. Para que con varios workers cada conexión reciba también los cambios
+# confirmados por los demás, cada evento se agrega además a un archivo compartido (CHANGE_FEED_FILE,
+# una línea por evento) y cada worker con conexiones abiertas lee las líneas nuevas de los otros
+# procesos y las reparte a sus suscriptores (ver ChangeFeedRelay).
+
+CHANGE_FEED_RESYNC = 'resync'
+
+class ChangeFeedSubscriber:
+    """Cola acotada de eventos de una conexión SSE."""
+
+    def __init__(self, max_events):
+        self.max_events = max_events
+        self.events = deque()
+        self.lagged = False # La cola se desbordó: el cliente debe resincronizar
+        self.condition = threading.Condition()
+
+    def push(self, event):
+        with self.condition:
+            if len(self.events) >= self.max_events:
+                self.events.clear()
+                self.lagged = True
+            else:
+                self.events.append(event)
+            self.condition.notify()
+
+    def pop(self, timeout):
+        """Siguiente evento, o None si pasaron `timeout` segundos sin eventos."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.lagged, timeout)
+            if self.lagged:
+                self.lagged = False
+                return (None, CHANGE_FEED_RESYNC, '{}')
+            return self.events.popleft() if self.events else None
+
+class ChangeFeed:
+    """Broker en memoria que reparte cada evento publicado a todos los suscriptores."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._last_event_id = 0
+
+    def subscribe(self, max_events):
+        subscriber = ChangeFeedSubscriber(max_events)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, data):
+        """Reparte el evento a los suscriptores de este proceso. Retorna el evento serializado."""
+        payload = json.dumps(data, ensure_ascii=False) # Se serializa una sola vez para todos
+        self.publish_payload(event_type, payload)
+        return payload
+
+    def publish_payload(self, event_type, payload):
+        with self._lock:
+            self._last_event_id += 1
+            event = (self._last_event_id, event_type, payload)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.push(event)
+
+change_feed = ChangeFeed()
+
+# Tamaño a partir del cual el archivo compartido de eventos se reemplaza por uno vacío
+CHANGE_FEED_FILE_MAX_BYTES = 1024 * 1024
+
+class ChangeFeedReader:
+    """
+    Posición de lectura en el archivo compartido de eventos. read() retorna los eventos que otros
+    procesos agregaron desde la lectura anterior. Empieza al final del archivo: solo interesan los
+    eventos posteriores a su creación.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.inode, self.offset = self._position()
+
+    def _position(self):
+        """(inodo, tamaño) del archivo actual, o (None, 0) si todavía no existe."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def skip_to_end(self):
+        self.inode, self.offset = self._position()
+
+    def read(self):
+        """
+        ([(tipo, json)] de otros procesos, perdidos). `perdidos` es True si el archivo se reemplazó
+        (al crecer) antes de terminar de leerlo: pudo haber eventos que nunca se van a leer.
+        """
+        inode, size = self._position() # Sin cambios (lo más común) alcanza con un stat
+        if inode is None or (inode == self.inode and size == self.offset):
+            return [], False
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return [], False
+        lost = False
+        with f:
+            current_inode = os.fstat(f.fileno()).st_ino
+            if current_inode != self.inode:
+                lost = self.inode is not None
+                self.inode, self.offset = current_inode, 0
+            f.seek(self.offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1 # Una línea a medio escribir se lee en la próxima vuelta
+        self.offset += end
+        pid = str(os.getpid())
+        events = []
+        for line in chunk[:end].decode('utf-8').splitlines():
+            line_pid, event_type, payload = line.split('\t', 2)
+            if line_pid != pid:
+                events.append((event_type, payload))
+        return events, lost
+
+class ChangeFeedRelay:
+    """
+    Reparte los eventos del feed entre procesos con un archivo compartido. Cada línea es
+    'pid<TAB>tipo<TAB>json': un solo write() con O_APPEND, así las líneas de distintos workers no
+    se mezclan. Un hilo por proceso lee las líneas nuevas y publica en el feed local las de los
+    demás procesos. Cuando el archivo supera CHANGE_FEED_FILE_MAX_BYTES se reemplaza por uno nuevo
+    (otro inodo): quien lo nota puede haberse perdido eventos y manda 'resync' a sus conexiones.
+    El catálogo en memoria lee el mismo archivo con su propio ChangeFeedReader (catalog_reader).
+    """
+
+    def __init__(self, path, poll_seconds, logger):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.logger = logger
+        self._thread = None
+        self._lock = threading.Lock()
+        self.catalog_reader = ChangeFeedReader(path)
+
+    def append(self, event_type, payload):
+        line = f'{os.getpid()}\t{event_type}\t{payload}\n'.encode('utf-8')
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > CHANGE_FEED_FILE_MAX_BYTES:
+                temp_path = f'{self.path}.{os.getpid()}.tmp'
+                open(temp_path, 'wb').close()
+                os.replace(temp_path, self.path)
+        except OSError: # El cambio ya está confirmado: sin relay, los otros workers solo pierden el aviso
+            self.logger.exception('No se pudo escribir el evento en el feed compartido')
+
+    def ensure_tailer(self):
+        with self._lock:
+            # is_alive(): después de un fork el hilo del proceso padre no existe en el hijo
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-feed-relay', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Solo interesan los eventos posteriores al arranque: las conexiones recargan todo al abrirse
+        reader = ChangeFeedReader(self.path)
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                events, lost = reader.read()
+            except Exception: # El hilo no debe morir: se reintenta en la próxima lectura
+                self.logger.exception('No se pudo leer el feed compartido')
+                reader.skip_to_end()
+                events, lost = [], True
+            if lost:
+                change_feed.publish_payload(CHANGE_FEED_RESYNC, '{}')
+            for event_type, payload in events:
+                change_feed.publish_payload(event_type, payload)
+
+_change_feed_relays = {} # Por archivo compartido
+_change_feed_relays_lock = threading.Lock()
+
+def change_feed_relay():
+    """El relay entre procesos de la app actual, o None si está desactivado (CHANGE_FEED_FILE vacío)."""
+    path = current_app.config['CHANGE_FEED_FILE']
+    if not path:
+        return None
+    with _change_feed_relays_lock:
+        relay = _change_feed_relays.get(path)
+        if relay is None:
+            relay = _change_feed_relays[path] = ChangeFeedRelay(
+                path, current_app.config['CHANGE_FEED_POLL_SECONDS'], current_app.logger)
+    return relay
+
+def publish_change(event_type, data, relay=None):
+    """Publica el evento en el feed de este proceso y, con `relay`, para los demás workers."""
+    payload = change_feed.publish(event_type, data)
+    if relay is not None:
+        relay.append(event_type, payload)
+
+def publish_after_commit(event_type, data):
+    """Publica el evento en el feed solo si la transacción actual se confirma."""
+    relay = change_feed_relay() # Se resuelve ahora, con la app de la petición
+    run_after_commit(lambda: publish_change(event_type, data, relay))
+
+def format_sse_event(event):
+    event_id, event_type, payload = event
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event_type}', f'data: {payload}']
+    return '\n'.join(lines) + '\n\n'
+
+@bp.route('/api/events', methods=['GET'])
+def stream_events():
+    max_events = current_app.config['CHANGE_FEED_QUEUE_SIZE']
+    heartbeat_seconds = current_app.config['CHANGE_FEED_HEARTBEAT_SECONDS']
+
+    relay = change_feed_relay()
+    if relay is not None:
+        relay.ensure_tailer() # Este worker empieza a recibir los eventos de los demás
+
+    # El generador no usa la base de datos, así que la conexión abierta no retiene ninguna conexión del pool
+    def generate():
+        subscriber = change_feed.subscribe(max_events)
+        try:
+            yield 'retry: 3000\n\n' # Reintento del navegador si se corta la conexión (ms)
+            while True:
+                event = subscriber.pop(timeout=heartbeat_seconds)
+                # El heartbeat mantiene viva la conexión en proxies y permite detectar clientes desconectados
+                yield format_sse_event(event or (None, 'heartbeat', '{}'))
+        finally:
+            change_feed.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Sin buffer en nginx
+    return response
+
+# --- Carga en lote de relaciones ---
+# Los listados cargan cada relación con una cantidad fija de consultas (JOIN o SELECT ... IN)
+# en vez de una consulta por fila al serializar (problema N+1).
+# Product.tags y Product.categories ya se cargan con 'selectin' por defecto.
+
+def sale_list_loader_options(fields=None):
+    """Opciones de carga para serializar ventas con sale_to_json sin consultas por fila (solo lo que pide `fields`)."""
+    options = []
+    if fields is not None:
+        options += column_projection_options(Sale, fields, ('client_name', 'items'))
+    if fields is None or 'client_name' in fields:
+        options.append(joinedload(Sale.client).load_only(Client.id, Client.name))
+    if fields is None or 'items' in fields:
+        item_product = selectinload(Sale.items).joinedload(SaleItem.product)
+        options += [
+            item_product.load_only(Product.id, Product.name),
+            # sale_item_to_json solo usa el nombre del producto: no cargar sus tags/categorías
+            item_product.lazyload(Product.tags),
+            item_product.lazyload(Product.categories),
+        ]
+    return options
+
+def product_columns_only_options():
+    """Para rutas que no usan tags ni categorías de los productos (ej. la creación de ventas): no se cargan."""
+    return (lazyload(Product.tags), lazyload(Product.categories))
+
+# --- Paginación por cursor (keyset) ---
+# Los listados se recorren por claves indexadas (ej. saleDate,id) en lugar de OFFSET,
+# así el costo de cada página no depende de qué tan profundo se pagine.
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+
+def encode_cursor(values):
+    """Codifica las claves de la última fila de una página como un cursor opaco."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodifica un cursor generado por encode_cursor. Lanza ValueError si es inválido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Cursor inválido.')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Cursor inválido.')
+    return values
+
+def wants_all_rows():
+    """True si el cliente pidió explícitamente el listado completo sin paginar (?all=true)."""
+    return request.args.get('all', '').lower() == 'true'
+
+def paginate_keyset(query, sort_column, id_column, to_json, descending=False):
+    """
+    Pagina `query` por (sort_column, id_column) usando los parámetros ?limit= y ?after=.
+    Retorna un dict con 'items' y 'next_cursor' (None si no hay más páginas).
+    Lanza ValueError si limit o after no son válidos.
+    """
+    limit_str = request.args.get('limit')
+    if limit_str is None or limit_str == '':
+        limit = DEFAULT_PAGE_LIMIT
+    else:
+        try:
+            limit = int(limit_str)
+        except ValueError:
+            raise ValueError('limit debe ser un número entero.')
+        if limit <= 0:
+            raise ValueError('limit debe ser mayor a 0.')
+        limit = min(limit, MAX_PAGE_LIMIT)
+
+    # Se compara contra el valor tal cual está guardado en SQLite (texto para fechas):
+    # las ventas creadas con current_timestamp no tienen microsegundos y un datetime
+    # re-serializado por SQLAlchemy no sería igual al valor almacenado.
+    sort_key = type_coerce(sort_column, db.String)
+
+    after = request.args.get('after')
+    if after:
+        sort_value, last_id = decode_cursor(after)
+        if descending:
+            query = query.filter(or_(sort_key < sort_value,
+                                     and_(sort_key == sort_value, id_column < last_id)))
+        else:
+            query = query.filter(or_(sort_key > sort_value,
+                                     and_(sort_key == sort_value, id_column > last_id)))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+
+    # Se pide una fila extra para saber si existe una página siguiente sin hacer un COUNT
+    rows = query.add_columns(sort_key.label('cursor_sort_value')).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last_obj, last_sort_value = rows[-1]
+        next_cursor = encode_cursor([last_sort_value, getattr(last_obj, id_column.key)])
+
+    return {'items': [to_json(obj) for obj, _ in rows], 'next_cursor': next_cursor}
+
+# --- Proyección de campos (?fields=) ---
+# Los listados aceptan ?fields=id,name,... para devolver solo esos campos. Además de serializar
+# menos, solo se cargan de la base de datos las columnas y relaciones pedidas (load_only y sin
+# cargar las relaciones que no se piden). El id se incluye siempre.
+
+def parse_fields_param(available_fields):
+    """Campos pedidos en ?fields=, o None si no se pidió proyección. Lanza ValueError si hay campos desconocidos."""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - set(available_fields)
+    if unknown:
+        raise ValueError(f"Campos desconocidos en 'fields': {', '.join(sorted(unknown))}. "
+                         f"Campos disponibles: {', '.join(available_fields)}.")
+    fields.add('id')
+    return fields
+
+def serialize_fields(obj, serializers, fields=None):
+    """Dict con los campos de `serializers` (nombre -> función) incluidos en `fields` (todos si es None)."""
+    return {name: serialize(obj) for name, serialize in serializers.items() if fields is None or name in fields}
+
+def column_projection_options(model, fields, relationship_fields=()):
+    """load_only de las columnas pedidas (los nombres de campo coinciden con los atributos del modelo)."""
+    return [load_only(*[getattr(model, field) for field in fields if field not in relationship_fields])]
+
+# --- Configuración en memoria ---
+# La configuración casi nunca cambia, así que cada proceso guarda una copia inmutable
+# (snapshot) y solo vuelve a leer la DB cuando cambia el archivo de versión, que update_config
+# actualiza después de confirmar. Así todos los workers ven un cambio (ej. el modo feria)
+# en la siguiente petición sin consultar la tabla config en cada una.
+
+_config_state = None # (versión del archivo, snapshot)
+_config_lock = threading.Lock()
+
+def config_to_json(config):
+    return {
         'id': config.id,
         'siteName': config.siteName,
         'brandColorPrimary': config.brandColorPrimary,
@@ -146,9 +958,68 @@ def get_config():
         'feriaOnlineLink': config.feriaOnlineLink,
         'showroomAddress': config.showroomAddress,
         'isFeriaModeActive': config.isFeriaModeActive
-    })
+    }
+
+def version_file_ns(path):
+    """Versión marcada en un archivo de versión (su fecha de modificación), o None si no existe."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def bump_version_file(path):
+    """Marca una nueva versión para todos los procesos. Retorna (versión anterior, versión nueva)."""
+    previous_ns = version_file_ns(path)
+    with open(path, 'a'):
+        pass
+    new_ns = max(time.time_ns(), (previous_ns or 0) + 1) # Siempre distinta de la anterior
+    os.utime(path, ns=(new_ns, new_ns))
+    return previous_ns, new_ns
+
+def config_file_version():
+    return version_file_ns(current_app.config['CONFIG_VERSION_FILE'])
+
+def bump_config_version():
+    """Marca una nueva versión de la configuración para todos los procesos."""
+    bump_version_file(current_app.config['CONFIG_VERSION_FILE'])
+
+def load_config_snapshot():
+    """Lee la configuración de la DB (creándola con valores por defecto si no existe) y la guarda en memoria."""
+    global _config_state
+    with _config_lock:
+        version = config_file_version()
+        config = Config.query.first()
+        if not config:
+            # Si no hay configuración, crear una por defecto y guardarla. Primero se cierra la
+            # transacción de lectura para que la escritura espere su turno (busy_timeout) si otro
+            # worker está escribiendo; con id fijo, si varios la crean a la vez queda una sola fila.
+            db.session.commit()
+            db.session.execute(sqlite_insert(Config).values(id=1).on_conflict_do_nothing())
+            db.session.commit()
+            config = Config.query.first()
+        snapshot = MappingProxyType(config_to_json(config))
+        _config_state = (version, snapshot)
+        return snapshot
+
+def current_config():
+    """Snapshot inmutable de la configuración, recargado solo si otro proceso (o este) la cambió."""
+    state = _config_state
+    if state is None or state[0] != config_file_version():
+        return load_config_snapshot()
+    return state[1]
+
+def refresh_config_snapshot():
+    """Se ejecuta después del commit de update_config: la próxima lectura recarga el snapshot."""
+    global _config_state
+    bump_config_version()
+    _config_state = None
 
-@app.route('/api/config', methods=['PUT'])
+# Endpoint para la Configuración
+@bp.route('/api/config', methods=['GET'])
+def get_config():
+    return jsonify(dict(current_config()))
+
+@bp.route('/api/config', methods=['PUT'])
 def update_config():
     data = request.json
     if not data:
@@ -179,29 +1050,290 @@ def update_config():
     elif isinstance(is_feria_mode_active, str): # Si viene como string "true" o "false"
         config.isFeriaModeActive = is_feria_mode_active.lower() == 'true'
 
+    run_after_commit(refresh_config_snapshot)
+    db.session.flush()
+    publish_after_commit('config_updated', config_to_json(config))
     db.session.commit()
     return jsonify({'message': 'Configuración actualizada exitosamente!'})
 
+# --- Índice de búsqueda del catálogo (FTS5) ---
+# Se mantiene sincronizado desde las rutas de productos, tags y categorías, en la misma sesión
+# que el cambio, así se confirma (o descarta) junto con él.
+
+# Pesos de bm25 por columna (name, tags, categories): el nombre pesa más que tags y categorías
+SEARCH_RANK_EXPRESSION = f'bm25({PRODUCT_SEARCH_TABLE}, 10.0, 2.0, 2.0)'
+
+def search_document(product_id, name, tag_names, category_names):
+    return {'id': product_id, 'name': name, 'tags': ' '.join(tag_names), 'categories': ' '.join(category_names)}
+
+def index_search_documents(documents):
+    """Inserta o reemplaza documentos de búsqueda (ver search_document) en dos sentencias."""
+    if not documents:
+        return
+    db.session.execute(
+        text(f"DELETE FROM {PRODUCT_SEARCH_TABLE} WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True)),
+        {'ids': [document['id'] for document in documents]}
+    )
+    db.session.execute(
+        text(f"INSERT INTO {PRODUCT_SEARCH_TABLE} (rowid, name, tags, categories) "
+             "VALUES (:id, :name, :tags, :categories)"),
+        documents
+    )
+
+def index_products_for_search(products):
+    """Inserta o reemplaza los documentos de búsqueda de varios productos (requiere product.id)."""
+    index_search_documents([
+        search_document(product.id, product.name,
+                        [tag.name for tag in product.tags],
+                        [category.name for category in product.categories])
+        for product in products
+    ])
+
+def index_product_for_search(product):
+    index_products_for_search([product])
+
+def unindex_product_for_search(product_id):
+    db.session.execute(text(f"DELETE FROM {PRODUCT_SEARCH_TABLE} WHERE rowid = :id"), {'id': product_id})
+
+def rebuild_product_search_index():
+    """Recalcula el índice de búsqueda completo a partir de la tabla product."""
+    db.session.execute(text(f"DELETE FROM {PRODUCT_SEARCH_TABLE}"))
+    batch = []
+    for product in Product.query.order_by(Product.id).yield_per(1000):
+        batch.append(product)
+        if len(batch) >= 1000:
+            index_products_for_search(batch)
+            batch = []
+    index_products_for_search(batch)
+    db.session.commit()
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Recalcula los índices de búsqueda full-text del catálogo y de clientes."""
+    rebuild_product_search_index()
+    rebuild_client_search_index()
+    print("Índices de búsqueda del catálogo y de clientes recalculados.")
+
+def build_search_match_query(search_term, include_tags_and_categories=False):
+    """
+    Convierte lo que escribe el usuario en una consulta MATCH de FTS5: cada palabra se busca
+    como prefijo y todas deben aparecer. Retorna None si no queda ninguna palabra buscable.
+    """
+    words = re.findall(r'\w+', search_term)
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"*' for word in words)
+    if include_tags_and_categories:
+        return terms
+    return f'name : ({terms})'
+
+def search_matches_subquery(match_query):
+    """Subconsulta (product_id, rank) con los productos que coinciden con la consulta MATCH."""
+    return text(
+        f"SELECT rowid AS product_id, {SEARCH_RANK_EXPRESSION} AS rank "
+        f"FROM {PRODUCT_SEARCH_TABLE} WHERE {PRODUCT_SEARCH_TABLE} MATCH :match_query"
+    ).bindparams(match_query=match_query).columns(product_id=db.Integer, rank=db.Float).subquery('search_matches')
+
+# --- Índice de búsqueda de clientes (FTS5 trigram) ---
+# Se mantiene desde las rutas de clientes, en la misma sesión que el cambio. La búsqueda tiene dos
+# pasadas sobre el índice: prefijos exactos y, si no alcanzan, candidatos para errores de tipeo.
+# Los candidatos (pocos) se ordenan en Python por similitud de trigramas, como pg_trgm. Ante empates,
+# primero por nombre.
+
+SEARCH_WORD_START = '^'
+CLIENT_SEARCH_DEFAULT_LIMIT = 10
+CLIENT_SEARCH_MAX_LIMIT = 50
+CLIENT_SEARCH_CANDIDATES = 100 # Filas del índice que se puntúan en Python por pasada
+CLIENT_SEARCH_MIN_SIMILARITY = 0.4 # Similitud de trigramas mínima para aceptar una palabra con errores
+CLIENT_SEARCH_FUZZY_MIN_LENGTH = 5 # Palabras más cortas solo se buscan como prefijo
+CLIENT_SEARCH_EMAIL_WEIGHT = 0.8 # Una coincidencia en el email pesa menos que en nombre o apodo
+
+def normalize_search_text(value):
+    """Minúsculas y sin acentos ("Gómez" -> "gomez")."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def search_words(value):
+    return re.findall(r'[^\W_]+', normalize_search_text(value))
+
+def phone_digits(value):
+    """Dígitos de un teléfono, sin ceros iniciales ("011 4567-8900" -> "1145678900")."""
+    return re.sub(r'\D', '', value or '').lstrip('0')
+
+def client_search_document(client):
+    def marked(value):
+        return ' '.join(SEARCH_WORD_START + word for word in search_words(value))
+    return {'id': client.id, 'name': marked(client.name), 'nickname': marked(client.nickname),
+            'email': marked(client.email), 'phone': phone_digits(client.whatsapp)}
+
+def index_clients_for_search(clients):
+    """Inserta o reemplaza los documentos de búsqueda de varios clientes (requiere client.id)."""
+    if not clients:
+        return
+    db.session.execute(
+        text(f"DELETE FROM {CLIENT_SEARCH_TABLE} WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True)),
+        {'ids': [client.id for client in clients]}
+    )
+    db.session.execute(
+        text(f"INSERT INTO {CLIENT_SEARCH_TABLE} (rowid, name, nickname, email, phone) "
+             "VALUES (:id, :name, :nickname, :email, :phone)"),
+        [client_search_document(client) for client in clients]
+    )
+
+def index_client_for_search(client):
+    index_clients_for_search([client])
+
+def unindex_client_for_search(client_id):
+    db.session.execute(text(f"DELETE FROM {CLIENT_SEARCH_TABLE} WHERE rowid = :id"), {'id': client_id})
+
+def rebuild_client_search_index():
+    """Recalcula el índice de búsqueda de clientes completo a partir de la tabla client."""
+    db.session.execute(text(f"DELETE FROM {CLIENT_SEARCH_TABLE}"))
+    batch = []
+    for client in Client.query.order_by(Client.id).yield_per(1000):
+        batch.append(client)
+        if len(batch) >= 1000:
+            index_clients_for_search(batch)
+            batch = []
+    index_clients_for_search(batch)
+    db.session.commit()
+
+def parse_client_search_term(search_term):
+    """
+    Palabras de la búsqueda: [(texto, es_telefono)]. Un término con forma de teléfono ("+54 9 11 4567-8900")
+    es una sola palabra de dígitos; en otro caso las palabras solo de dígitos también se buscan en el teléfono.
+    """
+    if re.fullmatch(r'[\d\s+\-().]+', search_term) and phone_digits(search_term):
+        return [(phone_digits(search_term), True)]
+    return [(word, word.isdigit()) for word in search_words(search_term)]
+
+@functools.lru_cache(maxsize=65536) # Nombres, apellidos y dominios se repiten mucho entre clientes
+def trigrams(value):
+    padded = f'  {value} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def trigram_similarity(a, b):
+    """Proporción de trigramas compartidos (0 a 1), como similarity() de pg_trgm."""
+    a_trigrams, b_trigrams = trigrams(a), trigrams(b)
+    return len(a_trigrams & b_trigrams) / len(a_trigrams | b_trigrams)
+
+def score_search_word(word, is_phone, document):
+    """Puntaje (0 a 1) de la mejor coincidencia de una palabra de la búsqueda en un documento del índice."""
+    if is_phone:
+        if word in document['phone']:
+            return 1.0 if document['phone'].endswith(word) else 0.9
+        return 0.0
+    best = 0.0
+    for field, weight in (('name', 1.0), ('nickname', 1.0), ('email', CLIENT_SEARCH_EMAIL_WEIGHT)):
+        for token in document[field].split():
+            token = token[len(SEARCH_WORD_START):]
+            if token == word:
+                score = 1.0
+            elif token.startswith(word):
+                score = 0.8 + 0.15 * len(word) / len(token) # Prefijos más completos primero
+            elif len(word) >= CLIENT_SEARCH_FUZZY_MIN_LENGTH:
+                # Con errores: la palabra completa o lo que se lleva escrito de ella
+                similarity = trigram_similarity(word, token)
+                if len(token) > len(word):
+                    similarity = max(similarity, trigram_similarity(word, token[:len(word)]))
+                score = 0.7 * similarity if similarity >= CLIENT_SEARCH_MIN_SIMILARITY else 0.0
+            else:
+                score = 0.0
+            best = max(best, score * weight)
+    return best
+
+def client_search_candidates(match_query, by_relevance=False):
+    """
+    Documentos del índice que coinciden con la consulta MATCH: los clientes más nuevos primero o, con
+    `by_relevance`, los que más términos comparten con la búsqueda (bm25). El orden por rowid lo recorre
+    FTS5 sin ordenar; bm25 obliga a puntuar todas las coincidencias (miles con un nombre común), por eso
+    solo se usa para los candidatos con errores, donde cuántas mitades coinciden sí importa.
+    """
+    order = 'rank' if by_relevance else 'rowid DESC'
+    rows = db.session.execute(
+        text(f"SELECT rowid AS id, name, nickname, email, phone FROM {CLIENT_SEARCH_TABLE} "
+             f"WHERE {CLIENT_SEARCH_TABLE} MATCH :match_query ORDER BY {order} LIMIT :limit"),
+        {'match_query': match_query, 'limit': CLIENT_SEARCH_CANDIDATES}
+    )
+    return [row._asdict() for row in rows]
+
+def search_client_ids(search_term, limit):
+    """
+    IDs de los clientes que mejor coinciden con `search_term` (nombre, apodo, email o WhatsApp), en orden.
+    Cada palabra se busca como prefijo ("gon" -> "González"); los dígitos, en cualquier parte del WhatsApp.
+    Si faltan resultados, las palabras de 5 o más letras se buscan también con errores de tipeo
+    ("gonsalez" -> "González"): un error deja intacta al menos una de sus mitades, que se busca en el índice.
+    """
+    words = parse_client_search_term(search_term)
+    # Solo las palabras con 3 o más caracteres (contando la marca de comienzo) pueden usar el índice
+    prefix_terms = [f'phone : "{word}"' if is_phone else f'{{name nickname email}} : "{SEARCH_WORD_START}{word}"'
+                    for word, is_phone in words if len(word) + (0 if is_phone else len(SEARCH_WORD_START)) >= 3]
+    if not prefix_terms:
+        return []
+
+    scores = {}
+    def add_candidates(match_query, by_relevance=False):
+        for document in client_search_candidates(match_query, by_relevance):
+            if document['id'] in scores:
+                continue
+            word_scores = [score_search_word(word, is_phone, document) for word, is_phone in words]
+            if all(word_scores): # Todas las palabras tienen que coincidir
+                scores[document['id']] = (sum(word_scores) / len(word_scores), document['name'])
+
+    add_candidates(' AND '.join(prefix_terms))
+    if len(scores) < limit:
+        halves = []
+        for word, is_phone in words:
+            marked_word = SEARCH_WORD_START + word
+            if not is_phone and len(word) >= CLIENT_SEARCH_FUZZY_MIN_LENGTH:
+                middle = len(marked_word) // 2
+                halves += [f'"{marked_word[:middle]}"', f'"{marked_word[middle:]}"']
+        if halves:
+            add_candidates(f'{{name nickname email}} : ({" OR ".join(halves)})', by_relevance=True)
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1][0], item[1][1], item[0]))
+    return [client_id for client_id, _ in ranked[:limit]]
+
 # --- API Endpoints para Productos ---
 
-def product_to_json(product):
-    """Convierte un objeto Product a un diccionario JSON serializable."""
-    return {
-        'id': product.id,
-        'name': product.name,
-        'priceRevista': product.priceRevista,
-        'priceShowroom': product.priceShowroom,
-        'priceFeria': product.priceFeria,
-        'stockActual': product.stockActual,
-        'stockCritico': product.stockCritico,
-        'imageUrl': product.imageUrl,
-        'catalogImageUrl': product.catalogImageUrl,
-        'catalogPrice': product.catalogPrice,
-        'tags': [tag_to_json(tag) for tag in product.tags],
-        'categories': [category_to_json(category) for category in product.categories] # Asumiendo que existirá category_to_json
-    }
+PRODUCT_JSON_FIELDS = {
+    'id': lambda product: product.id,
+    'name': lambda product: product.name,
+    'priceRevista': lambda product: product.priceRevista,
+    'priceShowroom': lambda product: product.priceShowroom,
+    'priceFeria': lambda product: product.priceFeria,
+    'stockActual': lambda product: product.stockActual,
+    'stockCritico': lambda product: product.stockCritico,
+    'imageUrl': lambda product: product.imageUrl,
+    'catalogImageUrl': lambda product: product.catalogImageUrl,
+    'catalogPrice': lambda product: product.catalogPrice,
+    'externalCode': lambda product: product.externalCode,
+    'tags': lambda product: [tag_to_json(tag) for tag in product.tags],
+    'categories': lambda product: [category_to_json(category) for category in product.categories] # Asumiendo que existirá category_to_json
+}
+
+def product_to_json(product, fields=None):
+    """Convierte un objeto Product a un diccionario JSON serializable (solo `fields`, si se indican)."""
+    return serialize_fields(product, PRODUCT_JSON_FIELDS, fields)
+
+def product_projection_options(fields):
+    """Carga solo las columnas y relaciones (tags, categories) pedidas en `fields`."""
+    if fields is None:
+        return []
+    options = column_projection_options(Product, fields, ('tags', 'categories'))
+    for relationship in (Product.tags, Product.categories):
+        if relationship.key not in fields:
+            options.append(lazyload(relationship))
+    return options
+
+def publish_stock_after_commit(product):
+    """Publica en el feed de cambios el stock del producto, si la transacción se confirma."""
+    db.session.flush() # Asigna el id de un producto nuevo
+    publish_after_commit('stock_changed', {
+        'products': [{'id': product.id, 'stockActual': product.stockActual}]
+    })
 
-@app.route('/api/products', methods=['POST'])
+@bp.route('/api/products', methods=['POST'])
 def create_product():
     data = request.json
     if not data:
@@ -213,6 +1345,10 @@ def create_product():
     if not name_data or not name_data.strip() or price_showroom_data is None: # priceShowroom puede ser 0, así que None es mejor check
         return jsonify({'error': 'Datos incompletos. Nombre y Precio Showroom son requeridos.'}), 400
 
+    external_code = (data.get('externalCode') or '').strip() or None
+    if external_code and Product.query.filter_by(externalCode=external_code).first():
+        return jsonify({'error': 'Ya existe un producto con este código.'}), 409
+
     new_product = Product()
     new_product.name = name_data.strip()
     new_product.priceRevista = data.get('priceRevista')
@@ -223,6 +1359,7 @@ def create_product():
     new_product.imageUrl = data.get('imageUrl')
     new_product.catalogImageUrl = data.get('catalogImageUrl')
     new_product.catalogPrice = data.get('catalogPrice')
+    new_product.externalCode = external_code
 
     tag_ids = data.get('tag_ids', [])
     if tag_ids:
@@ -239,20 +1376,39 @@ def create_product():
                 new_product.categories.append(category)
 
     db.session.add(new_product)
+    db.session.flush() # Para obtener el id antes de indexar
+    index_product_for_search(new_product)
+    update_product_facets_after_commit(new_product) # Antes de invalidar la caché (que se recalcula con las facetas)
+    update_catalog_product_after_commit(new_product) # También invalida la caché del catálogo
+    publish_stock_after_commit(new_product)
     db.session.commit()
     return jsonify(product_to_json(new_product)), 201
 
-@app.route('/api/products', methods=['GET'])
+@bp.route('/api/products', methods=['GET'])
 def get_products():
-    products = Product.query.all()
-    return jsonify([product_to_json(product) for product in products])
+    try:
+        fields = parse_fields_param(list(PRODUCT_JSON_FIELDS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = Product.query.options(*product_projection_options(fields))
+
+    # Paginado por cursor (name,id). El listado completo solo con ?all=true explícito.
+    if wants_all_rows():
+        products = query.order_by(Product.name, Product.id).all()
+        return jsonify([product_to_json(product, fields) for product in products])
 
-@app.route('/api/products/<int:product_id>', methods=['GET'])
+    try:
+        page = paginate_keyset(query, Product.name, Product.id, lambda product: product_to_json(product, fields))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@bp.route('/api/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
     product = Product.query.get_or_404(product_id)
     return jsonify(product_to_json(product))
 
-@app.route('/api/products/<int:product_id>', methods=['PUT'])
+@bp.route('/api/products/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
     product = Product.query.get_or_404(product_id)
     data = request.json
@@ -268,6 +1424,11 @@ def update_product(product_id):
     product.imageUrl = data.get('imageUrl', product.imageUrl)
     product.catalogImageUrl = data.get('catalogImageUrl', product.catalogImageUrl)
     product.catalogPrice = data.get('catalogPrice', product.catalogPrice)
+    if 'externalCode' in data:
+        external_code = (data.get('externalCode') or '').strip() or None
+        if external_code and Product.query.filter(Product.id != product_id, Product.externalCode == external_code).first():
+            return jsonify({'error': 'Ya existe otro producto con este código.'}), 409
+        product.externalCode = external_code
 
     # Lógica para actualizar tags
     tag_ids = data.get('tag_ids') # Si es None, no se actualizan. Si es [], se borran todos.
@@ -289,90 +1450,813 @@ def update_product(product_id):
                 if category:
                     product.categories.append(category)
 
+    index_product_for_search(product)
+    update_product_facets_after_commit(product) # Antes de invalidar la caché (que se recalcula con las facetas)
+    update_catalog_product_after_commit(product) # También invalida la caché del catálogo
+    publish_stock_after_commit(product)
     db.session.commit()
     return jsonify(product_to_json(product))
 
-@app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@bp.route('/api/products/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
+    unindex_product_for_search(product.id)
+    run_after_commit(lambda: facet_index.remove_product(product_id))
+    run_after_commit(lambda: catalog_snapshot.remove_product(product_id)) # También invalida la caché del catálogo
+    notify_catalog_change_after_commit()
+    publish_after_commit('product_deleted', {'id': product.id})
     db.session.delete(product)
     db.session.commit()
     return jsonify({'message': 'Producto eliminado exitosamente.'})
 
+# --- Importación masiva de productos ---
+# Carga la revista completa en una sola petición: el archivo (CSV o NDJSON) se lee como stream,
+# fila por fila, y se procesa en lotes. Cada lote resuelve productos existentes, tags y categorías
+# con una consulta IN por tabla y se confirma en su propia transacción.
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FLOAT_FIELDS = ('priceRevista', 'priceShowroom', 'priceFeria', 'catalogPrice')
+IMPORT_INT_FIELDS = ('stockActual', 'stockCritico')
+IMPORT_TEXT_FIELDS = ('imageUrl', 'catalogImageUrl')
+
+def iter_import_rows(stream, import_format):
+    """Genera diccionarios (uno por fila) leyendo el archivo de a poco, sin cargarlo entero en memoria."""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if import_format == 'csv':
+        yield from csv.DictReader(text_stream)
+    else:
+        for line in text_stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # Una línea inválida no corta la importación: se reporta como error de esa fila
+            yield row if isinstance(row, dict) else {'__invalid__': 'La línea no es un objeto JSON válido.'}
+
+def parse_import_id_list(value):
+    """Lista de IDs desde JSON ([1, 2]) o CSV ("1|2" o "1;2"). None si la columna no viene."""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [int(v) for v in value]
+    return [int(v) for v in re.split(r'[|;,]', str(value)) if v.strip()]
+
+def parse_import_row(row):
+    """Normaliza una fila importada. Retorna un dict solo con los campos presentes; lanza ValueError si es inválida."""
+    if '__invalid__' in row:
+        raise ValueError(row['__invalid__'])
+
+    def present(key):
+        value = row.get(key)
+        return value is not None and not (isinstance(value, str) and value.strip() == '')
+
+    parsed = {}
+    if present('name'):
+        parsed['name'] = str(row['name']).strip()
+    if present('externalCode'):
+        parsed['externalCode'] = str(row['externalCode']).strip()
+    if 'name' not in parsed and 'externalCode' not in parsed:
+        raise ValueError('Se requiere name o externalCode.')
+
+    for field in IMPORT_FLOAT_FIELDS:
+        if present(field):
+            try:
+                parsed[field] = float(row[field])
+            except (TypeError, ValueError):
+                raise ValueError(f'{field} debe ser un número.')
+    for field in IMPORT_INT_FIELDS:
+        if present(field):
+            try:
+                parsed[field] = int(row[field])
+            except (TypeError, ValueError):
+                raise ValueError(f'{field} debe ser un número entero.')
+    for field in IMPORT_TEXT_FIELDS:
+        if present(field):
+            parsed[field] = str(row[field]).strip()
+
+    for field in ('tag_ids', 'category_ids'):
+        # En JSON una lista vacía borra las asociaciones; en CSV una celda vacía significa "sin cambios"
+        if isinstance(row.get(field), list) or present(field):
+            try:
+                parsed[field] = parse_import_id_list(row[field])
+            except (TypeError, ValueError):
+                raise ValueError(f'{field} debe ser una lista de números enteros.')
+    return parsed
+
+def related_names_by_product(table, related_model, column, product_ids):
+    """{product_id: [nombres]} de tags o categorías actuales de varios productos, en una consulta."""
+    names = {}
+    if not product_ids:
+        return names
+    rows = db.session.query(table.c.product_id, related_model.name) \
+        .join(related_model, related_model.id == getattr(table.c, column)) \
+        .filter(table.c.product_id.in_(product_ids)).all()
+    for product_id, name in rows:
+        names.setdefault(product_id, []).append(name)
+    return names
+
+def import_products_batch(batch, summary):
+    """Aplica (upsert) un lote de filas ya parseadas [(número de fila, datos)] en una transacción."""
+    codes = {data['externalCode'] for _, data in batch if 'externalCode' in data}
+    names = {data['name'] for _, data in batch if 'externalCode' not in data}
+    tag_ids = {tag_id for _, data in batch for tag_id in data.get('tag_ids', [])}
+    category_ids = {cat_id for _, data in batch for cat_id in data.get('category_ids', [])}
+
+    # Una consulta IN por tabla para todo el lote (solo las columnas necesarias, sin cargar objetos)
+    existing = {} # clave ('code', código) o ('name', nombre) -> {'id', 'name', 'externalCode'}
+    if codes:
+        for product_id, name, code in db.session.query(Product.id, Product.name, Product.externalCode) \
+                .filter(Product.externalCode.in_(codes)):
+            existing[('code', code)] = {'id': product_id, 'name': name, 'externalCode': code}
+    if names:
+        for product_id, name, code in db.session.query(Product.id, Product.name, Product.externalCode) \
+                .filter(Product.name.in_(names)).order_by(Product.id.desc()):
+            existing[('name', name)] = {'id': product_id, 'name': name, 'externalCode': code} # Si hay nombres repetidos gana el primero
+    tags = dict(db.session.query(Tag.id, Tag.name).filter(Tag.id.in_(tag_ids)).all()) if tag_ids else {}
+    categories = dict(db.session.query(Category.id, Category.name).filter(Category.id.in_(category_ids)).all()) if category_ids else {}
+
+    # Se combinan las filas por producto (varias filas del mismo código/nombre actualizan el mismo producto)
+    pending = {}
+    applied_rows = []
+    created = updated = 0
+    for row_number, data in batch:
+        key = ('code', data['externalCode']) if 'externalCode' in data else ('name', data['name'])
+        product = pending.get(key)
+        if product is None:
+            product = existing.get(key)
+            if product is None:
+                if 'name' not in data or 'priceShowroom' not in data:
+                    summary['errors'].append({'row': row_number, 'error': 'Datos incompletos. Nombre y Precio Showroom son requeridos para productos nuevos.'})
+                    continue
+                product = {'id': None, 'values': {}}
+                created += 1
+            else:
+                product = {'id': product['id'], 'name': product['name'], 'values': {}}
+                updated += 1
+            pending[key] = product
+        else:
+            updated += 1
+
+        for field, value in data.items():
+            if field == 'tag_ids':
+                product['tag_ids'] = [tag_id for tag_id in dict.fromkeys(value) if tag_id in tags]
+            elif field == 'category_ids':
+                product['category_ids'] = [cat_id for cat_id in dict.fromkeys(value) if cat_id in categories]
+            else:
+                product['values'][field] = value
+        applied_rows.append(row_number)
+
+    new_products = [p for p in pending.values() if p['id'] is None]
+    existing_products = [p for p in pending.values() if p['id'] is not None]
+
+    try:
+        # INSERT y UPDATE por lote (executemany) en vez de objeto por objeto
+        if new_products:
+            new_rows = [{
+                'name': None, 'externalCode': None, 'priceRevista': None, 'priceShowroom': None,
+                'priceFeria': None, 'stockActual': 0, 'stockCritico': 1, 'imageUrl': None,
+                'catalogImageUrl': None, 'catalogPrice': None, **p['values']
+            } for p in new_products]
+            new_ids = db.session.scalars(
+                db.insert(Product).returning(Product.id, sort_by_parameter_order=True), new_rows
+            ).all()
+            for p, new_id in zip(new_products, new_ids):
+                p['id'] = new_id
+        update_rows = [{'id': p['id'], **p['values']} for p in existing_products if p['values']]
+        if update_rows:
+            db.session.execute(db.update(Product), update_rows)
+
+        # Las asociaciones se reemplazan con sentencias por lote sobre las tablas intermedias
+        for field, table, column in (('tag_ids', product_tags_table, 'tag_id'),
+                                     ('category_ids', product_categories_table, 'category_id')):
+            assigned = [p for p in pending.values() if field in p]
+            if not assigned:
+                continue
+            db.session.execute(table.delete().where(table.c.product_id.in_([p['id'] for p in assigned])))
+            rows = [{'product_id': p['id'], column: related_id} for p in assigned for related_id in p[field]]
+            if rows:
+                db.session.execute(table.insert(), rows)
+
+        existing_ids = [p['id'] for p in existing_products]
+        current_tags = related_names_by_product(product_tags_table, Tag, 'tag_id', existing_ids)
+        current_categories = related_names_by_product(product_categories_table, Category, 'category_id', existing_ids)
+        index_search_documents([
+            search_document(
+                p['id'], p['values'].get('name', p.get('name')),
+                [tags[i] for i in p['tag_ids']] if 'tag_ids' in p else current_tags.get(p['id'], []),
+                [categories[i] for i in p['category_ids']] if 'category_ids' in p else current_categories.get(p['id'], [])
+            )
+            for p in pending.values()
+        ])
+        # Índices en memoria del catálogo: se reconstruyen en la próxima lectura
+        run_after_commit(facet_index.invalidate)
+        run_after_commit(catalog_snapshot.invalidate) # También invalida la caché del catálogo
+        notify_catalog_change_after_commit()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        message = f'Error al guardar el lote: {str(e)}'
+        summary['errors'].extend({'row': row_number, 'error': message} for row_number in applied_rows)
+        return
+    summary['created'] += created
+    summary['updated'] += updated
+
+@bp.route('/api/products/import', methods=['POST'])
+def import_products():
+    # Formato: ?format=csv|ndjson, o según el Content-Type / nombre del archivo subido
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        content_type = upload.mimetype or ''
+        filename = upload.filename or ''
+    else:
+        stream = request.stream
+        content_type = request.mimetype or ''
+        filename = ''
+
+    import_format = request.args.get('format')
+    if not import_format:
+        if 'csv' in content_type or filename.lower().endswith('.csv'):
+            import_format = 'csv'
+        elif 'ndjson' in content_type or 'jsonl' in content_type or filename.lower().endswith(('.ndjson', '.jsonl')):
+            import_format = 'ndjson'
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': "Formato no soportado. Usar ?format=csv o ?format=ndjson."}), 400
+
+    summary = {'processed': 0, 'created': 0, 'updated': 0, 'errors': []}
+    batch = []
+    try:
+        for row_number, row in enumerate(iter_import_rows(stream, import_format), start=1):
+            summary['processed'] += 1
+            try:
+                batch.append((row_number, parse_import_row(row)))
+            except ValueError as e:
+                summary['errors'].append({'row': row_number, 'error': str(e)})
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                import_products_batch(batch, summary)
+                batch = []
+        if batch:
+            import_products_batch(batch, summary)
+    except (UnicodeDecodeError, csv.Error) as e:
+        summary['errors'].append({'row': summary['processed'] + 1, 'error': f'No se pudo leer el archivo: {str(e)}'})
+
+    # Cada lote ya se confirmó: un solo evento resumido en lugar de uno por producto
+    if summary['created'] or summary['updated']:
+        publish_change('products_imported', {'created': summary['created'], 'updated': summary['updated']},
+                       change_feed_relay())
+    return jsonify(summary)
+
+# --- Caché de respuestas del catálogo ---
+# El catálogo público es la ruta más consultada y solo cambia con escrituras de productos (incluido
+# el stock que descuentan las ventas), tags o categorías. Se guardan las respuestas ya serializadas,
+# con clave (búsqueda, category_ids, tag_ids, modo feria), en una LRU acotada. Cada entrada recuerda
+# qué productos incluye: una venta solo descarta las respuestas que muestran los productos vendidos.
+
+# Respuestas con más productos que esto (o el catálogo completo) se tratan como si incluyeran todos:
+# no se guarda el conjunto de IDs y cualquier cambio de stock las descarta.
+CATALOG_CACHE_MAX_TRACKED_PRODUCTS = 2000
+
+class CatalogCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict() # clave -> (body, etag)
+        self._product_ids = {} # clave -> frozenset de IDs de productos de la respuesta (None = todos)
+        self._lock = threading.Lock()
+        # Se incrementa con cada invalidación. Una respuesta calculada antes de una invalidación
+        # no se guarda (podría haber leído datos anteriores al commit que invalidó).
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, generation, product_ids=None):
+        with self._lock:
+            if generation != self.generation:
+                return None
+            entry = (body, hashlib.sha1(body).hexdigest())
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._product_ids[key] = product_ids
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                del self._product_ids[evicted_key]
+            return entry
+
+    def invalidate(self, predicate=None):
+        """Descarta todas las entradas, o solo aquellas cuya clave cumple `predicate`."""
+        with self._lock:
+            self.generation += 1
+            if predicate is None:
+                self._entries.clear()
+                self._product_ids.clear()
+            else:
+                for key in [k for k in self._entries if predicate(k)]:
+                    del self._entries[key]
+                    del self._product_ids[key]
+
+    def invalidate_products(self, product_ids):
+        """Descarta solo las respuestas que incluyen alguno de `product_ids` (ej. cambió su stock)."""
+        product_ids = set(product_ids)
+        self.invalidate(lambda key: self._product_ids[key] is None or not product_ids.isdisjoint(self._product_ids[key]))
+
+catalog_cache = CatalogCache(DEFAULT_CONFIG['CATALOG_CACHE_SIZE']) # create_app() aplica CATALOG_CACHE_SIZE
+
+def catalog_cache_key(match_query, category_ids, tag_ids, is_feria_active, category_mode, tag_mode, with_facets):
+    return (match_query.lower() if match_query else None,
+            tuple(sorted(set(category_ids))), tuple(sorted(set(tag_ids))), is_feria_active,
+            category_mode, tag_mode, with_facets)
+
+def invalidate_catalog_searches_after_commit():
+    """Invalida solo las búsquedas que incluyen nombres de tags/categorías (ej. se renombró un tag)."""
+    run_after_commit(lambda: catalog_cache.invalidate(
+        lambda key: key[0] is not None and not key[0].startswith('name :')))
+
+def invalidate_catalog_facets_after_commit():
+    """Invalida solo las respuestas con facetas (ej. se creó, renombró o eliminó un tag o una categoría)."""
+    run_after_commit(lambda: catalog_cache.invalidate(lambda key: key[6]))
+    notify_catalog_change_after_commit()
+
+def catalog_response(entry):
+    """Respuesta JSON con ETag a partir de una entrada de la caché; responde 304 si el navegador ya la tiene."""
+    body, etag = entry
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # El navegador puede guardarla pero debe revalidar
+    return response.make_conditional(request)
+
+# --- Índice de facetas del catálogo (bitsets en memoria) ---
+# Para cada categoría y tag se guarda el conjunto de IDs de sus productos como un bitset: un int de
+# Python donde el bit i indica el producto con id i. Los filtros se resuelven con intersecciones (&)
+# y uniones (|) y los conteos con bit_count(), sin JOINs ni filas duplicadas. Las rutas de productos,
+# tags y categorías lo actualizan después de cada commit; la importación masiva lo invalida y se
+# reconstruye (tres consultas) en la siguiente lectura.
+
+CATALOG_FILTER_MODES = ('any', 'all') # any = unión (OR), all = intersección (AND)
+
+class FacetIndexState:
+    __slots__ = ('products', 'categories', 'tags')
+
+    def __init__(self, products, categories, tags):
+        self.products = products # bitset de todos los productos
+        self.categories = categories # id -> (nombre, bitset)
+        self.tags = tags # id -> (nombre, bitset)
+
+class FacetIndex:
+    """
+    Estado inmutable reemplazado en cada cambio (copy-on-write): las lecturas no toman locks.
+    Como en la caché del catálogo, un contador de generación evita instalar un estado reconstruido
+    con datos anteriores a un cambio confirmado mientras se leía la base de datos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._generation = 0
+
+    def current(self):
+        state = self._state
+        return state if state is not None else self._rebuild()
+
+    def _rebuild(self):
+        generation = self._generation
+        categories = {c.id: [c.name, 0] for c in db.session.query(Category.id, Category.name)}
+        tags = {t.id: [t.name, 0] for t in db.session.query(Tag.id, Tag.name)}
+        products = 0
+        for (product_id,) in db.session.query(Product.id):
+            products |= 1 << product_id
+        for facets, table, column in ((categories, product_categories_table, 'category_id'),
+                                      (tags, product_tags_table, 'tag_id')):
+            for product_id, facet_id in db.session.execute(db.select(table.c.product_id, getattr(table.c, column))):
+                if facet_id in facets:
+                    facets[facet_id][1] |= 1 << product_id
+        state = FacetIndexState(products, {k: tuple(v) for k, v in categories.items()}, {k: tuple(v) for k, v in tags.items()})
+        with self._lock:
+            if generation == self._generation:
+                self._state = state
+        return state
+
+    def _update(self, change):
+        """Aplica `change(products, categories, tags)` sobre copias y publica el nuevo estado."""
+        with self._lock:
+            self._generation += 1
+            state = self._state
+            if state is None: # Se reconstruirá completo en la próxima lectura
+                return
+            categories, tags = dict(state.categories), dict(state.tags)
+            products = change(state.products, categories, tags)
+            self._state = FacetIndexState(products, categories, tags)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._state = None
+
+    def set_product(self, product_id, category_ids, tag_ids):
+        bit = 1 << product_id
+        def change(products, categories, tags):
+            for facets, selected in ((categories, set(category_ids)), (tags, set(tag_ids))):
+                for facet_id, (name, bits) in facets.items():
+                    facets[facet_id] = (name, bits | bit if facet_id in selected else bits & ~bit)
+            return products | bit
+        self._update(change)
+
+    def remove_product(self, product_id):
+        bit = 1 << product_id
+        def change(products, categories, tags):
+            for facets in (categories, tags):
+                for facet_id, (name, bits) in facets.items():
+                    if bits & bit:
+                        facets[facet_id] = (name, bits & ~bit)
+            return products & ~bit
+        self._update(change)
+
+    def set_facet(self, kind, facet_id, name):
+        """Crea o renombra una categoría (kind='categories') o un tag (kind='tags')."""
+        def change(products, categories, tags):
+            facets = categories if kind == 'categories' else tags
+            facets[facet_id] = (name, facets[facet_id][1] if facet_id in facets else 0)
+            return products
+        self._update(change)
+
+    def remove_facet(self, kind, facet_id):
+        def change(products, categories, tags):
+            (categories if kind == 'categories' else tags).pop(facet_id, None)
+            return products
+        self._update(change)
+
+facet_index = FacetIndex()
+
+def update_product_facets_after_commit(product):
+    category_ids = [c.id for c in product.categories]
+    tag_ids = [t.id for t in product.tags]
+    db.session.flush() # Asigna el id de un producto nuevo
+    product_id = product.id
+    run_after_commit(lambda: facet_index.set_product(product_id, category_ids, tag_ids))
+
+def combine_facet_bitsets(facets, facet_ids, mode, universe):
+    """Bitset de los productos que tienen alguna (any) o todas (all) las facetas pedidas."""
+    if not facet_ids:
+        return universe
+    bitsets = [facets[facet_id][1] if facet_id in facets else 0 for facet_id in set(facet_ids)]
+    combined = 0 if mode == 'any' else universe
+    for bits in bitsets:
+        combined = combined | bits if mode == 'any' else combined & bits
+    return combined
+
+def bitset_to_ids(bits):
+    """IDs (bits en 1) de un bitset, en orden creciente."""
+    binary = bin(bits)[:1:-1] # Dígitos del menos al más significativo
+    ids = []
+    position = binary.find('1')
+    while position != -1:
+        ids.append(position)
+        position = binary.find('1', position + 1)
+    return ids
+
+def facet_counts(facets, base):
+    """[{id, name, count}] ordenado por nombre: productos de `base` que tienen cada faceta."""
+    return sorted(
+        ({'id': facet_id, 'name': name, 'count': (bits & base).bit_count()} for facet_id, (name, bits) in facets.items()),
+        key=lambda facet: facet['name']
+    )
+
+# --- Snapshot del catálogo en memoria ---
+# El catálogo público se arma desde una copia compacta de los productos en memoria (un registro con
+# __slots__ por producto, ordenados por nombre), sin consultar SQLite: en una feria, el tráfico del
+# catálogo no compite con las ventas por la base de datos. Cada cambio confirmado de un producto
+# arma un snapshot nuevo y lo reemplaza de una vez (copy-on-write): las lecturas nunca ven un
+# snapshot a medio actualizar y no toman locks. El stock es la excepción: las ventas lo cambian en
+# el registro mismo (una asignación por producto, sin copiar el snapshot), porque no altera el orden
+# ni qué productos hay; una lectura concurrente ve el valor anterior o el nuevo. La importación
+# masiva lo invalida y se vuelve a armar (una consulta) en la siguiente lectura. El precio a mostrar
+# se calcula en cada lectura con el modo feria de la configuración en memoria, así cambiar la
+# configuración no requiere reconstruirlo.
+
+class CatalogProduct:
+    __slots__ = ('id', 'name', 'price_showroom', 'price_feria', 'stock', 'stock_critico', 'image_url')
+
+    def __init__(self, id, name, price_showroom, price_feria, stock, stock_critico, image_url):
+        self.id = id
+        self.name = name
+        self.price_showroom = price_showroom
+        self.price_feria = price_feria
+        self.stock = stock
+        self.stock_critico = stock_critico
+        self.image_url = image_url
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(product.id, product.name, product.priceShowroom, product.priceFeria, product.stockActual,
+                   product.stockCritico, product.catalogImageUrl if product.catalogImageUrl else product.imageUrl) # Usar imagen de catálogo si existe
+
+    @property
+    def sort_key(self):
+        return (self.name, self.id) # Mismo orden que ORDER BY name (binario), desempate por id
+
+class CatalogSnapshot:
+    __slots__ = ('records', 'by_id', 'position')
+
+    def __init__(self, records, by_id=None, position=None):
+        self.records = records # Ordenados por nombre
+        self.by_id = by_id if by_id is not None else {record.id: record for record in records}
+        self.position = position if position is not None else {record.id: i for i, record in enumerate(records)}
+
+    def sorted_by_name(self, product_ids):
+        """Registros de `product_ids` en el orden del catálogo, sin recorrer todo el snapshot."""
+        position = self.position
+        positions = sorted(position[product_id] for product_id in product_ids if product_id in position)
+        return [self.records[i] for i in positions]
+
+class CatalogSnapshotStore:
+    """Guarda el snapshot vigente. Como FacetIndex, usa un contador de generación para no instalar un
+    snapshot armado con datos anteriores a un cambio confirmado mientras se leía la base de datos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+
+    def current(self):
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None else self._rebuild()
+
+    def _rebuild(self):
+        generation = self._generation
+        rows = db.session.execute(db.select(
+            Product.id, Product.name, Product.priceShowroom, Product.priceFeria, Product.stockActual,
+            Product.stockCritico, func.coalesce(func.nullif(Product.catalogImageUrl, ''), Product.imageUrl)
+        ).order_by(Product.name, Product.id))
+        snapshot = CatalogSnapshot([CatalogProduct(*row) for row in rows])
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def _swap(self, change):
+        """Arma el snapshot nuevo con `change(snapshot)`, lo publica e invalida las respuestas en caché."""
+        with self._lock:
+            self._generation += 1
+            if self._snapshot is not None:
+                self._snapshot = change(self._snapshot)
+        # Después del reemplazo: una respuesta calculada con el snapshot anterior no queda en la caché
+        catalog_cache.invalidate()
+
+    def invalidate(self):
+        self._swap(lambda snapshot: None)
+
+    def update_stock(self, new_stock):
+        """
+        Aplica {product_id: stockActual} (ej. después de una venta) en los registros del snapshot vigente,
+        sin copiarlo, y descarta solo las respuestas en caché que incluyen esos productos.
+        """
+        with self._lock:
+            self._generation += 1 # Un snapshot que se estaba armando puede tener el stock anterior
+            snapshot = self._snapshot
+            if snapshot is not None:
+                for product_id, stock in new_stock.items():
+                    record = snapshot.by_id.get(product_id)
+                    if record is not None:
+                        record.stock = stock
+        catalog_cache.invalidate_products(new_stock)
+
+    def upsert_product(self, record):
+        def change(snapshot):
+            records = list(snapshot.records)
+            if record.id in snapshot.position:
+                del records[snapshot.position[record.id]]
+            records.insert(bisect.bisect_left(records, record.sort_key, key=lambda r: r.sort_key), record)
+            by_id = dict(snapshot.by_id)
+            by_id[record.id] = record
+            return CatalogSnapshot(records, by_id)
+        self._swap(change)
+
+    def remove_product(self, product_id):
+        def change(snapshot):
+            if product_id not in snapshot.position:
+                return snapshot
+            records = list(snapshot.records)
+            del records[snapshot.position[product_id]]
+            by_id = dict(snapshot.by_id)
+            del by_id[product_id]
+            return CatalogSnapshot(records, by_id)
+        self._swap(change)
+
+catalog_snapshot = CatalogSnapshotStore()
+
+def update_catalog_product_after_commit(product):
+    db.session.flush() # Asigna el id de un producto nuevo
+    record = CatalogProduct.from_product(product) # Valores leídos antes del commit
+    run_after_commit(lambda: catalog_snapshot.upsert_product(record))
+    notify_catalog_change_after_commit()
+
+def update_catalog_stock_after_commit(new_stock):
+    """
+    Aplica el stock nuevo al catálogo de este proceso al confirmar. Los demás workers lo aplican al leer
+    el evento 'stock_changed' que las rutas de ventas publican en el feed compartido (ver
+    sync_catalog_stock_with_other_processes); sin feed compartido, se les avisa con catalog.version.
+    """
+    if new_stock:
+        new_stock = dict(new_stock)
+        run_after_commit(lambda: catalog_snapshot.update_stock(new_stock)) # También invalida esas respuestas en caché
+        if change_feed_relay() is None:
+            notify_catalog_change_after_commit()
+
+# --- Sincronización del catálogo entre procesos ---
+# El snapshot, el índice de facetas y la caché del catálogo son por proceso: cada worker aplica
+# en memoria los cambios que él mismo confirma. Para enterarse de los cambios de otros workers:
+# - Productos, tags, categorías e importaciones usan un archivo de versión, igual que la
+#   configuración: después de cada commit se actualiza su fecha de modificación, y antes de leer el
+#   catálogo cada proceso la compara (un stat) con la última que vio. Si otro proceso la cambió, se
+#   descartan las estructuras en memoria y la siguiente lectura las reconstruye desde la DB.
+# - El stock que cambian las ventas (lo más frecuente en una feria) no reconstruye nada: cada worker
+#   lee del feed compartido (CHANGE_FEED_FILE) los eventos 'stock_changed' de los demás y actualiza
+#   solo esos productos. Las líneas del feed se escriben después de cada commit y pueden quedar en
+#   otro orden que los commits, así que el stock no se toma del evento: se lee de la DB por id (una
+#   consulta por clave primaria para todos los productos que cambiaron desde la lectura anterior).
+
+_catalog_seen_version = None # Última versión del archivo que este proceso ya tiene en memoria
+_catalog_version_lock = threading.Lock()
+
+def sync_catalog_with_other_processes():
+    global _catalog_seen_version
+    sync_catalog_stock_with_other_processes()
+    version = version_file_ns(current_app.config['CATALOG_VERSION_FILE'])
+    if version == _catalog_seen_version:
+        return
+    with _catalog_version_lock:
+        if version != _catalog_seen_version:
+            facet_index.invalidate()
+            catalog_snapshot.invalidate() # También invalida la caché del catálogo
+            _catalog_seen_version = version
+
+def sync_catalog_stock_with_other_processes():
+    """Actualiza el stock de los productos que otros workers vendieron desde la lectura anterior."""
+    relay = change_feed_relay()
+    if relay is None:
+        return
+    reader = relay.catalog_reader
+    with reader.lock:
+        events, lost = reader.read()
+    if lost: # Se reemplazó el archivo antes de leerlo entero: el stock de algún producto puede haber quedado viejo
+        catalog_snapshot.invalidate()
+        return
+    product_ids = {product['id'] for event_type, payload in events if event_type == 'stock_changed'
+                   for product in json.loads(payload)['products']}
+    if product_ids:
+        catalog_snapshot.update_stock(dict(db.session.execute(
+            db.select(Product.id, Product.stockActual).where(Product.id.in_(product_ids))).all()))
+
+def notify_catalog_change():
+    """Se ejecuta después del commit, una vez que este proceso ya actualizó su catálogo en memoria."""
+    global _catalog_seen_version
+    with _catalog_version_lock:
+        previous_version, new_version = bump_version_file(current_app.config['CATALOG_VERSION_FILE'])
+        if previous_version != _catalog_seen_version:
+            # Otro proceso confirmó cambios que este todavía no leyó
+            facet_index.invalidate()
+            catalog_snapshot.invalidate()
+        _catalog_seen_version = new_version
+
+def notify_catalog_change_after_commit():
+    """Avisa a los demás procesos (una vez por transacción) que el catálogo cambió."""
+    if notify_catalog_change not in db.session.info.get('after_commit_callbacks', []):
+        run_after_commit(notify_catalog_change)
+
+def catalog_product_json(record, is_feria_active):
+    display_price = record.price_showroom # Precio por defecto
+    if is_feria_active and record.price_feria is not None:
+        display_price = record.price_feria
+
+    # Si hay un precio específico de catálogo y NO estamos en modo feria, podría usarse.
+    # AGENTS.md: "Posibilidad de cambiar precio e imagen (solo para el catálogo): Sobreescribir `Precio Feria` y `Imagen` para la vista del catálogo."
+    # Esto sugiere que `catalogPrice` y `catalogImageUrl` son para el catálogo general, no específicamente feria.
+    # Si `catalogPrice` existe, y no estamos en modo feria, podría tener precedencia sobre showroom.
+    # Por ahora, la lógica es: Modo Feria -> priceFeria (si existe), sino priceShowroom.
+    # Si AGENTS.md implica que catalogPrice es EL precio del catálogo (y priceFeria lo sobreescribe en modo feria), la lógica cambiaría.
+    # Mantendré la lógica simple por ahora: Feria usa PriceFeria, sino PriceShowroom. CatalogPrice/ImageUrl se pueden usar en el frontend si se desea.
+
+    stock_status = ""
+    if record.stock == 0:
+        stock_status = "AGOTADO"
+    elif record.stock > 0 and record.stock <= record.stock_critico:
+        stock_status = "Pocas unidades!"
+
+    return {
+        'id': record.id,
+        'name': record.name,
+        'displayPrice': display_price,
+        'imageUrl': record.image_url,
+        'stockActual': record.stock,
+        'stockCritico': record.stock_critico,
+        'stockStatus': stock_status,
+        # Incluir categorías y tags si se decide mostrarlos en el catálogo
+        # 'categories': [c.name for c in p.categories],
+        # 'tags': [t.name for t in p.tags],
+    }
+
 # --- API Endpoint para el Catálogo Público ---
-@app.route('/api/catalog', methods=['GET'])
+@bp.route('/api/catalog', methods=['GET'])
 def get_catalog():
     search_term = request.args.get('search_term', '').strip()
+    # search_scope=all busca también en nombres de tags y categorías (por defecto solo en el nombre)
+    search_all_fields = request.args.get('search_scope', 'name') == 'all'
     category_ids_str = request.args.get('category_ids', '') # CSV de IDs
     tag_ids_str = request.args.get('tag_ids', '') # CSV de IDs
 
-    config = Config.query.first()
-    is_feria_active = config.isFeriaModeActive if config else False
-
-    query = Product.query
-
-    if search_term:
-        query = query.filter(Product.name.ilike(f'%{search_term}%')) # Búsqueda case-insensitive
-
-    if category_ids_str:
-        try:
-            category_ids = [int(id_str) for id_str in category_ids_str.split(',') if id_str.strip()]
-            if category_ids:
-                query = query.join(Product.categories).filter(Category.id.in_(category_ids))
-        except ValueError:
-            return jsonify({'error': 'category_ids debe ser una lista de números enteros separados por comas.'}), 400
-
-    if tag_ids_str:
-        try:
-            tag_ids = [int(id_str) for id_str in tag_ids_str.split(',') if id_str.strip()]
-            if tag_ids:
-                query = query.join(Product.tags).filter(Tag.id.in_(tag_ids))
-        except ValueError:
-            return jsonify({'error': 'tag_ids debe ser una lista de números enteros separados por comas.'}), 400
-
-    products_query = query.order_by(Product.name).all() # Ordenar por nombre
-    catalog_products = []
-
-    for p in products_query:
-        display_price = p.priceShowroom # Precio por defecto
-        if is_feria_active and p.priceFeria is not None:
-            display_price = p.priceFeria
-
-        # Si hay un precio específico de catálogo y NO estamos en modo feria, podría usarse.
-        # AGENTS.md: "Posibilidad de cambiar precio e imagen (solo para el catálogo): Sobreescribir `Precio Feria` y `Imagen` para la vista del catálogo."
-        # Esto sugiere que `catalogPrice` y `catalogImageUrl` son para el catálogo general, no específicamente feria.
-        # Si `catalogPrice` existe, y no estamos en modo feria, podría tener precedencia sobre showroom.
-        # Por ahora, la lógica es: Modo Feria -> priceFeria (si existe), sino priceShowroom.
-        # Si AGENTS.md implica que catalogPrice es EL precio del catálogo (y priceFeria lo sobreescribe en modo feria), la lógica cambiaría.
-        # Mantendré la lógica simple por ahora: Feria usa PriceFeria, sino PriceShowroom. CatalogPrice/ImageUrl se pueden usar en el frontend si se desea.
-
-        stock_status = ""
-        if p.stockActual == 0:
-            stock_status = "AGOTADO"
-        elif p.stockActual > 0 and p.stockActual <= p.stockCritico:
-            stock_status = "Pocas unidades!"
-
-        catalog_products.append({
-            'id': p.id,
-            'name': p.name,
-            'displayPrice': display_price,
-            'imageUrl': p.catalogImageUrl if p.catalogImageUrl else p.imageUrl, # Usar imagen de catálogo si existe
-            'stockActual': p.stockActual,
-            'stockCritico': p.stockCritico,
-            'stockStatus': stock_status,
-            # Incluir categorías y tags si se decide mostrarlos en el catálogo
-            # 'categories': [c.name for c in p.categories],
-            # 'tags': [t.name for t in p.tags],
-        })
-
-    return jsonify(catalog_products)
+    try:
+        category_ids = [int(id_str) for id_str in category_ids_str.split(',') if id_str.strip()]
+    except ValueError:
+        return jsonify({'error': 'category_ids debe ser una lista de números enteros separados por comas.'}), 400
+    try:
+        tag_ids = [int(id_str) for id_str in tag_ids_str.split(',') if id_str.strip()]
+    except ValueError:
+        return jsonify({'error': 'tag_ids debe ser una lista de números enteros separados por comas.'}), 400
+    # Varias categorías (o tags) se combinan con OR (any, por defecto) o AND (all); categorías y tags, siempre con AND
+    category_mode = request.args.get('category_mode', 'any')
+    tag_mode = request.args.get('tag_mode', 'any')
+    if category_mode not in CATALOG_FILTER_MODES or tag_mode not in CATALOG_FILTER_MODES:
+        return jsonify({'error': "Parámetros 'category_mode' y 'tag_mode' deben ser 'any' o 'all'."}), 400
+    # facets=true responde {"products": [...], "facets": {...}} con los conteos de cada categoría y tag
+    with_facets = request.args.get('facets', 'false').lower() == 'true'
+
+    is_feria_active = current_config()['isFeriaModeActive']
+    sync_catalog_with_other_processes() # Descarta el catálogo en memoria si otro worker lo cambió
+
+    match_query = build_search_match_query(search_term, search_all_fields) if search_term else None
+    cache_key = catalog_cache_key(match_query, category_ids, tag_ids, is_feria_active, category_mode, tag_mode, with_facets)
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return catalog_response(cached)
+    cache_generation = catalog_cache.generation
+
+    snapshot = catalog_snapshot.current()
+
+    ranked_ids = None
+    if match_query:
+        # Búsqueda full-text sobre el índice FTS5: única consulta a la base de datos de esta ruta
+        search_matches = search_matches_subquery(match_query)
+        ranked_ids = [product_id for (product_id,) in db.session.execute(
+            db.select(search_matches.c.product_id).order_by(search_matches.c.rank))]
+
+    if category_ids or tag_ids or with_facets:
+        index = facet_index.current()
+        universe = index.products
+        if ranked_ids is not None:
+            universe = 0
+            for product_id in ranked_ids:
+                universe |= 1 << product_id
+        category_bits = combine_facet_bitsets(index.categories, category_ids, category_mode, universe)
+        tag_bits = combine_facet_bitsets(index.tags, tag_ids, tag_mode, universe)
+        selected = universe & category_bits & tag_bits
+
+    if ranked_ids is not None:
+        # Más relevantes primero (el orden de FTS), filtrados por categorías y tags si hace falta
+        if category_ids or tag_ids:
+            ranked_ids = [product_id for product_id in ranked_ids if selected >> product_id & 1]
+        records = [snapshot.by_id[product_id] for product_id in ranked_ids if product_id in snapshot.by_id]
+    elif category_ids or tag_ids:
+        records = snapshot.sorted_by_name(bitset_to_ids(selected))
+    else:
+        records = snapshot.records # Ya ordenados por nombre
+
+    catalog_products = [catalog_product_json(record, is_feria_active) for record in records]
+    product_ids = None # Todos: cualquier cambio de stock descarta la respuesta
+    if records is not snapshot.records and len(records) <= CATALOG_CACHE_MAX_TRACKED_PRODUCTS:
+        product_ids = frozenset(record.id for record in records)
+
+    if with_facets:
+        # Conteo de cada faceta con los demás filtros aplicados: en modo any no se aplica la selección
+        # del propio grupo (muestra cuántos productos sumaría marcarla), en modo all sí (cuántos quedarían).
+        category_base = universe & tag_bits & (category_bits if category_mode == 'all' else universe)
+        tag_base = universe & category_bits & (tag_bits if tag_mode == 'all' else universe)
+        body = jsonify({
+            'products': catalog_products,
+            'facets': {
+                'categories': facet_counts(index.categories, category_base),
+                'tags': facet_counts(index.tags, tag_base),
+            }
+        }).get_data()
+    else:
+        body = jsonify(catalog_products).get_data()
+    entry = catalog_cache.put(cache_key, body, cache_generation, product_ids)
+    if entry is None: # Hubo una invalidación mientras se calculaba: se responde sin guardar
+        entry = (body, hashlib.sha1(body).hexdigest())
+    return catalog_response(entry)
 
 # --- API Endpoints para Tags ---
 
 def tag_to_json(tag):
     return {'id': tag.id, 'name': tag.name}
 
-@app.route('/api/tags', methods=['POST'])
+@bp.route('/api/tags', methods=['POST'])
 def create_tag():
     data = request.json
     if not data or not data.get('name') or not data.get('name').strip():
@@ -386,15 +2270,19 @@ def create_tag():
     new_tag = Tag()
     new_tag.name = name_stripped
     db.session.add(new_tag)
+    db.session.flush()
+    new_tag_id = new_tag.id
+    run_after_commit(lambda: facet_index.set_facet('tags', new_tag_id, name_stripped))
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify(tag_to_json(new_tag)), 201
 
-@app.route('/api/tags', methods=['GET'])
+@bp.route('/api/tags', methods=['GET'])
 def get_tags():
     tags = Tag.query.order_by(Tag.name).all()
     return jsonify([tag_to_json(tag) for tag in tags])
 
-@app.route('/api/tags/<int:tag_id>', methods=['PUT'])
+@bp.route('/api/tags/<int:tag_id>', methods=['PUT'])
 def update_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
     data = request.json
@@ -411,10 +2299,15 @@ def update_tag(tag_id):
         return jsonify({'error': 'Ya existe otro tag con este nombre.'}), 409
 
     tag.name = new_name
+    for product in tag.products: # El nombre del tag forma parte del documento de búsqueda
+        index_product_for_search(product)
+    run_after_commit(lambda: facet_index.set_facet('tags', tag_id, new_name))
+    invalidate_catalog_searches_after_commit()
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify(tag_to_json(tag))
 
-@app.route('/api/tags/<int:tag_id>', methods=['DELETE'])
+@bp.route('/api/tags/<int:tag_id>', methods=['DELETE'])
 def delete_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
 
@@ -425,6 +2318,8 @@ def delete_tag(tag_id):
         # O permitir la eliminación y que la relación se rompa (depende del comportamiento deseado).
 
     db.session.delete(tag)
+    run_after_commit(lambda: facet_index.remove_facet('tags', tag_id))
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify({'message': 'Tag eliminado exitosamente.'})
 
@@ -433,7 +2328,7 @@ def delete_tag(tag_id):
 def category_to_json(category):
     return {'id': category.id, 'name': category.name, 'imageUrl': category.imageUrl}
 
-@app.route('/api/categories', methods=['POST'])
+@bp.route('/api/categories', methods=['POST'])
 def create_category():
     data = request.json
     if not data or not data.get('name') or not data.get('name').strip():
@@ -444,19 +2339,23 @@ def create_category():
         return jsonify({'error': 'Esta categoría ya existe.'}), 409
 
     new_category = Category()
-    new_category.name = data['name'].strip()
+    new_category.name = new_category_name = data['name'].strip()
     new_category.imageUrl = data.get('imageUrl')
 
     db.session.add(new_category)
+    db.session.flush()
+    new_category_id = new_category.id
+    run_after_commit(lambda: facet_index.set_facet('categories', new_category_id, new_category_name))
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify(category_to_json(new_category)), 201
 
-@app.route('/api/categories', methods=['GET'])
+@bp.route('/api/categories', methods=['GET'])
 def get_categories():
     categories = Category.query.order_by(Category.name).all()
     return jsonify([category_to_json(cat) for cat in categories])
 
-@app.route('/api/categories/<int:category_id>', methods=['PUT'])
+@bp.route('/api/categories/<int:category_id>', methods=['PUT'])
 def update_category(category_id):
     category = Category.query.get_or_404(category_id)
     data = request.json
@@ -474,65 +2373,161 @@ def update_category(category_id):
 
     category.name = new_name
     category.imageUrl = data.get('imageUrl', category.imageUrl)
+    for product in category.products: # El nombre de la categoría forma parte del documento de búsqueda
+        index_product_for_search(product)
+    run_after_commit(lambda: facet_index.set_facet('categories', category_id, new_name))
+    invalidate_catalog_searches_after_commit()
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify(category_to_json(category))
 
-@app.route('/api/categories/<int:category_id>', methods=['DELETE'])
+@bp.route('/api/categories/<int:category_id>', methods=['DELETE'])
 def delete_category(category_id):
     category = Category.query.get_or_404(category_id)
     if category.products: # Si la backref 'products' tiene elementos
         return jsonify({'error': 'Esta categoría está asociada a productos y no puede ser eliminada directamente.'}), 400
 
     db.session.delete(category)
+    run_after_commit(lambda: facet_index.remove_facet('categories', category_id))
+    invalidate_catalog_facets_after_commit()
     db.session.commit()
     return jsonify({'message': 'Categoría eliminada exitosamente.'})
 
 # --- API Endpoints para Clientes ---
 
-def client_to_json(client):
+CLIENT_JSON_FIELDS = {
+    'id': lambda client: client.id,
+    'name': lambda client: client.name,
+    'nickname': lambda client: client.nickname,
+    'whatsapp': lambda client: client.whatsapp,
+    'email': lambda client: client.email,
+    'gender': lambda client: client.gender,
+    'clientLevel': lambda client: client.clientLevel,
+    'profileImageUrl': lambda client: client.profileImageUrl,
+    'purchaseStats': lambda client: purchase_stats_to_json(client.purchase_stats),
+    # 'sales': lambda client: [sale.id for sale in client.sales] # Podría ser útil más adelante
+}
+
+def purchase_stats_to_json(stats):
+    """Compras no canceladas de un cliente, desde client_sales_total (sin recorrer sus ventas)."""
+    order_count = stats.order_count if stats else 0
+    total_spent = stats.total_spent if stats else 0.0
     return {
-        'id': client.id,
-        'name': client.name,
-        'nickname': client.nickname,
-        'whatsapp': client.whatsapp,
-        'email': client.email,
-        'gender': client.gender,
-        'clientLevel': client.clientLevel,
-        'profileImageUrl': client.profileImageUrl,
-        # 'sales': [sale.id for sale in client.sales] # Podría ser útil más adelante
+        'orderCount': order_count,
+        'lifetimeValue': round(total_spent, 2),
+        'averageTicket': round(total_spent / order_count, 2) if order_count else None,
+        'firstPurchase': stats.first_purchase.isoformat() if stats and stats.first_purchase else None,
+        'lastPurchase': stats.last_purchase.isoformat() if stats and stats.last_purchase else None,
     }
 
-@app.route('/api/clients', methods=['POST'])
+def client_to_json(client, fields=None):
+    return serialize_fields(client, CLIENT_JSON_FIELDS, fields)
+
+def client_list_loader_options(fields=None):
+    """Columnas pedidas en `fields` y, si se piden, los totales de compras en una consulta para todo el listado."""
+    options = column_projection_options(Client, fields, ('purchaseStats',)) if fields is not None else []
+    if fields is None or 'purchaseStats' in fields:
+        options.append(selectinload(Client.purchase_stats))
+    return options
+
+def client_levels_are_automatic():
+    return bool(current_app.config['CLIENT_LEVEL_RULES'])
+
+def manual_client_level_error(current_level, data):
+    """Mensaje de error si se pide cambiar a mano un nivel que calculan las reglas (None si no hay problema)."""
+    requested = data.get('clientLevel')
+    if client_levels_are_automatic() and requested is not None and requested != current_level:
+        return ('El nivel de cliente lo calculan las reglas (CLIENT_LEVEL_RULES) a partir de sus compras: '
+                'no se puede cambiar a mano.')
+    return None
+
+@bp.route('/api/clients', methods=['POST'])
 def create_client():
     data = request.json
     if not data or not data.get('name') or not data.get('name').strip():
         return jsonify({'error': 'El nombre del cliente es requerido.'}), 400
 
+    level_error = manual_client_level_error(CLIENT_LEVELS[0], data)
+    if level_error:
+        return jsonify({'error': level_error}), 400
+
     new_client = Client()
     new_client.name = data['name'].strip()
     new_client.nickname = data.get('nickname', '').strip()
     new_client.whatsapp = data.get('whatsapp', '').strip()
     new_client.email = data.get('email', '').strip()
     new_client.gender = data.get('gender')
-    new_client.clientLevel = data.get('clientLevel', 'Nuevo')
+    # Con CLIENT_LEVEL_RULES el nivel lo calculan las reglas (un cliente nuevo, con sus compras en cero)
+    new_client.clientLevel = CLIENT_LEVELS[0] if client_levels_are_automatic() else data.get('clientLevel', 'Nuevo')
     new_client.profileImageUrl = data.get('profileImageUrl')
 
     db.session.add(new_client)
+    db.session.flush() # Asigna el id para el índice de búsqueda
+    index_client_for_search(new_client)
+    if client_levels_are_automatic():
+        classify_clients([new_client.id])
+        db.session.expire(new_client, ['clientLevel'])
     db.session.commit()
     return jsonify(client_to_json(new_client)), 201
 
-@app.route('/api/clients', methods=['GET'])
+@bp.route('/api/clients', methods=['GET'])
 def get_clients():
-    # Implementar búsqueda si se necesita: request.args.get('search_term')
-    clients = Client.query.order_by(Client.name).all()
-    return jsonify([client_to_json(client) for client in clients])
+    # La búsqueda está en GET /api/clients/search
+    try:
+        fields = parse_fields_param(list(CLIENT_JSON_FIELDS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = Client.query.options(*client_list_loader_options(fields))
+
+    # Paginado por cursor (name,id). El listado completo solo con ?all=true explícito.
+    if wants_all_rows():
+        clients = query.order_by(Client.name, Client.id).all()
+        return jsonify([client_to_json(client, fields) for client in clients])
 
-@app.route('/api/clients/<int:client_id>', methods=['GET'])
+    try:
+        page = paginate_keyset(query, Client.name, Client.id, lambda client: client_to_json(client, fields))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@bp.route('/api/clients/search', methods=['GET'])
+def search_clients():
+    """
+    Búsqueda rápida de clientes (ej. para elegir el cliente de una venta): ?q=texto&limit=10.
+    Busca en nombre, apodo, email y WhatsApp con el índice client_search (ver search_client_ids)
+    y devuelve como máximo `limit` clientes, los más relevantes primero. Acepta ?fields=.
+    """
+    try:
+        fields = parse_fields_param(list(CLIENT_JSON_FIELDS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = request.args.get('limit', CLIENT_SEARCH_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit or CLIENT_SEARCH_DEFAULT_LIMIT, CLIENT_SEARCH_MAX_LIMIT))
+    client_ids = search_client_ids(request.args.get('q', '').strip(), limit)
+    if not client_ids:
+        return jsonify([])
+    query = Client.query.options(*client_list_loader_options(fields))
+    clients = {client.id: client for client in query.filter(Client.id.in_(client_ids))}
+    return jsonify([client_to_json(clients[client_id], fields) for client_id in client_ids if client_id in clients])
+
+@bp.route('/api/clients/reclassify', methods=['POST'])
+def reclassify_clients():
+    """
+    Recalcula el nivel de todos los clientes con CLIENT_LEVEL_RULES en un solo UPDATE (ej. después de
+    cambiar las reglas, o para que las reglas por antigüedad de la última compra se apliquen).
+    """
+    if not client_levels_are_automatic():
+        return jsonify({'error': 'No hay reglas de nivel de cliente (CLIENT_LEVEL_RULES): los niveles se cargan a mano.'}), 400
+    changed = classify_clients()
+    db.session.commit()
+    return jsonify({'changed': changed, 'levels': client_level_counts()})
+
+@bp.route('/api/clients/<int:client_id>', methods=['GET'])
 def get_client(client_id):
     client = Client.query.get_or_404(client_id)
     return jsonify(client_to_json(client))
 
-@app.route('/api/clients/<int:client_id>', methods=['PUT'])
+@bp.route('/api/clients/<int:client_id>', methods=['PUT'])
 def update_client(client_id):
     client = Client.query.get_or_404(client_id)
     data = request.json
@@ -543,18 +2538,24 @@ def update_client(client_id):
     if not name_data or not name_data.strip(): # Nombre sigue siendo requerido
         return jsonify({'error': 'El nombre del cliente es requerido.'}), 400
 
+    level_error = manual_client_level_error(client.clientLevel, data)
+    if level_error:
+        return jsonify({'error': level_error}), 400
+
     client.name = name_data.strip()
     client.nickname = data.get('nickname', client.nickname).strip() if data.get('nickname') is not None else client.nickname
     client.whatsapp = data.get('whatsapp', client.whatsapp).strip() if data.get('whatsapp') is not None else client.whatsapp
     client.email = data.get('email', client.email).strip() if data.get('email') is not None else client.email
     client.gender = data.get('gender', client.gender)
-    client.clientLevel = data.get('clientLevel', client.clientLevel)
+    if not client_levels_are_automatic(): # Con CLIENT_LEVEL_RULES el nivel lo calculan las reglas
+        client.clientLevel = data.get('clientLevel', client.clientLevel)
     client.profileImageUrl = data.get('profileImageUrl', client.profileImageUrl)
 
+    index_client_for_search(client)
     db.session.commit()
     return jsonify(client_to_json(client))
 
-@app.route('/api/clients/<int:client_id>', methods=['DELETE'])
+@bp.route('/api/clients/<int:client_id>', methods=['DELETE'])
 def delete_client(client_id):
     client = Client.query.get_or_404(client_id)
     # Verificar si el cliente tiene ventas asociadas
@@ -563,11 +2564,15 @@ def delete_client(client_id):
         # Se podría implementar lógica para anonimizar o reasignar ventas si es necesario.
 
     db.session.delete(client)
+    unindex_client_for_search(client.id)
     db.session.commit()
     return jsonify({'message': 'Cliente eliminado exitosamente.'})
 
 # --- API Endpoints para Ventas (Sales) ---
 
+# Estados de una venta, en el orden del pipeline
+SALE_STATUSES = ["Contactado", "Armado", "Entregado", "Cobrado", "Cancelado"]
+
 def sale_item_to_json(item):
     return {
         'id': item.id,
@@ -578,18 +2583,315 @@ def sale_item_to_json(item):
         'subtotal': item.subtotal
     }
 
-def sale_to_json(sale):
+# --- Agregados de ventas mantenidos incrementalmente ---
+# Cada venta "aporta" a los agregados según su estado. Crear una venta suma su aporte (sign=1),
+# eliminarla lo resta (sign=-1) y un cambio de estado resta el aporte del estado viejo y suma el del nuevo.
+# Todo se ejecuta en la sesión actual, así que se confirma (o descarta) junto con la venta.
+
+def add_sale_increments(increments, sale, status, sign):
+    """
+    Acumula en `increments` ({(modelo, claves): {columna: valor}}) el aporte de `sale` con estado
+    `status` a los agregados: sign=1 lo suma, sign=-1 lo resta.
+    """
+    def add(model, keys, values):
+        totals = increments.setdefault((model, tuple(keys.items())), dict.fromkeys(values, 0))
+        for column, value in values.items():
+            totals[column] += value
+
+    add(SaleStatusCounter, {'status': status}, {'count': sign, 'totalAmount': sign * sale.totalAmount})
+
+    # Las estadísticas financieras no cuentan las ventas canceladas
+    if status == 'Cancelado':
+        return
+    sale_day = sale.saleDate.date()
+    add(SalesDailyRollup, {'date': sale_day}, {'order_count': sign, 'total_sales': sign * sale.totalAmount})
+
+    client_increments = {'order_count': sign, 'total_spent': sign * sale.totalAmount}
+    add(ClientSalesTotal, {'client_id': sale.client_id}, client_increments)
+    add(ClientDailySales, {'date': sale_day, 'client_id': sale.client_id}, client_increments)
+
+    for item in sale.items: # Un producto puede estar en varios items: se acumulan en la misma fila
+        product_increments = {'units_sold': sign * item.quantity, 'revenue': sign * item.subtotal}
+        add(ProductSalesTotal, {'product_id': item.product_id}, product_increments)
+        add(ProductDailySales, {'date': sale_day, 'product_id': item.product_id}, product_increments)
+
+def write_sale_increments(increments):
+    """
+    INSERT de cada fila de agregados con sus incrementos, o suma de los incrementos si ya existe
+    (upsert). Un solo executemany por tabla, sin importar cuántas ventas aporten. Después actualiza
+    la primera y última compra y el nivel de los clientes cuyos totales cambiaron.
+    """
+    rows_by_table = {}
+    for (model, keys), values in increments.items():
+        if not any(values.values()): # Ej. un cambio entre dos estados que cuentan igual para las estadísticas
+            continue
+        rows_by_table.setdefault((model, tuple(key for key, _ in keys), tuple(values)), []).append({**dict(keys), **values})
+    for (model, key_columns, value_columns), rows in rows_by_table.items():
+        stmt = sqlite_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[getattr(model, column) for column in key_columns],
+            set_={column: getattr(model, column) + getattr(stmt.excluded, column) for column in value_columns}
+        )
+        db.session.execute(stmt, rows)
+    changed_client_ids = [dict(keys)['client_id'] for (model, keys), values in increments.items()
+                          if model is ClientSalesTotal and any(values.values())]
+    if changed_client_ids:
+        refresh_client_purchase_stats(changed_client_ids)
+
+def apply_sale_to_aggregates(sale, status, sign):
+    """Suma (sign=1) o resta (sign=-1) el aporte de `sale` con estado `status` a los agregados."""
+    increments = {}
+    add_sale_increments(increments, sale, status, sign)
+    write_sale_increments(increments)
+
+STOCK_UPDATE_BATCH_SIZE = 500 # Productos por UPDATE (2 parámetros cada uno, lejos del límite de SQLite)
+
+def apply_stock_deltas(deltas):
+    """
+    Suma `deltas` ({product_id: unidades}, negativas para descontar) al stock con un UPDATE por lote
+    de productos (CASE por id). Retorna el stock nuevo {product_id: stockActual}; los productos que
+    ya no existen no aparecen.
+    """
+    deltas = sorted((product_id, delta) for product_id, delta in deltas.items() if delta)
+    new_stock = {}
+    for start in range(0, len(deltas), STOCK_UPDATE_BATCH_SIZE):
+        batch = dict(deltas[start:start + STOCK_UPDATE_BATCH_SIZE])
+        new_stock.update(db.session.execute(
+            db.update(Product)
+            .where(Product.id.in_(list(batch)))
+            .values(stockActual=Product.stockActual + case(batch, value=Product.id))
+            .returning(Product.id, Product.stockActual)
+            .execution_options(synchronize_session=False)
+        ).all())
+    return new_stock
+
+def sale_product_quantities(sale):
+    quantities = {}
+    for item in sale.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+def transition_sales(sales, new_status):
+    """
+    Pasa `sales` (en ese orden) a `new_status` con las reglas de los cambios de estado:
+    - Cancelar una venta devuelve al stock las unidades de sus items.
+    - Reactivar una venta cancelada las vuelve a descontar, solo si alcanza el stock (las ventas que
+      no entran quedan con su error y sin cambios; las anteriores de la lista tienen prioridad).
+    El stock se actualiza con un UPDATE por lote de productos y los agregados con un upsert por fila
+    afectada, en la transacción actual (no confirma).
+    Retorna (errores {sale_id: mensaje}, cambiadas [(venta, estado anterior)], stock nuevo {product_id: stockActual}).
+    """
+    errors = {}
+    changed = []
+    stock_deltas = {}
+    increments = {}
+
+    reactivating = [sale for sale in sales if sale.status == 'Cancelado' and new_status != 'Cancelado']
+    available = {}
+    if reactivating:
+        # Con BEGIN IMMEDIATE (peticiones que escriben) nadie más modifica el stock hasta el commit
+        product_ids = {item.product_id for sale in reactivating for item in sale.items}
+        available = {row.id: row for row in db.session.execute(
+            db.select(Product.id, Product.name, Product.stockActual).where(Product.id.in_(product_ids)))}
+    reserved = {} # product_id -> unidades ya reservadas por reactivaciones anteriores de la lista
+
+    for sale in sales:
+        if sale.status == new_status:
+            continue
+        quantities = sale_product_quantities(sale)
+        if sale.status == 'Cancelado':
+            shortage = next((product_id for product_id, quantity in quantities.items()
+                             if product_id not in available
+                             or available[product_id].stockActual - reserved.get(product_id, 0) < quantity), None)
+            if shortage is not None:
+                product = available.get(shortage)
+                name = product.name if product else f'ID {shortage}'
+                stock = product.stockActual - reserved.get(shortage, 0) if product else 'N/A'
+                errors[sale.id] = (f"No se puede reactivar la venta. Stock insuficiente para {name}. "
+                                   f"Disponible: {stock}, Requerido: {quantities[shortage]}")
+                continue
+            for product_id, quantity in quantities.items():
+                reserved[product_id] = reserved.get(product_id, 0) + quantity
+                stock_deltas[product_id] = stock_deltas.get(product_id, 0) - quantity
+        elif new_status == 'Cancelado':
+            for product_id, quantity in quantities.items():
+                stock_deltas[product_id] = stock_deltas.get(product_id, 0) + quantity
+
+        add_sale_increments(increments, sale, sale.status, -1)
+        add_sale_increments(increments, sale, new_status, 1)
+        changed.append((sale, sale.status))
+        sale.status = new_status
+
+    new_stock = apply_stock_deltas(stock_deltas)
+    write_sale_increments(increments)
+    return errors, changed, new_stock
+
+def rebuild_sale_aggregates():
+    """Recalcula desde cero todos los agregados de ventas a partir de las tablas sale y sale_item."""
+    def rebuild(model, select):
+        db.session.query(model).delete()
+        db.session.execute(db.insert(model).from_select([c.name for c in select.selected_columns], select))
+
+    rebuild(SaleStatusCounter, db.select(
+        Sale.status, func.count(Sale.id).label('count'), func.coalesce(func.sum(Sale.totalAmount), 0.0).label('totalAmount')
+    ).where(Sale.status.isnot(None)).group_by(Sale.status))
+
+    sale_day = func.date(Sale.saleDate).label('date')
+    not_cancelled = Sale.status != 'Cancelado'
+    rebuild(SalesDailyRollup, db.select(
+        sale_day, func.count(Sale.id).label('order_count'), func.sum(Sale.totalAmount).label('total_sales')
+    ).where(not_cancelled).group_by(sale_day))
+
+    rebuild(ClientSalesTotal, db.select(
+        Sale.client_id, func.count(Sale.id).label('order_count'), func.sum(Sale.totalAmount).label('total_spent'),
+        func.min(sale_day).label('first_purchase'), func.max(sale_day).label('last_purchase')
+    ).where(not_cancelled).group_by(Sale.client_id))
+    rebuild(ClientDailySales, db.select(
+        sale_day, Sale.client_id, func.count(Sale.id).label('order_count'), func.sum(Sale.totalAmount).label('total_spent')
+    ).where(not_cancelled).group_by(sale_day, Sale.client_id))
+
+    rebuild(ProductSalesTotal, db.select(
+        SaleItem.product_id, func.sum(SaleItem.quantity).label('units_sold'), func.sum(SaleItem.subtotal).label('revenue')
+    ).join(Sale, Sale.id == SaleItem.sale_id).where(not_cancelled).group_by(SaleItem.product_id))
+    rebuild(ProductDailySales, db.select(
+        sale_day, SaleItem.product_id, func.sum(SaleItem.quantity).label('units_sold'), func.sum(SaleItem.subtotal).label('revenue')
+    ).join(Sale, Sale.id == SaleItem.sale_id).where(not_cancelled).group_by(sale_day, SaleItem.product_id))
+
+    if current_app.config['CLIENT_LEVEL_RULES']:
+        classify_clients() # Los niveles salen de los totales por cliente recién calculados
+    db.session.commit()
+
+@bp.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recalcula los agregados de ventas (ej. contadores del dashboard) desde la tabla sale."""
+    rebuild_sale_aggregates()
+    print("Agregados de ventas recalculados.")
+
+# --- Niveles de cliente ---
+# El nivel (Nuevo/Frecuente/VIP) sale de CLIENT_LEVEL_RULES aplicadas a client_sales_total. Las reglas
+# se traducen a un CASE de SQL, así el mismo cálculo sirve para los clientes de una venta (en la
+# transacción de la venta) y para reclasificar a todos en un solo UPDATE.
+
+CLIENT_LEVELS = ["Nuevo", "Frecuente", "VIP"] # El primero es el nivel de quien no cumple ninguna regla
+
+CLIENT_LEVEL_CONDITIONS = {
+    'min_orders': lambda stats, value: stats.order_count >= value,
+    'min_total_spent': lambda stats, value: stats.total_spent >= value,
+    'min_average_ticket': lambda stats, value: and_(stats.order_count > 0, stats.total_spent >= value * stats.order_count),
+    # Las fechas de compra son días UTC (como saleDate y los rollups): "hoy" también
+    'max_days_since_last_purchase': lambda stats, value:
+        stats.last_purchase >= datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=value),
+}
+
+def validate_client_level_rules(rules):
+    """Falla al crear la app (no en cada venta) si CLIENT_LEVEL_RULES tiene un nivel o una condición desconocidos."""
+    for rule in rules:
+        unknown = set(rule) - set(CLIENT_LEVEL_CONDITIONS) - {'level'}
+        if rule.get('level') not in CLIENT_LEVELS or unknown:
+            raise ValueError(f"Regla de CLIENT_LEVEL_RULES inválida: {rule}. Niveles: {', '.join(CLIENT_LEVELS)}; "
+                             f"condiciones: {', '.join(CLIENT_LEVEL_CONDITIONS)}.")
+
+def client_level_expression(stats):
+    """CASE que calcula el nivel a partir de las columnas de `stats` (order_count, total_spent, last_purchase)."""
+    whens = [(and_(true(), *[CLIENT_LEVEL_CONDITIONS[name](stats, value) for name, value in rule.items() if name != 'level']),
+              rule['level'])
+             for rule in current_app.config['CLIENT_LEVEL_RULES']]
+    return case(*whens, else_=CLIENT_LEVELS[0]) if whens else literal(CLIENT_LEVELS[0])
+
+def classify_clients(client_ids=None):
+    """
+    Recalcula el nivel de `client_ids` (todos si es None) en un solo UPDATE ... FROM, en la transacción
+    actual. Los clientes sin compras se evalúan con totales en cero. Retorna cuántos cambiaron de nivel.
+    """
+    stats = db.select(
+        Client.id.label('client_id'),
+        func.coalesce(ClientSalesTotal.order_count, 0).label('order_count'),
+        func.coalesce(ClientSalesTotal.total_spent, 0.0).label('total_spent'),
+        ClientSalesTotal.last_purchase,
+    ).outerjoin(ClientSalesTotal, ClientSalesTotal.client_id == Client.id)
+    if client_ids is not None:
+        stats = stats.where(Client.id.in_(client_ids))
+    stats = stats.subquery('stats')
+    level = client_level_expression(stats.c)
+    result = db.session.execute(
+        db.update(Client).where(Client.id == stats.c.client_id, Client.clientLevel.is_distinct_from(level))
+        .values(clientLevel=level).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+def refresh_client_purchase_stats(client_ids):
+    """
+    Después de cambiar los totales de `client_ids`: recalcula su primera y última compra (una venta
+    cancelada o eliminada puede haber sido cualquiera de las dos) y, si hay reglas, su nivel.
+    """
+    daily = db.select(ClientDailySales.date).where(
+        ClientDailySales.client_id == ClientSalesTotal.client_id, ClientDailySales.order_count > 0)
+    db.session.execute(
+        db.update(ClientSalesTotal).where(ClientSalesTotal.client_id.in_(client_ids)).values(
+            first_purchase=daily.order_by(ClientDailySales.date).limit(1).scalar_subquery(),
+            last_purchase=daily.order_by(ClientDailySales.date.desc()).limit(1).scalar_subquery(),
+        ).execution_options(synchronize_session=False)
+    )
+    if current_app.config['CLIENT_LEVEL_RULES']:
+        classify_clients(client_ids)
+
+def client_level_counts():
+    return dict(db.session.execute(db.select(Client.clientLevel, func.count(Client.id)).group_by(Client.clientLevel)).all())
+
+@bp.cli.command('reclassify-clients')
+def reclassify_clients_command():
+    """Recalcula el nivel de todos los clientes con CLIENT_LEVEL_RULES (ej. después de cambiar las reglas)."""
+    if not client_levels_are_automatic(): # Sin reglas todos quedarían en 'Nuevo'
+        print("No hay reglas de nivel de cliente (CLIENT_LEVEL_RULES): los niveles se cargan a mano.")
+        return
+    changed = classify_clients()
+    db.session.commit()
+    print(f"Clientes reclasificados: {changed} cambiaron de nivel. {client_level_counts()}")
+
+SALE_JSON_FIELDS = {
+    'id': lambda sale: sale.id,
+    'client_id': lambda sale: sale.client_id,
+    'client_name': lambda sale: sale.client.name, # Asumiendo backref 'client'
+    'saleDate': lambda sale: sale.saleDate.isoformat(),
+    'totalAmount': lambda sale: sale.totalAmount,
+    'status': lambda sale: sale.status,
+    'items': lambda sale: [sale_item_to_json(item) for item in sale.items]
+}
+
+def sale_to_json(sale, fields=None):
+    return serialize_fields(sale, SALE_JSON_FIELDS, fields)
+
+def sale_event_data(sale):
+    """Datos compactos de una venta para los eventos del feed (sin items)."""
     return {
         'id': sale.id,
         'client_id': sale.client_id,
-        'client_name': sale.client.name, # Asumiendo backref 'client'
+        'client_name': sale.client.name,
         'saleDate': sale.saleDate.isoformat(),
         'totalAmount': sale.totalAmount,
-        'status': sale.status,
-        'items': [sale_item_to_json(item) for item in sale.items]
+        'status': sale.status
     }
 
-@app.route('/api/sales', methods=['POST'])
+def publish_sale_changes(event_type, sale, new_stock=None, **extra):
+    """
+    Publica, si la transacción se confirma, el evento de la venta, el stock nuevo de los productos
+    afectados ({product_id: stockActual}) y los contadores del dashboard. Los datos se leen antes del
+    commit, dentro de la misma transacción, así cada evento refleja exactamente ese cambio.
+    """
+    publish_sales_changes(event_type, [(sale, extra)], new_stock)
+
+def publish_sales_changes(event_type, sales, new_stock=None):
+    """Como publish_sale_changes, para varias ventas [(venta, datos extra del evento)]: un evento por venta y uno solo de stock y contadores."""
+    db.session.flush() # Asigna el id de una venta nueva y escribe los cambios pendientes
+    for sale, extra in sales:
+        publish_after_commit(event_type, {**sale_event_data(sale), **extra})
+    if new_stock:
+        publish_after_commit('stock_changed', {
+            'products': [{'id': product_id, 'stockActual': stock} for product_id, stock in sorted(new_stock.items())]
+        })
+    publish_after_commit('summary_updated', dashboard_summary())
+
+@bp.route('/api/sales', methods=['POST'])
 def create_sale():
     data = request.json
     if not data or not 'client_id' in data or not 'items' in data or not isinstance(data['items'], list) or not data['items']:
@@ -601,22 +2903,32 @@ def create_sale():
 
     new_sale = Sale()
     new_sale.client_id = data['client_id']
-    new_sale.status = data.get('status', 'Contactado') # Estado inicial por defecto
+    # Misma fecha (UTC) que pondría current_timestamp, pero conocida antes del INSERT para los agregados
+    new_sale.saleDate = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    new_sale.status = data.get('status') or 'Contactado' # Estado inicial por defecto
+
+    # Una sola consulta IN para todos los productos del pedido
+    product_ids = {item_data.get('product_id') for item_data in data['items'] if isinstance(item_data.get('product_id'), int)}
+    products = {p.id: p for p in Product.query.options(*product_columns_only_options()).filter(Product.id.in_(product_ids))}
 
     calculated_total_amount = 0
     items_to_add = []
+    requested_quantities = {} # product_id -> cantidad total pedida (un producto puede repetirse en varios items)
 
     for item_data in data['items']:
-        product = Product.query.get(item_data.get('product_id'))
+        product_id = item_data.get('product_id')
+        product = products.get(product_id) if isinstance(product_id, int) else None
         if not product:
-            return jsonify({'error': f"Producto con ID {item_data.get('product_id')} no encontrado."}), 404
+            return jsonify({'error': f"Producto con ID {product_id} no encontrado."}), 404
 
         quantity = item_data.get('quantity', 1)
         if not isinstance(quantity, int) or quantity <= 0:
             return jsonify({'error': f"Cantidad inválida para el producto {product.name}."}), 400
 
-        if product.stockActual < quantity:
-            return jsonify({'error': f"Stock insuficiente para {product.name}. Disponible: {product.stockActual}, Solicitado: {quantity}"}), 400
+        requested_quantities[product.id] = requested_quantities.get(product.id, 0) + quantity
+        # Chequeo rápido con el stock leído; la reserva real (atómica) se hace más abajo
+        if product.stockActual < requested_quantities[product.id]:
+            return jsonify({'error': f"Stock insuficiente para {product.name}. Disponible: {product.stockActual}, Solicitado: {requested_quantities[product.id]}"}), 400
 
         price_at_sale = item_data.get('price_at_sale', product.priceShowroom) # Usar precio de showroom por defecto si no se especifica
         # Aquí se podría implementar lógica más compleja para determinar el precio (ej. modo feria)
@@ -624,9 +2936,6 @@ def create_sale():
         subtotal = quantity * price_at_sale
         calculated_total_amount += subtotal
 
-        # Disminuir stock
-        product.stockActual -= quantity
-
         sale_item = SaleItem()
         sale_item.product_id = product.id
         sale_item.quantity = quantity
@@ -639,36 +2948,68 @@ def create_sale():
     new_sale.items = items_to_add
 
     try:
+        # Reservar stock con UPDATEs condicionales: la condición se evalúa en la base de datos al
+        # escribir, así dos ventas simultáneas no pueden vender las mismas unidades (sin sobreventa).
+        new_stock = {}
+        for product_id in sorted(requested_quantities):
+            quantity = requested_quantities[product_id]
+            new_stock[product_id] = db.session.execute(
+                db.update(Product)
+                .where(Product.id == product_id, Product.stockActual >= quantity)
+                .values(stockActual=Product.stockActual - quantity)
+                .returning(Product.stockActual)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if new_stock[product_id] is None: # Ninguna fila cumplió la condición
+                db.session.rollback()
+                product = db.session.get(Product, product_id)
+                return jsonify({'error': f"Stock insuficiente para {product.name}. Disponible: {product.stockActual}, Solicitado: {quantity}"}), 400
+
         db.session.add(new_sale)
+        apply_sale_to_aggregates(new_sale, new_sale.status, 1)
+        update_catalog_stock_after_commit(new_stock) # Cambió el stock: actualiza el snapshot y las respuestas en caché con esos productos
+        publish_sale_changes('sale_created', new_sale, new_stock)
         db.session.commit()
         return jsonify(sale_to_json(new_sale)), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Error al crear venta: {e}") # Log del error
+        current_app.logger.exception("Error al crear venta")
         return jsonify({'error': f'Ocurrió un error al crear la venta: {str(e)}'}), 500
 
 
-@app.route('/api/sales', methods=['GET'])
+@bp.route('/api/sales', methods=['GET'])
 def get_sales():
     status_filter = request.args.get('status')
     client_id_filter = request.args.get('client_id', type=int)
+    try:
+        fields = parse_fields_param(list(SALE_JSON_FIELDS))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    query = Sale.query.order_by(Sale.saleDate.desc())
+    query = Sale.query.options(*sale_list_loader_options(fields))
 
     if status_filter:
         query = query.filter(Sale.status == status_filter)
     if client_id_filter:
         query = query.filter(Sale.client_id == client_id_filter)
 
-    sales = query.all()
-    return jsonify([sale_to_json(s) for s in sales])
+    # Paginado por cursor (saleDate,id, más recientes primero). El listado completo solo con ?all=true explícito.
+    if wants_all_rows():
+        sales = query.order_by(Sale.saleDate.desc(), Sale.id.desc()).all()
+        return jsonify([sale_to_json(s, fields) for s in sales])
 
-@app.route('/api/sales/<int:sale_id>', methods=['GET'])
+    try:
+        page = paginate_keyset(query, Sale.saleDate, Sale.id, lambda sale: sale_to_json(sale, fields), descending=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@bp.route('/api/sales/<int:sale_id>', methods=['GET'])
 def get_sale(sale_id):
     sale = Sale.query.get_or_404(sale_id)
     return jsonify(sale_to_json(sale))
 
-@app.route('/api/sales/<int:sale_id>', methods=['PUT'])
+@bp.route('/api/sales/<int:sale_id>', methods=['PUT'])
 def update_sale_status(sale_id): # Por ahora solo actualiza el estado
     sale = Sale.query.get_or_404(sale_id)
     data = request.json
@@ -678,40 +3019,71 @@ def update_sale_status(sale_id): # Por ahora solo actualiza el estado
         return jsonify({'error': 'Se requiere un nuevo estado (status).'}), 400
 
     # Validar que el estado sea uno de los permitidos (opcional pero recomendado)
-    allowed_statuses = ["Contactado", "Armado", "Entregado", "Cobrado", "Cancelado"] # Añadir "Cancelado"
-    if new_status not in allowed_statuses:
-        return jsonify({'error': f'Estado "{new_status}" no válido. Estados permitidos: {", ".join(allowed_statuses)}'}), 400
-
-    # Lógica para restaurar stock si se cancela una venta que ya había descontado stock
-    # Esto asume que el stock se descuenta al crear la venta.
-    if new_status == "Cancelado" and sale.status != "Cancelado": # Si se está cancelando y no estaba ya cancelada
-        for item in sale.items:
-            product = Product.query.get(item.product_id)
-            if product:
-                product.stockActual += item.quantity
-        sale.status = new_status # Actualizar estado después de restaurar stock
-        db.session.commit()
-        return jsonify(sale_to_json(sale)) # Retornar venta actualizada
-    elif sale.status == "Cancelado" and new_status != "Cancelado": # Si se está reactivando una venta cancelada
-        # Verificar stock nuevamente antes de descontar
-        for item in sale.items:
-            product = Product.query.get(item.product_id)
-            if not product or product.stockActual < item.quantity:
-                 return jsonify({'error': f"No se puede reactivar la venta. Stock insuficiente para {product.name if product else 'ID '+str(item.product_id)}. Disponible: {product.stockActual if product else 'N/A'}, Requerido: {item.quantity}"}), 400
-        # Si hay stock, descontarlo
-        for item in sale.items:
-            product = Product.query.get(item.product_id) # Volver a obtener por si acaso
-            product.stockActual -= item.quantity
-        sale.status = new_status
-        db.session.commit()
-        return jsonify(sale_to_json(sale))
-
-    sale.status = new_status
+    if new_status not in SALE_STATUSES:
+        return jsonify({'error': f'Estado "{new_status}" no válido. Estados permitidos: {", ".join(SALE_STATUSES)}'}), 400
+
+    # Cancelar devuelve el stock de los items; reactivar una venta cancelada lo vuelve a descontar (si alcanza)
+    errors, changed, new_stock = transition_sales([sale], new_status)
+    if sale.id in errors:
+        return jsonify({'error': errors[sale.id]}), 400
+    if changed:
+        if new_stock:
+            update_catalog_stock_after_commit(new_stock) # Cambió el stock: actualiza el snapshot y las respuestas en caché con esos productos
+        publish_sale_changes('sale_status_changed', sale, new_stock, previousStatus=changed[0][1])
     db.session.commit()
     return jsonify(sale_to_json(sale))
 
 
-@app.route('/api/sales/<int:sale_id>', methods=['DELETE'])
+BULK_STATUS_MAX_SALES = 2000
+
+@bp.route('/api/sales/status', methods=['POST'])
+def bulk_update_sales_status():
+    """
+    Cambia el estado de muchas ventas en una sola transacción ({"sale_ids": [1, 2, ...], "status": "Entregado"}),
+    con las mismas reglas que PUT /api/sales/<id>. Responde el resultado de cada venta en el orden pedido:
+    updated, unchanged (ya tenía ese estado), not_found o failed (ej. sin stock para reactivarla).
+    """
+    data = request.get_json(silent=True) or {}
+    new_status = data.get('status')
+    if not new_status:
+        return jsonify({'error': 'Se requiere un nuevo estado (status).'}), 400
+    if new_status not in SALE_STATUSES:
+        return jsonify({'error': f'Estado "{new_status}" no válido. Estados permitidos: {", ".join(SALE_STATUSES)}'}), 400
+    sale_ids = data.get('sale_ids')
+    if (not isinstance(sale_ids, list) or not sale_ids
+            or not all(isinstance(sale_id, int) and not isinstance(sale_id, bool) for sale_id in sale_ids)):
+        return jsonify({'error': "Se requiere 'sale_ids': una lista de IDs de ventas."}), 400
+    sale_ids = list(dict.fromkeys(sale_ids)) # Sin repetidos, en el orden pedido
+    if len(sale_ids) > BULK_STATUS_MAX_SALES:
+        return jsonify({'error': f'Como máximo {BULK_STATUS_MAX_SALES} ventas por petición.'}), 400
+
+    # Ventas, items y clientes (para los eventos) en tres consultas, sin importar cuántas ventas sean
+    sales = {sale.id: sale for sale in Sale.query.options(selectinload(Sale.items), joinedload(Sale.client))
+             .filter(Sale.id.in_(sale_ids))}
+    errors, changed, new_stock = transition_sales([sales[sale_id] for sale_id in sale_ids if sale_id in sales], new_status)
+    if changed:
+        if new_stock:
+            update_catalog_stock_after_commit(new_stock) # Cambió el stock: actualiza el snapshot y las respuestas en caché con esos productos
+        publish_sales_changes('sale_status_changed',
+                              [(sale, {'previousStatus': previous_status}) for sale, previous_status in changed], new_stock)
+
+    # Resultados antes del commit: después las ventas quedan expiradas y leerlas haría una consulta por venta
+    previous_statuses = {sale.id: previous_status for sale, previous_status in changed}
+    results = []
+    for sale_id in sale_ids:
+        if sale_id not in sales:
+            results.append({'id': sale_id, 'result': 'not_found', 'error': 'Venta no encontrada.'})
+        elif sale_id in errors:
+            results.append({'id': sale_id, 'result': 'failed', 'status': sales[sale_id].status, 'error': errors[sale_id]})
+        elif sale_id in previous_statuses:
+            results.append({'id': sale_id, 'result': 'updated', 'status': new_status, 'previousStatus': previous_statuses[sale_id]})
+        else:
+            results.append({'id': sale_id, 'result': 'unchanged', 'status': new_status})
+    counts = {result: sum(1 for r in results if r['result'] == result) for result in ('updated', 'unchanged', 'not_found', 'failed')}
+    db.session.commit()
+    return jsonify({'status': new_status, **counts, 'results': results})
+
+@bp.route('/api/sales/<int:sale_id>', methods=['DELETE'])
 def delete_sale(sale_id):
     sale = Sale.query.get_or_404(sale_id)
 
@@ -720,11 +3092,14 @@ def delete_sale(sale_id):
     # Si se elimina una venta "Entregada" o "Cobrada", restaurar stock podría no ser lo correcto.
     # Por simplicidad, si se elimina una venta que no está Cancelada, restauramos stock.
     # Si ya estaba Cancelada, el stock ya debería haber sido restaurado por el PUT.
+    new_stock = {}
     if sale.status != "Cancelado":
-        for item in sale.items:
-            product = Product.query.get(item.product_id)
-            if product:
-                product.stockActual += item.quantity
+        # Un UPDATE atómico por lote de productos (no lee y reescribe el stock en Python)
+        new_stock = apply_stock_deltas(sale_product_quantities(sale))
+        update_catalog_stock_after_commit(new_stock) # Cambió el stock: actualiza el snapshot y las respuestas en caché con esos productos
+
+    apply_sale_to_aggregates(sale, sale.status, -1)
+    publish_sale_changes('sale_deleted', sale, new_stock)
 
     # Los SaleItems se eliminan en cascada debido a la configuración del modelo Sale.
     db.session.delete(sale)
@@ -732,204 +3107,936 @@ def delete_sale(sale_id):
     return jsonify({'message': 'Venta eliminada exitosamente.'})
 
 # --- API Endpoint para el Dashboard ---
-@app.route('/api/dashboard/summary', methods=['GET'])
-def get_dashboard_summary():
-    summary = {
-        'ventasEntregadas': {'count': 0, 'totalAmount': 0},
-        'ventasAEntregar': {'count': 0, 'totalAmount': 0}, # Contactado, Armado
-        'ventasPorArmar': {'count': 0, 'totalAmount': 0},   # Solo Contactado
-        'ventasCobradas': {'count': 0, 'totalAmount': 0},
-        'ventasACobrar': {'count': 0, 'totalAmount': 0}    # Entregado pero no Cobrado
-    }
-
-    sales_data = Sale.query.all()
-
-    for sale in sales_data:
-        if sale.status == 'Entregado':
-            summary['ventasEntregadas']['count'] += 1
-            summary['ventasEntregadas']['totalAmount'] += sale.totalAmount
-            if sale.status != 'Cobrado': # Asumiendo que "Cobrado" es un estado final y separado
-                summary['ventasACobrar']['count'] += 1
-                summary['ventasACobrar']['totalAmount'] += sale.totalAmount
-
-        if sale.status in ['Contactado', 'Armado']:
-            summary['ventasAEntregar']['count'] += 1
-            summary['ventasAEntregar']['totalAmount'] += sale.totalAmount
-            if sale.status == 'Contactado':
-                summary['ventasPorArmar']['count'] += 1
-                summary['ventasPorArmar']['totalAmount'] += sale.totalAmount
-
-        if sale.status == 'Cobrado':
-            summary['ventasCobradas']['count'] += 1
-            summary['ventasCobradas']['totalAmount'] += sale.totalAmount
-            # Si una venta está "Cobrada", también está "Entregada" implícitamente para algunos conteos.
-            # AGENTS.md: "Ventas Entregadas" y "Ventas Cobradas" son cards separadas.
-            # Re-evaluar si "Entregadas" debe incluir "Cobradas" o ser mutuamente excluyentes para las cards.
-            # Por ahora, si está Cobrada, la cuento en Cobradas. Si está Entregada (y no Cobrada), la cuento en Entregadas y A Cobrar.
-            # Si está Entregada Y Cobrada, se contará en ambas 'ventasEntregadas' (si no es mutuamente excluyente) y 'ventasCobradas'.
-            # Para evitar doble conteo en "Entregadas" si ya está "Cobrada", ajusto:
-            if sale.status == 'Cobrado' and summary['ventasEntregadas']['count'] > 0 and sale.status != 'Entregado':
-                 # Esta lógica es un poco confusa. Simplificando:
-                 # Entregada: status == 'Entregado' (puede o no estar cobrada)
-                 # A Entregar: status == 'Contactado' o 'Armado'
-                 # Por Armar: status == 'Contactado'
-                 # Cobrada: status == 'Cobrado'
-                 # A Cobrar: status == 'Entregado' Y status != 'Cobrado'
-                 pass # Ya se manejó arriba
-
-    # Re-calculo para mayor claridad y evitar doble conteo problemático
-    summary['ventasEntregadas'] = {'count': Sale.query.filter(Sale.status == 'Entregado').count(), 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Entregado').scalar() or 0}
-    summary['ventasAEntregar'] = {'count': Sale.query.filter(Sale.status.in_(['Contactado', 'Armado'])).count(), 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status.in_(['Contactado', 'Armado'])).scalar() or 0}
-    summary['ventasPorArmar'] = {'count': Sale.query.filter(Sale.status == 'Contactado').count(), 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Contactado').scalar() or 0}
-    summary['ventasCobradas'] = {'count': Sale.query.filter(Sale.status == 'Cobrado').count(), 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Cobrado').scalar() or 0}
-    summary['ventasACobrar'] = {'count': Sale.query.filter(Sale.status == 'Entregado').count(), 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Entregado').scalar() or 0}
-    # Nota: "Ventas a Cobrar" según AGENTS.md es "Entregado pero no Cobrado".
-    # El cálculo actual de 'ventasACobrar' es igual a 'ventasEntregadas'. Necesita ajuste.
-    # Lo correcto para 'ventasACobrar':
-
-    entregadas_no_cobradas_query = Sale.query.filter(Sale.status == 'Entregado') # AGENTS.md no especifica si "Cobrado" es un superestado de "Entregado"
-                                                                              # Asumiré que son estados distintos. Si una venta está "Cobrada", ya no está solo "Entregada".
-                                                                              # Si una venta puede estar "Entregada" Y "Cobrada" simultáneamente (ej. flags), la lógica cambia.
-                                                                              # Para el dashboard, "Ventas Entregadas" probablemente significa "Entregadas Y NO COBRADAS AÚN"
-                                                                              # o "Todas las que llegaron a estado Entregado o Cobrado".
-                                                                              # Asumiré que los estados son progresivos y excluyentes para las cards.
-                                                                              # Entregado (y no cobrado)
-                                                                              # Cobrado (implica entregado)
-
-    summary['ventasEntregadas'] = {'count': Sale.query.filter(Sale.status == 'Entregado').count(),
-                                   'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Entregado').scalar() or 0}
-    summary['ventasCobradas'] = {'count': Sale.query.filter(Sale.status == 'Cobrado').count(),
-                                 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Cobrado').scalar() or 0}
-    summary['ventasACobrar'] = summary['ventasEntregadas'] # Si "Entregadas" son las que están pendientes de cobro.
-                                                          # Si "Entregadas" es un estado que persiste aún después de "Cobrado", entonces A Cobrar es Entregadas - Cobradas.
-                                                          # Por simplicidad y según el texto "Ventas Entregadas" y "Ventas A Cobrar", parece que "Entregadas" son las que esperan cobro.
-
-    # Para mayor claridad según AGENTS.md:
+def dashboard_summary():
+    # Una sola lectura de la tabla de contadores por estado (a lo sumo una fila por estado),
+    # sin importar cuántas ventas haya en el historial.
+    counters = {c.status: c for c in SaleStatusCounter.query.all()}
+
+    def totals(*statuses):
+        return {
+            'count': sum(counters[st].count for st in statuses if st in counters),
+            'totalAmount': sum(counters[st].totalAmount for st in statuses if st in counters)
+        }
+
+    # Interpretación de AGENTS.md (estados progresivos y excluyentes):
     # - Ventas Entregadas: status == 'Entregado' (aún no cobradas)
     # - Ventas A Entregar: status == 'Contactado' OR status == 'Armado'
     # - Ventas Por Armar: status == 'Contactado'
     # - Ventas Cobradas: status == 'Cobrado'
-    # - Ventas A Cobrar: status == 'Entregado' (igual que "Ventas Entregadas" en este caso)
-
-    # Recalculando con esta interpretación:
-    summary['ventasEntregadas'] = {'count': Sale.query.filter(Sale.status == 'Entregado').count(),
-                                   'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Entregado').scalar() or 0}
-    summary['ventasAEntregar'] = {'count': Sale.query.filter(Sale.status.in_(['Contactado', 'Armado'])).count(),
-                                  'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status.in_(['Contactado', 'Armado'])).scalar() or 0}
-    summary['ventasPorArmar'] = {'count': Sale.query.filter(Sale.status == 'Contactado').count(),
-                                 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Contactado').scalar() or 0}
-    summary['ventasCobradas'] = {'count': Sale.query.filter(Sale.status == 'Cobrado').count(),
-                                 'totalAmount': db.session.query(db.func.sum(Sale.totalAmount)).filter(Sale.status == 'Cobrado').scalar() or 0}
-    summary['ventasACobrar'] = summary['ventasEntregadas'] # Reitero, esto es si 'Entregado' significa 'entregado y pendiente de cobro'.
+    # - Ventas A Cobrar: status == 'Entregado' (igual que "Ventas Entregadas")
+    summary = {
+        'ventasEntregadas': totals('Entregado'),
+        'ventasAEntregar': totals('Contactado', 'Armado'),
+        'ventasPorArmar': totals('Contactado'),
+        'ventasCobradas': totals('Cobrado'),
+        'ventasACobrar': totals('Entregado')
+    }
+    return summary
 
-    return jsonify(summary)
+@bp.route('/api/dashboard/summary', methods=['GET'])
+def get_dashboard_summary():
+    return jsonify(dashboard_summary())
+
+BOARD_DEFAULT_LIMIT = 10
+BOARD_MAX_LIMIT = 50
+
+@bp.route('/api/dashboard/sales_board', methods=['GET'])
+def get_sales_board():
+    """
+    Tablero Kanban agrupado por estado: para cada estado, cantidad y monto total (de los contadores)
+    y las `limit` ventas más recientes con un resumen de sus items. El tamaño de la respuesta y el
+    costo no dependen del historial: a lo sumo 5 * limit ventas, en tres consultas.
+    """
+    limit = request.args.get('limit', BOARD_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit or BOARD_DEFAULT_LIMIT, BOARD_MAX_LIMIT))
+
+    counters = {c.status: c for c in SaleStatusCounter.query.all()}
+
+    # Las N más recientes de cada estado. Cada rama es un recorrido acotado del índice
+    # (status, saleDate, id); un ROW_NUMBER() OVER (PARTITION BY status) tendría que numerar
+    # todas las ventas del historial antes de filtrar.
+    recent_per_status = [
+        db.select(Sale.id).where(Sale.status == status)
+        .order_by(Sale.saleDate.desc(), Sale.id.desc()).limit(limit).subquery()
+        for status in SALE_STATUSES
+    ]
+    board_ids = db.union_all(*[db.select(subquery.c.id) for subquery in recent_per_status]).subquery()
+    sales = db.session.execute(
+        db.select(Sale.id, Sale.client_id, Client.name.label('client_name'), Sale.saleDate, Sale.totalAmount, Sale.status)
+        .join(Client, Client.id == Sale.client_id)
+        .where(Sale.id.in_(db.select(board_ids.c.id)))
+        .order_by(Sale.saleDate.desc(), Sale.id.desc())
+    ).all()
+
+    # Resumen liviano de los items (producto y cantidad), con una sola consulta IN
+    items_by_sale = {}
+    if sales:
+        item_rows = db.session.execute(
+            db.select(SaleItem.sale_id, SaleItem.product_id, Product.name, SaleItem.quantity)
+            .join(Product, Product.id == SaleItem.product_id)
+            .where(SaleItem.sale_id.in_([sale.id for sale in sales]))
+            .order_by(SaleItem.sale_id, SaleItem.id)
+        )
+        for sale_id, product_id, product_name, quantity in item_rows:
+            items_by_sale.setdefault(sale_id, []).append(
+                {'product_id': product_id, 'product_name': product_name, 'quantity': quantity})
+
+    board = {
+        status: {
+            'count': counters[status].count if status in counters else 0,
+            'totalAmount': counters[status].totalAmount if status in counters else 0,
+            'sales': []
+        }
+        for status in SALE_STATUSES
+    }
+    for sale in sales:
+        board[sale.status]['sales'].append({
+            'id': sale.id,
+            'client_id': sale.client_id,
+            'client_name': sale.client_name,
+            'saleDate': sale.saleDate.isoformat(),
+            'totalAmount': sale.totalAmount,
+            'status': sale.status,
+            'items': items_by_sale.get(sale.id, [])
+        })
+    return jsonify({'limit': limit, 'statuses': SALE_STATUSES, 'board': board})
+
+# --- Copia de la base de datos para estadísticas (snapshot analítico) ---
+# Las estadísticas (/api/stats/*) leen de una copia consistente de la base de datos en lugar de la
+# base principal: las consultas pesadas no compiten con las ventas (mismo archivo, mismo caché de
+# páginas, checkpoints del WAL demorados por lecturas largas). Un hilo en segundo plano rehace la
+# copia cada ANALYTICS_SNAPSHOT_SECONDS con la API de backup de SQLite (una sola transacción de
+# lectura: con WAL no bloquea a los escritores). La copia se escribe en un archivo temporal y
+# reemplaza a la anterior de forma atómica; las lecturas en curso siguen con la copia que abrieron.
+# El archivo es compartido entre workers: lo rehace el primero que lo encuentra vencido.
+# Si la copia tiene más de ANALYTICS_MAX_STALENESS_SECONDS (ej. todavía no se creó, o el backup
+# falla) se lee la base principal. La respuesta indica la antigüedad de los datos en el header
+# X-Analytics-Snapshot-Age (segundos; 0 si se leyó la base principal).
+# El dashboard no usa la copia: es una lectura acotada y el tablero se recarga con cada evento de
+# venta (SSE), así que tiene que ver los cambios recién confirmados. Tampoco stock_summary: el stock
+# crítico y los agotados se usan para reponer durante la venta, y con la copia un producto recién
+# agotado tardaría hasta ANALYTICS_SNAPSHOT_SECONDS en aparecer. Solo lee la tabla de productos.
+
+class AnalyticsSnapshot:
+    """Hilo que mantiene actualizada la copia de una base SQLite y engine de solo lectura sobre ella."""
+
+    def __init__(self, source_path, snapshot_path, interval_seconds, busy_timeout_seconds, logger):
+        self.source_path = source_path
+        self.snapshot_path = snapshot_path
+        self.interval_seconds = interval_seconds
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.logger = logger
+        # immutable=1: SQLite no toma locks ni busca un WAL. Es seguro porque el archivo nunca se
+        # modifica: cada copia nueva es otro archivo (otro inodo) que lo reemplaza.
+        # NullPool: cada sesión abre una conexión nueva y así ve la copia más reciente.
+        self.engine = create_engine(f'sqlite:///file:{snapshot_path}?mode=ro&immutable=1&uri=true', poolclass=NullPool)
+        event.listen(self.engine, 'before_cursor_execute', record_sql_start)
+        event.listen(self.engine, 'after_cursor_execute', record_sql_end)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def age_seconds(self):
+        """Antigüedad de la copia actual (None si no existe). La fecha de modificación es la del inicio del backup."""
+        try:
+            return max(0.0, time.time() - os.stat(self.snapshot_path).st_mtime)
+        except FileNotFoundError:
+            return None
+
+    def ensure_refresher(self):
+        with self._lock:
+            # is_alive(): después de un fork el hilo del proceso padre no existe en el hijo
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='analytics-snapshot', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            age = self.age_seconds()
+            if age is None or age >= self.interval_seconds:
+                try:
+                    self.refresh()
+                except Exception: # El hilo no debe morir: se reintenta en el próximo intervalo
+                    self.logger.exception('No se pudo actualizar la copia para estadísticas')
+                age = self.age_seconds() or 0.0
+            time.sleep(max(1.0, self.interval_seconds - age))
+
+    def refresh(self, force=False):
+        """Rehace la copia si está vencida (o siempre, con `force`). Retorna True si la rehízo este proceso."""
+        with open(self.snapshot_path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False # Otro worker la está rehaciendo
+            age = self.age_seconds()
+            if not force and age is not None and age < self.interval_seconds:
+                return False # Otro worker la rehízo mientras tanto
+            started_at = time.time()
+            temp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+            source = sqlite3.connect(self.source_path, timeout=self.busy_timeout_seconds)
+            try:
+                target = sqlite3.connect(temp_path)
+                try:
+                    source.backup(target) # Todas las páginas en un solo paso: copia consistente
+                    target.execute('PRAGMA journal_mode = DELETE') # La copia es un único archivo, sin WAL
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            os.utime(temp_path, (started_at, started_at))
+            os.replace(temp_path, self.snapshot_path)
+            return True
+
+_analytics_snapshots = {} # Por archivo de la copia
+_analytics_snapshots_lock = threading.Lock()
+
+def analytics_snapshot():
+    """La copia configurada para la app actual, o None si está desactivada (o la base no es un archivo SQLite)."""
+    snapshot_path = current_app.config['ANALYTICS_SNAPSHOT_FILE']
+    if not snapshot_path or not current_app.config['ANALYTICS_SNAPSHOT_SECONDS']:
+        return None
+    with _analytics_snapshots_lock:
+        snapshot = _analytics_snapshots.get(snapshot_path)
+        if snapshot is None:
+            snapshot = _analytics_snapshots[snapshot_path] = AnalyticsSnapshot(
+                db.engine.url.database, snapshot_path, current_app.config['ANALYTICS_SNAPSHOT_SECONDS'],
+                current_app.config['SQLITE_PRAGMAS']['busy_timeout'] / 1000, current_app.logger)
+    return snapshot
+
+@contextmanager
+def analytics_session():
+    """Sesión para las consultas de estadísticas: sobre la copia si no está vencida, si no sobre la base principal."""
+    snapshot = analytics_snapshot()
+    age = None
+    if snapshot is not None:
+        snapshot.ensure_refresher()
+        age = snapshot.age_seconds()
+    if age is None or age > current_app.config['ANALYTICS_MAX_STALENESS_SECONDS']:
+        g.analytics_snapshot_age = 0.0
+        yield db.session
+        return
+    g.analytics_snapshot_age = age
+    with Session(snapshot.engine) as session:
+        yield session
+
+@bp.after_app_request
+def add_analytics_snapshot_age(response):
+    if 'analytics_snapshot_age' in g:
+        response.headers['X-Analytics-Snapshot-Age'] = f'{g.analytics_snapshot_age:.1f}'
+    return response
+
+@bp.cli.command('refresh-analytics-snapshot')
+def refresh_analytics_snapshot_command():
+    """Rehace ahora la copia de la base de datos que usan las estadísticas."""
+    snapshot = analytics_snapshot()
+    if snapshot is None:
+        print("La copia para estadísticas está desactivada (ANALYTICS_SNAPSHOT_SECONDS) o la base no es SQLite.")
+        return
+    snapshot.refresh(force=True)
+    print("Copia para estadísticas actualizada: " + snapshot.snapshot_path)
 
 # --- API Endpoints para Estadísticas ---
 
-@app.route('/api/stats/sales_over_time', methods=['GET'])
+# Formato de strftime de SQLite para agrupar los días del rollup en cada período.
+# 'week' no usa strftime: '%Y-W%W' parte en dos la semana que cruza el año nuevo (2024-W52 y 2025-W00),
+# así que se agrupa por la fecha del lunes de la semana (ver sales_period_key).
+SALES_PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': None,
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+def sales_period_key(period, date_column):
+    """Expresión SQL que agrupa `date_column` por período. Para 'week' es la fecha (YYYY-MM-DD) del lunes."""
+    if period != 'week':
+        return func.strftime(SALES_PERIOD_FORMATS[period], date_column)
+    # %w va de 0 (domingo) a 6: se retroceden (w + 6) % 7 días hasta el lunes
+    days_since_monday = (cast(func.strftime('%w', date_column), db.Integer) + 6) % 7
+    return func.date(date_column, '-' + cast(days_since_monday, db.String) + ' days')
+
+def sales_period_label(period, key):
+    """Etiqueta del período. Las semanas se muestran como semana ISO (ej. 2025-W01) a partir del lunes."""
+    if period != 'week':
+        return key
+    iso_year, iso_week, _ = datetime.date.fromisoformat(key).isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+# Cada estadística tiene una función que lee sus parámetros (`args`: request.args, o los parámetros
+# de un reporte en segundo plano como MultiDict) y lanza ValueError si son inválidos, y otra que la
+# calcula a partir de ellos. Las usan los endpoints y los reportes en segundo plano.
+
+def parse_date_arg(args, name):
+    """Lee un parámetro de fecha YYYY-MM-DD. Retorna None si no viene; lanza ValueError si es inválido."""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Parámetro '{name}' debe tener formato YYYY-MM-DD.")
+
+def sales_over_time_params(args):
+    period = args.get('period', 'month') # 'day', 'week', 'month', 'year'
+    if period not in SALES_PERIOD_FORMATS:
+        raise ValueError("Parámetro 'period' debe ser 'day', 'week', 'month' o 'year'.")
+    return {'period': period, 'date_from': parse_date_arg(args, 'from'), 'date_to': parse_date_arg(args, 'to')}
+
+def sales_over_time(period, date_from, date_to):
+    # Se lee el rollup diario (una fila por día con ventas, ya sin canceladas) en lugar de
+    # agrupar toda la tabla sale: el costo depende de la cantidad de días, no de ventas.
+    date_period = sales_period_key(period, SalesDailyRollup.date).label('date_period')
+    with analytics_session() as session:
+        query = session.query(
+            date_period,
+            func.sum(SalesDailyRollup.order_count).label('order_count'),
+            func.sum(SalesDailyRollup.total_sales).label('total_sales')
+        ).filter(SalesDailyRollup.order_count > 0)
+        if date_from:
+            query = query.filter(SalesDailyRollup.date >= date_from)
+        if date_to:
+            query = query.filter(SalesDailyRollup.date <= date_to)
+        rows = query.group_by(date_period).order_by(date_period).all()
+    return [{'period': sales_period_label(period, r.date_period), 'orderCount': r.order_count,
+             'totalSales': r.total_sales or 0} for r in rows]
+
+@bp.route('/api/stats/sales_over_time', methods=['GET'])
 def stats_sales_over_time():
-    period = request.args.get('period', 'month') # 'day', 'week', 'month', 'year'
-
-    # Solo considerar ventas que no estén canceladas para estadísticas financieras
-    base_query = Sale.query.filter(Sale.status != 'Cancelado')
-
-    results = []
-    if period == 'day':
-        # Agrupar por día: se usa strftime con SQLite. Para otros DBs, puede ser diferente.
-        # SQLite strftime: '%Y-%m-%d'
-        daily_sales = base_query.with_entities(
-            func.strftime('%Y-%m-%d', Sale.saleDate).label('date_period'),
-            func.count(Sale.id).label('order_count'),
-            func.sum(Sale.totalAmount).label('total_sales')
-        ).group_by('date_period').order_by('date_period').all()
-        results = [{'period': r.date_period, 'orderCount': r.order_count, 'totalSales': r.total_sales or 0} for r in daily_sales]
-
-    elif period == 'month':
-        # Agrupar por mes: '%Y-%m'
-        monthly_sales = base_query.with_entities(
-            func.strftime('%Y-%m', Sale.saleDate).label('date_period'),
-            func.count(Sale.id).label('order_count'),
-            func.sum(Sale.totalAmount).label('total_sales')
-        ).group_by('date_period').order_by('date_period').all()
-        results = [{'period': r.date_period, 'orderCount': r.order_count, 'totalSales': r.total_sales or 0} for r in monthly_sales]
-
-    elif period == 'year':
-        # Agrupar por año: '%Y'
-        yearly_sales = base_query.with_entities(
-            func.strftime('%Y', Sale.saleDate).label('date_period'),
-            func.count(Sale.id).label('order_count'),
-            func.sum(Sale.totalAmount).label('total_sales')
-        ).group_by('date_period').order_by('date_period').all()
-        results = [{'period': r.date_period, 'orderCount': r.order_count, 'totalSales': r.total_sales or 0} for r in yearly_sales]
-
-    # 'week' es más complejo con strftime puro y puede variar entre DBs.
-    # Para SQLite, strftime('%Y-%W') (semana del año) o strftime('%Y-%j')/7.
-    # Por simplicidad, omitiré 'week' por ahora o se puede implementar si es muy necesario.
-
-    return jsonify(results)
-
-@app.route('/api/stats/top_products', methods=['GET'])
-def stats_top_products():
-    by = request.args.get('by', 'quantity') # 'quantity' o 'value'
-    limit = request.args.get('limit', 5, type=int)
-
-    if by == 'quantity':
-        top_products_query = db.session.query(
-            Product.name,
-            func.sum(SaleItem.quantity).label('total_sold')
-        ).join(SaleItem.sale).filter(Sale.status != 'Cancelado').join(Product).group_by(Product.id).order_by(func.sum(SaleItem.quantity).desc()).limit(limit).all()
-        results = [{'productName': r.name, 'totalSold': r.total_sold or 0} for r in top_products_query]
-    elif by == 'value':
-        top_products_query = db.session.query(
-            Product.name,
-            func.sum(SaleItem.subtotal).label('total_value')
-        ).join(SaleItem.sale).filter(Sale.status != 'Cancelado').join(Product).group_by(Product.id).order_by(func.sum(SaleItem.subtotal).desc()).limit(limit).all()
-        results = [{'productName': r.name, 'totalValue': r.total_value or 0} for r in top_products_query]
+    try:
+        params = sales_over_time_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(sales_over_time(**params))
+
+def top_k_query(session, entity_model, total_model, daily_model, key_column, metric, limit, date_from, date_to):
+    """
+    Top-K de `entity_model` (Product o Client) por `metric`. Sin rango de fechas es una lectura por
+    índice de la tabla de totales; con from/to suma las filas por día de ese rango. El JOIN con la
+    entidad va antes del LIMIT: los agregados de un producto eliminado no ocupan lugares del top.
+    Retorna filas (name, value).
+    """
+    if date_from is None and date_to is None:
+        value = getattr(total_model, metric)
+        key = getattr(total_model, key_column)
+        query = session.query(entity_model.name, value.label('value')).join(entity_model, entity_model.id == key) \
+            .filter(value > 0).order_by(value.desc(), key)
     else:
-        return jsonify({'error': "Parámetro 'by' debe ser 'quantity' o 'value'."}), 400
-
-    return jsonify(results)
-
-@app.route('/api/stats/top_clients', methods=['GET'])
+        value = func.sum(getattr(daily_model, metric))
+        key = getattr(daily_model, key_column)
+        query = session.query(entity_model.name, value.label('value')).join(entity_model, entity_model.id == key)
+        if date_from:
+            query = query.filter(daily_model.date >= date_from)
+        if date_to:
+            query = query.filter(daily_model.date <= date_to)
+        query = query.group_by(key).having(value > 0).order_by(value.desc(), key)
+    return query.limit(limit).all()
+
+def top_products_params(args):
+    by = args.get('by', 'quantity') # 'quantity' o 'value'
+    if by not in ('quantity', 'value'):
+        raise ValueError("Parámetro 'by' debe ser 'quantity' o 'value'.")
+    return {'by': by, 'limit': args.get('limit', 5, type=int),
+            'date_from': parse_date_arg(args, 'from'), 'date_to': parse_date_arg(args, 'to')}
+
+def top_products(by, limit, date_from, date_to):
+    metric, result_key = ('units_sold', 'totalSold') if by == 'quantity' else ('revenue', 'totalValue')
+    with analytics_session() as session:
+        rows = top_k_query(session, Product, ProductSalesTotal, ProductDailySales, 'product_id', metric, limit, date_from, date_to)
+    return [{'productName': r.name, result_key: r.value or 0} for r in rows]
+
+@bp.route('/api/stats/top_products', methods=['GET'])
+def stats_top_products():
+    try:
+        params = top_products_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(top_products(**params))
+
+def top_clients_params(args):
+    by = args.get('by', 'frequency') # 'frequency' o 'value'
+    if by not in ('frequency', 'value'):
+        raise ValueError("Parámetro 'by' debe ser 'frequency' o 'value'.")
+    return {'by': by, 'limit': args.get('limit', 5, type=int),
+            'date_from': parse_date_arg(args, 'from'), 'date_to': parse_date_arg(args, 'to')}
+
+def top_clients(by, limit, date_from, date_to):
+    metric, result_key = ('order_count', 'orderCount') if by == 'frequency' else ('total_spent', 'totalSpent')
+    with analytics_session() as session:
+        rows = top_k_query(session, Client, ClientSalesTotal, ClientDailySales, 'client_id', metric, limit, date_from, date_to)
+    return [{'clientName': r.name, result_key: r.value or 0} for r in rows]
+
+@bp.route('/api/stats/top_clients', methods=['GET'])
 def stats_top_clients():
-    by = request.args.get('by', 'frequency') # 'frequency' o 'value'
-    limit = request.args.get('limit', 5, type=int)
-
-    if by == 'frequency':
-        top_clients_query = db.session.query(
-            Client.name,
-            func.count(Sale.id).label('order_count')
-        ).join(Sale.client).filter(Sale.status != 'Cancelado').group_by(Client.id).order_by(func.count(Sale.id).desc()).limit(limit).all()
-        results = [{'clientName': r.name, 'orderCount': r.order_count or 0} for r in top_clients_query]
-    elif by == 'value':
-        top_clients_query = db.session.query(
-            Client.name,
-            func.sum(Sale.totalAmount).label('total_spent')
-        ).join(Sale.client).filter(Sale.status != 'Cancelado').group_by(Client.id).order_by(func.sum(Sale.totalAmount).desc()).limit(limit).all()
-        results = [{'clientName': r.name, 'totalSpent': r.total_spent or 0} for r in top_clients_query]
-    else:
-        return jsonify({'error': "Parámetro 'by' debe ser 'frequency' o 'value'."}), 400
+    try:
+        params = top_clients_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(top_clients(**params))
 
-    return jsonify(results)
+def stock_summary_params(args):
+    return {} # Sin parámetros
 
-@app.route('/api/stats/stock_summary', methods=['GET'])
-def stats_stock_summary():
+def stock_summary():
+    # Stock actual de la base principal, no de la copia para estadísticas (ver AnalyticsSnapshot)
     critical_stock_products = Product.query.filter(Product.stockActual > 0, Product.stockActual <= Product.stockCritico).order_by(Product.stockActual).all()
     out_of_stock_products = Product.query.filter(Product.stockActual == 0).order_by(Product.name).all()
-
-    return jsonify({
+    return {
         'criticalStock': [product_to_json(p) for p in critical_stock_products],
         'outOfStock': [product_to_json(p) for p in out_of_stock_products]
-    })
+    }
+
+@bp.route('/api/stats/stock_summary', methods=['GET'])
+def stats_stock_summary():
+    return jsonify(stock_summary(**stock_summary_params(request.args)))
+
+# --- Exportación en streaming (NDJSON/CSV) ---
+# Las exportaciones no arman la lista completa en memoria: la consulta se lee de a EXPORT_BATCH_SIZE
+# filas (yield_per) y cada lote se escribe en la respuesta apenas está listo. La memoria queda
+# constante aunque se exporten millones de filas y el primer byte llega sin esperar al final.
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+SALE_EXPORT_FIELDS = ('id', 'saleDate', 'client_id', 'client_name', 'status', 'totalAmount')
+SALE_ITEM_EXPORT_FIELDS = ('sale_id', 'saleDate', 'status', 'client_id', 'client_name', 'id',
+                           'product_id', 'product_name', 'quantity', 'price_at_sale', 'subtotal')
+PRODUCT_EXPORT_FIELDS = ('id', 'externalCode', 'name', 'priceRevista', 'priceShowroom', 'priceFeria',
+                         'stockActual', 'stockCritico', 'imageUrl', 'catalogImageUrl', 'catalogPrice',
+                         'tag_ids', 'category_ids')
+
+def parse_export_format(args):
+    export_format = args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        raise ValueError("Parámetro 'format' debe ser 'ndjson' o 'csv'.")
+    return export_format
+
+def filter_sales_for_export(statement, args):
+    """Aplica los filtros ?from=YYYY-MM-DD, ?to=YYYY-MM-DD (inclusive) y ?status=A,B. Lanza ValueError si son inválidos."""
+    date_from = parse_date_arg(args, 'from')
+    date_to = parse_date_arg(args, 'to')
+    # saleDate se compara como texto (igual que en la paginación): las filas guardadas con
+    # current_timestamp no tienen microsegundos y una comparación contra un datetime las dejaría afuera.
+    sale_date_text = type_coerce(Sale.saleDate, db.String)
+    if date_from:
+        statement = statement.where(sale_date_text >= date_from.isoformat())
+    if date_to:
+        statement = statement.where(sale_date_text < (date_to + datetime.timedelta(days=1)).isoformat())
+    statuses = [status.strip() for status in args.get('status', '').split(',') if status.strip()]
+    if statuses:
+        statement = statement.where(Sale.status.in_(statuses))
+    return statement
+
+def export_value(value):
+    """Convierte un valor de la consulta a uno serializable (fechas en ISO 8601)."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+def export_chunks(statement, fields, export_format, to_record=None):
+    """
+    Genera el archivo lote por lote: (texto, filas del lote). `to_record` permite ajustar cada fila
+    (dict) antes de escribirla.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+        yield buffer.getvalue(), 0 # El encabezado sale antes de ejecutar la consulta
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    try:
+        for partition in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            for row in partition:
+                record = {field: export_value(value) for field, value in zip(fields, row)}
+                if to_record:
+                    record = to_record(record)
+                if writer:
+                    # Listas de IDs como "1|2", el mismo formato que acepta la importación
+                    writer.writerow(['|'.join(map(str, value)) if isinstance(value, list) else value
+                                     for value in record.values()])
+                else:
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue(), len(partition)
+    finally:
+        result.close()
+
+def export_response(statement, fields, export_format, filename, to_record=None):
+    """Respuesta que envía el archivo a medida que se genera cada lote."""
+    def generate():
+        for text, _ in export_chunks(statement, fields, export_format, to_record):
+            yield text
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{export_format}'
+    return response
+
+# Cada exportación arma su consulta a partir de los parámetros (`args`, como en las estadísticas) y retorna
+# (consulta, campos, formato, nombre de archivo, to_record); lanza ValueError si un parámetro es inválido.
+# Las usan los endpoints de exportación y los reportes en segundo plano.
+
+def sales_export_query(args):
+    export_format = parse_export_format(args)
+    statement = filter_sales_for_export(
+        db.select(Sale.id, Sale.saleDate, Sale.client_id, Client.name, Sale.status, Sale.totalAmount)
+        .join(Client, Client.id == Sale.client_id),
+        args
+    )
+    return statement.order_by(Sale.saleDate, Sale.id), SALE_EXPORT_FIELDS, export_format, 'ventas', None
+
+def sale_items_export_query(args):
+    """Una fila por item vendido, con los datos de su venta repetidos (cómodo para planillas)."""
+    export_format = parse_export_format(args)
+    statement = filter_sales_for_export(
+        db.select(Sale.id, Sale.saleDate, Sale.status, Sale.client_id, Client.name, SaleItem.id,
+                  SaleItem.product_id, Product.name, SaleItem.quantity, SaleItem.price_at_sale, SaleItem.subtotal)
+        .join(Client, Client.id == Sale.client_id)
+        .join(SaleItem, SaleItem.sale_id == Sale.id)
+        .join(Product, Product.id == SaleItem.product_id),
+        args
+    )
+    statement = statement.order_by(Sale.saleDate, Sale.id, SaleItem.id)
+    return statement, SALE_ITEM_EXPORT_FIELDS, export_format, 'ventas_items', None
+
+@bp.route('/api/export/sales', methods=['GET'])
+def export_sales():
+    try:
+        return export_response(*sales_export_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/api/export/sale_items', methods=['GET'])
+def export_sale_items():
+    try:
+        return export_response(*sale_items_export_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def related_ids_column(table, column):
+    """IDs asociados a cada producto como texto "1|2" (subconsulta correlacionada, sin cargar relaciones)."""
+    return db.select(func.group_concat(getattr(table.c, column), '|')) \
+        .where(table.c.product_id == Product.id).scalar_subquery()
+
+def product_export_record(record):
+    for field in ('tag_ids', 'category_ids'):
+        record[field] = [int(value) for value in record[field].split('|')] if record[field] else []
+    return record
+
+def products_export_query(args):
+    """El catálogo en el mismo formato que acepta POST /api/products/import."""
+    export_format = parse_export_format(args)
+    statement = db.select(
+        Product.id, Product.externalCode, Product.name, Product.priceRevista, Product.priceShowroom,
+        Product.priceFeria, Product.stockActual, Product.stockCritico, Product.imageUrl,
+        Product.catalogImageUrl, Product.catalogPrice,
+        related_ids_column(product_tags_table, 'tag_id'),
+        related_ids_column(product_categories_table, 'category_id'),
+    ).order_by(Product.id)
+    return statement, PRODUCT_EXPORT_FIELDS, export_format, 'productos', product_export_record
+
+@bp.route('/api/export/products', methods=['GET'])
+def export_products():
+    try:
+        return export_response(*products_export_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# --- Reportes en segundo plano (jobs) ---
+# Los reportes pesados (estadísticas de todo el historial, exportaciones grandes) se pueden pedir como
+# job: POST /api/reports responde enseguida con un id y el reporte se genera en un pool de hilos del
+# proceso (REPORT_WORKERS), sin ocupar el hilo de la petición. El estado y el resultado se guardan en
+# REPORTS_DIR (`<id>.json` y `<id>.result`), compartido entre workers: cualquiera responde el estado
+# y sirve el resultado.
+# El id es un hash del reporte y sus parámetros: el mismo pedido mientras se genera devuelve el mismo
+# job, y mientras el resultado tenga menos de REPORT_RESULT_TTL_SECONDS se sirve el guardado (con
+# "refresh": true se vuelve a generar). Los resultados vencidos se borran al pedir reportes.
+# Mientras un job está en cola o generándose, su proceso toca el archivo de estado cada
+# REPORT_HEARTBEAT_SECONDS; si el proceso muere, el job queda abandonado y el próximo pedido lo reencola.
+
+REPORT_HEARTBEAT_SECONDS = 10
+REPORT_ABANDONED_SECONDS = 60
+REPORT_PROGRESS_INTERVAL_SECONDS = 1 # Cada cuánto se guarda el progreso de una exportación
+
+# Los reportes de estadísticas llaman a las mismas funciones que los endpoints (parámetros, cálculo);
+# las exportaciones escriben el archivo lote por lote e informan el progreso (filas escritas sobre el total).
+REPORT_STATS = {
+    'sales_over_time': (sales_over_time_params, sales_over_time),
+    'top_products': (top_products_params, top_products),
+    'top_clients': (top_clients_params, top_clients),
+    'stock_summary': (stock_summary_params, stock_summary),
+}
+REPORT_EXPORTS = {
+    'export_sales': sales_export_query,
+    'export_sale_items': sale_items_export_query,
+    'export_products': products_export_query,
+}
+REPORT_JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+def report_job_id(report, params):
+    key = json.dumps({'report': report, 'params': params}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+class ReportJobRunner:
+    """Pool de hilos que genera los reportes de este proceso y mantiene el heartbeat de sus jobs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._active = {} # id del job -> archivo de estado
+
+    def submit(self, job_id, status_path, run, max_workers):
+        with self._lock:
+            if self._pid != os.getpid(): # Primer uso, o proceso hijo después de un fork: hilos propios
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+                self._active = {}
+                threading.Thread(target=self._heartbeat, name='report-heartbeat', daemon=True).start()
+            self._active[job_id] = status_path
+        self._executor.submit(self._run, job_id, run)
+
+    def _run(self, job_id, run):
+        try:
+            run()
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(REPORT_HEARTBEAT_SECONDS)
+            with self._lock:
+                paths = list(self._active.values())
+            for path in paths:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+
+report_job_runner = ReportJobRunner()
+_reports_lock = threading.Lock()
+
+@contextmanager
+def reports_lock(directory):
+    """Exclusión entre hilos y entre workers para crear, reencolar y borrar jobs."""
+    os.makedirs(directory, exist_ok=True)
+    with _reports_lock, open(os.path.join(directory, '.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def report_file(directory, job_id, suffix):
+    return os.path.join(directory, job_id + suffix)
+
+def read_report_job(directory, job_id):
+    try:
+        with open(report_file(directory, job_id, '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_report_job(directory, job):
+    path = report_file(directory, job['id'], '.json')
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(temp_path, path) # Reemplazo atómico: nunca se lee un estado a medio escribir
+
+def report_job_expired(job, ttl_seconds):
+    return job['status'] in ('done', 'failed') and time.time() - job['finishedAt'] > ttl_seconds
+
+def report_job_abandoned(directory, job):
+    if job['status'] not in ('queued', 'running'):
+        return False
+    try:
+        return time.time() - os.stat(report_file(directory, job['id'], '.json')).st_mtime > REPORT_ABANDONED_SECONDS
+    except FileNotFoundError:
+        return True
+
+def remove_report_job(directory, job_id):
+    for suffix in ('.json', '.result'):
+        try:
+            os.remove(report_file(directory, job_id, suffix))
+        except FileNotFoundError:
+            pass
+
+def evict_expired_reports(directory, ttl_seconds):
+    """Borra los resultados vencidos, los jobs abandonados hace más de `ttl_seconds` y los temporales huérfanos."""
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.tmp'):
+            try:
+                if now - os.stat(path).st_mtime > ttl_seconds:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        elif name.endswith('.json'):
+            job = read_report_job(directory, name[:-len('.json')])
+            if job is None:
+                continue
+            try:
+                abandoned_for = now - os.stat(path).st_mtime if job['status'] in ('queued', 'running') else 0
+            except FileNotFoundError:
+                continue
+            if report_job_expired(job, ttl_seconds) or abandoned_for > ttl_seconds:
+                remove_report_job(directory, job['id'])
+
+def timestamp_to_iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat() if timestamp else None
+
+def report_job_to_json(job, ttl_seconds):
+    data = {
+        'id': job['id'],
+        'report': job['report'],
+        'params': job['params'],
+        'status': job['status'], # queued, running, done o failed
+        'rowsDone': job['rowsDone'],
+        'rowsTotal': job['rowsTotal'],
+        'createdAt': timestamp_to_iso(job['createdAt']),
+        'startedAt': timestamp_to_iso(job['startedAt']),
+        'finishedAt': timestamp_to_iso(job['finishedAt']),
+        'error': job['error'],
+    }
+    if job['status'] == 'done':
+        data['progress'] = 1.0
+    elif job['rowsTotal']:
+        data['progress'] = round(min(job['rowsDone'] / job['rowsTotal'], 1.0), 3)
+    else:
+        data['progress'] = 0.0
+    if job['status'] == 'done':
+        data['resultUrl'] = f"/api/reports/{job['id']}/result"
+        data['resultBytes'] = job['resultBytes']
+        data['expiresAt'] = timestamp_to_iso(job['finishedAt'] + ttl_seconds)
+    return data
+
+def run_report_job(app, job):
+    """Genera el reporte (en un hilo del pool) con sus parámetros, igual que lo haría el endpoint."""
+    directory = app.config['REPORTS_DIR']
+    result_path = report_file(directory, job['id'], '.result')
+    temp_path = f'{result_path}.{os.getpid()}.tmp'
+    args = MultiDict(job['params']) # Se leen como el query string del endpoint (ej. args.get('limit', type=int))
+    with app.app_context():
+        job.update(status='running', startedAt=time.time())
+        write_report_job(directory, job)
+        try:
+            if job['report'] in REPORT_EXPORTS:
+                statement, fields, export_format, filename, to_record = REPORT_EXPORTS[job['report']](args)
+                job['rowsTotal'] = db.session.scalar(
+                    db.select(func.count()).select_from(statement.order_by(None).subquery()))
+                job.update(mimetype=EXPORT_MIMETYPES[export_format], filename=f'{filename}.{export_format}')
+                write_report_job(directory, job)
+                last_progress_at = time.monotonic()
+                with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+                    for text, rows in export_chunks(statement, fields, export_format, to_record):
+                        f.write(text)
+                        job['rowsDone'] += rows
+                        if time.monotonic() - last_progress_at >= REPORT_PROGRESS_INTERVAL_SECONDS:
+                            write_report_job(directory, job)
+                            last_progress_at = time.monotonic()
+            else:
+                parse_params, compute = REPORT_STATS[job['report']]
+                result = compute(**parse_params(args))
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(current_app.json.dumps(result))
+                job.update(mimetype='application/json', filename=f"{job['report']}.json")
+            os.replace(temp_path, result_path)
+            job.update(status='done', resultBytes=os.path.getsize(result_path))
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if isinstance(e, ValueError): # Parámetros inválidos: mismo mensaje que daría el endpoint
+                job['error'] = str(e)
+            else:
+                app.logger.exception('Error al generar el reporte %s', job['id'])
+                job['error'] = 'Error interno al generar el reporte.'
+            job['status'] = 'failed'
+        job['finishedAt'] = time.time()
+        write_report_job(directory, job)
+
+@bp.route('/api/reports', methods=['POST'])
+def submit_report():
+    data = request.get_json(silent=True)
+    report = data.get('report') if isinstance(data, dict) else None
+    if report not in REPORT_STATS and report not in REPORT_EXPORTS:
+        available = ', '.join(sorted(REPORT_STATS) + sorted(REPORT_EXPORTS))
+        return jsonify({'error': f"Parámetro 'report' inválido. Reportes disponibles: {available}"}), 400
+    params = data.get('params') or {}
+    if not isinstance(params, dict) or not all(isinstance(value, (str, int, float)) for value in params.values()):
+        return jsonify({'error': "'params' debe ser un objeto con los parámetros del reporte (ej. {\"period\": \"year\"})."}), 400
+    # Los mismos parámetros que aceptaría el endpoint como query string. Los vacíos no cuentan
+    # (ej. {"from": ""} es el mismo reporte que sin "from").
+    params = {str(key): str(value) for key, value in params.items() if str(value) != ''}
+
+    directory = current_app.config['REPORTS_DIR']
+    ttl_seconds = current_app.config['REPORT_RESULT_TTL_SECONDS']
+    job_id = report_job_id(report, params)
+    with reports_lock(directory):
+        evict_expired_reports(directory, ttl_seconds)
+        job = read_report_job(directory, job_id)
+        if (job is None or job['status'] == 'failed' or report_job_abandoned(directory, job)
+                or (job['status'] == 'done' and data.get('refresh') is True)):
+            job = {'id': job_id, 'report': report, 'params': params, 'status': 'queued', 'rowsDone': 0, 'rowsTotal': None,
+                   'createdAt': time.time(), 'startedAt': None, 'finishedAt': None, 'error': None,
+                   'mimetype': None, 'filename': None, 'resultBytes': None}
+            write_report_job(directory, job)
+            app = current_app._get_current_object()
+            report_job_runner.submit(job_id, report_file(directory, job_id, '.json'),
+                                     lambda: run_report_job(app, dict(job)), current_app.config['REPORT_WORKERS'])
+    # 200 si el resultado ya está (guardado de un pedido anterior), 202 si se está generando
+    return jsonify(report_job_to_json(job, ttl_seconds)), 200 if job['status'] == 'done' else 202
+
+def find_report_job(job_id):
+    """El job `job_id` si existe y no venció, o None."""
+    if not REPORT_JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    job = read_report_job(current_app.config['REPORTS_DIR'], job_id)
+    if job is None or report_job_expired(job, current_app.config['REPORT_RESULT_TTL_SECONDS']):
+        return None
+    return job
+
+@bp.route('/api/reports/<job_id>', methods=['GET'])
+def get_report(job_id):
+    job = find_report_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Reporte no encontrado o vencido.'}), 404
+    return jsonify(report_job_to_json(job, current_app.config['REPORT_RESULT_TTL_SECONDS']))
+
+@bp.route('/api/reports/<job_id>/result', methods=['GET'])
+def get_report_result(job_id):
+    job = find_report_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Reporte no encontrado o vencido.'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"El reporte todavía no está listo (estado: {job['status']}).",
+                        'job': report_job_to_json(job, current_app.config['REPORT_RESULT_TTL_SECONDS'])}), 409
+    return send_file(report_file(current_app.config['REPORTS_DIR'], job_id, '.result'), mimetype=job['mimetype'],
+                     as_attachment=job['report'] in REPORT_EXPORTS, download_name=job['filename'], max_age=0)
 
 # Función para crear la base de datos y tablas
-def create_db():
+def create_db(app):
     with app.app_context():
         db.create_all()
     print("Base de datos y tablas creadas en: " + app.config['SQLALCHEMY_DATABASE_URI'])
 
+# Columnas agregadas a tablas existentes: create_all() crea tablas nuevas pero no altera las que ya existen
+SCHEMA_ADDED_COLUMNS = [
+    ('product', 'externalCode', 'VARCHAR(50)'),
+    ('client_sales_total', 'first_purchase', 'DATE'),
+    ('client_sales_total', 'last_purchase', 'DATE'),
+]
+
+def upgrade_db():
+    """Actualiza una base de datos existente al esquema actual. Es idempotente: se puede ejecutar siempre."""
+    db.create_all() # Tablas nuevas
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table_name, column_name, column_type in SCHEMA_ADDED_COLUMNS:
+            existing_columns = {column['name'] for column in inspector.get_columns(table_name)}
+            if column_name not in existing_columns:
+                connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN "{column_name}" {column_type}'))
+    # Índices declarados en los modelos que falten en tablas que ya existían
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    # Actualiza las estadísticas que usa el planificador de consultas para elegir índices
+    with db.engine.begin() as connection:
+        connection.execute(text('PRAGMA optimize'))
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Crea tablas, columnas e índices nuevos en una base de datos existente."""
+    upgrade_db()
+    print("Base de datos actualizada: " + current_app.config['SQLALCHEMY_DATABASE_URI'])
+
+# --- Fábrica de la aplicación ---
+# Importar este módulo no crea la app, no abre la base de datos ni escribe archivos: todo eso lo
+# hace create_app(). Cada worker del servidor (ver wsgi.py y gunicorn.conf.py) crea su propia app
+# y su propio pool de conexiones SQLite.
+
+def apply_sqlite_storage_profile(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        # Las transacciones las abre begin_sqlite_transaction (el driver no emite su propio BEGIN)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        cursor.close()
+    return on_connect
+
+def begin_sqlite_transaction(connection):
+    """
+    Las peticiones que escriben toman el lock de escritura al empezar (BEGIN IMMEDIATE). Con un
+    BEGIN común la transacción empieza leyendo y, si otro proceso escribió mientras tanto, SQLite
+    no puede esperar al pasar a escribir: falla con "database is locked" sin respetar busy_timeout.
+    Las lecturas (GET) siguen usando BEGIN común y no bloquean a nadie (WAL).
+    """
+    immediate = has_request_context() and request.method not in ('GET', 'HEAD', 'OPTIONS')
+    connection.exec_driver_sql('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+
+def dispose_engine_after_fork(app):
+    """
+    Un proceso hijo (ej. un worker de gunicorn con preload_app) no debe usar las conexiones
+    SQLite que abrió el proceso padre: se descartan sin cerrarlas (siguen siendo del padre)
+    y el hijo abre las suyas.
+    """
+    def dispose():
+        with app.app_context():
+            db.engine.dispose(close=False)
+    if hasattr(os, 'register_at_fork'): # No existe en Windows, donde tampoco hay fork
+        os.register_at_fork(after_in_child=dispose)
+
+def create_app(config=None):
+    """Crea la aplicación. `config` (ej. en benchmarks) tiene prioridad sobre el entorno y los valores por defecto."""
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_prefixed_env() # FLASK_<CLAVE>=valor (los valores se interpretan como JSON si se puede)
+    for key in ('DATABASE_URL', 'JSON_ENCODER'):
+        if os.environ.get(key):
+            app.config[key] = os.environ[key]
+    if config:
+        app.config.from_mapping(config)
+
+    # La carpeta 'instance' guarda el SQLite por defecto y los archivos de versión
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.config.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(app.instance_path, 'database.db'))
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', app.config['DATABASE_URL'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', sqlite_engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLITE_PRAGMAS']))
+    # Archivos cuya fecha de modificación marca la versión de la configuración y del catálogo. Cada
+    # proceso compara esa fecha (un stat, sin consultar la DB) para saber si su copia en memoria quedó vieja.
+    app.config.setdefault('CONFIG_VERSION_FILE', os.path.join(app.instance_path, 'config.version'))
+    app.config.setdefault('CATALOG_VERSION_FILE', os.path.join(app.instance_path, 'catalog.version'))
+    app.config.setdefault('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+    app.config.setdefault('REPORTS_DIR', os.path.join(app.instance_path, 'reports'))
+    # Eventos del feed en vivo compartidos entre workers (None lo desactiva: cada worker solo reparte los suyos)
+    app.config.setdefault('CHANGE_FEED_FILE', os.path.join(app.instance_path, 'changes.log'))
+    app.config.setdefault('ANALYTICS_SNAPSHOT_FILE', analytics_snapshot_path(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    CORS(app) # Habilitar CORS para todas las rutas
+    if orjson is not None and app.config['JSON_ENCODER'] == 'orjson':
+        app.json = OrjsonJSONProvider(app)
+    catalog_cache.max_size = app.config['CATALOG_CACHE_SIZE']
+    validate_client_level_rules(app.config['CLIENT_LEVEL_RULES'])
+
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', apply_sqlite_storage_profile(app.config['SQLITE_PRAGMAS']))
+            event.listen(db.engine, 'begin', begin_sqlite_transaction)
+        event.listen(db.engine, 'before_cursor_execute', record_sql_start)
+        event.listen(db.engine, 'after_cursor_execute', record_sql_end)
+    dispose_engine_after_fork(app)
+
+    app.register_blueprint(bp)
+    return app
+
 if __name__ == '__main__':
+    # Servidor de desarrollo (un solo proceso). Para ferias y producción usar gunicorn (ver README).
+    app = create_app()
+    reset_metrics_files(app.config['METRICS_DIR']) # Las métricas empiezan de cero en cada arranque
     # Descomentar la siguiente línea SOLO la primera vez para crear la DB, o cuando se añadan nuevos modelos.
     # Luego comentar para evitar recrear la DB cada vez que se inicia el servidor.
-    # create_db()
-    app.run(debug=True, port=5000)
+    # create_db(app)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=5000)
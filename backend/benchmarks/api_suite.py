@@ -0,0 +1,588 @@
+"""
+Suite de benchmarks de la API sobre datos sintéticos (ver datagen.py).
+
+Recorre todas las rutas de backend/app.py con escenarios realistas (búsqueda y filtros del
+catálogo, dashboard, estadísticas, listados paginados, exportaciones, creación de ventas con
+varios hilos a la vez, etc.) y reporta por escenario latencia p50/p95/p99, throughput y el pico de
+memoria de una petición. Si alguna ruta de la app no tiene escenario, la suite falla: al agregar
+una ruta hay que agregar su escenario en SCENARIOS.
+
+Por defecto usa el test client de Flask en este proceso, sobre una copia de la base generada
+(las rutas que escriben no modifican la base cacheada). Con --base-url mide un servidor ya
+levantado, que debe usar una base generada con los mismos parámetros.
+
+Comparación contra una línea base:
+    --save-baseline FILE  guarda los resultados de esta corrida como línea base.
+    --baseline FILE       compara contra esa línea base y termina con código 1 si algún escenario
+                          empeoró más que --tolerance (p50, throughput o memoria; el p95, que
+                          es más ruidoso, con el doble de tolerancia).
+La línea base depende de la máquina: conviene generarla en la misma máquina donde se compara.
+
+Uso (desde la raíz del proyecto):
+    python backend/benchmarks/api_suite.py --scale 0.01 --save-baseline /tmp/base.json
+    python backend/benchmarks/api_suite.py --scale 0.01 --baseline /tmp/base.json
+    python backend/benchmarks/api_suite.py --only catalog,stats
+"""
+import os
+import sys
+import json
+import gc
+import time
+import zlib
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import tracemalloc
+import statistics
+import urllib.error
+import urllib.request
+
+try:
+    import resource # Solo Unix: pico de memoria (RSS) del proceso
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen
+
+# Diferencias por debajo de estos valores se consideran ruido aunque superen la tolerancia
+MIN_LATENCY_REGRESSION_MS = 3.0
+MIN_MEMORY_REGRESSION_KB = 256
+
+# --- Clientes HTTP ---
+
+class TestClientDriver:
+    """Peticiones con el test client de Flask (un cliente por hilo)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, url, json_body=None, data=None, headers=None, first_chunk_only=False):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(url, method=method, json=json_body, data=data, headers=headers,
+                               buffered=not first_chunk_only)
+        if first_chunk_only: # Streams sin fin (ej. /api/events): solo hasta el primer bloque
+            size = len(next(iter(response.response), b''))
+            response.close()
+            return response.status_code, size
+        return response.status_code, len(response.get_data())
+
+class HttpDriver:
+    """Peticiones HTTP a un servidor ya levantado."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, json_body=None, data=None, headers=None, first_chunk_only=False):
+        headers = dict(headers or {})
+        if json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        http_request = urllib.request.Request(self.base_url + url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(http_request, timeout=120) as response:
+                body = response.read(1024) if first_chunk_only else response.read()
+                return response.status, len(body)
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+# --- Escenarios ---
+
+class Scenario:
+    """
+    `build(ctx, i)` arma la petición número i: dict con method, url y opcionalmente json, data,
+    headers. `prepare(ctx, count)` (opcional) corre antes de medir, sin contar en los tiempos
+    (ej. crear los registros que después se borran) y lo que retorna queda en ctx.prepared.
+    """
+
+    def __init__(self, name, endpoint, build, requests=100, threads=1, expected=(200,), prepare=None,
+                 first_chunk_only=False):
+        self.name = name
+        self.endpoint = endpoint
+        self.build = build
+        self.requests = requests
+        self.threads = threads
+        self.expected = expected
+        self.prepare = prepare
+        self.first_chunk_only = first_chunk_only
+
+class Context:
+    def __init__(self, driver, params, seed):
+        self.driver = driver
+        self.params = params
+        self.rng = random.Random(seed)
+        self.prepared = None
+        self.end_date = datetime.date.fromisoformat(params['end_date'])
+
+    def product_id(self):
+        return self.rng.randint(1, self.params['products'])
+
+    def client_id(self):
+        return self.rng.randint(1, self.params['clients'])
+
+    def sale_id(self):
+        return self.rng.randint(1, self.params['sales'])
+
+    def date_range(self, days):
+        """Rango (from, to) de `days` días que termina en un día al azar del historial."""
+        end = self.end_date - datetime.timedelta(days=self.rng.randrange(365 * self.params['years'] - days))
+        return (end - datetime.timedelta(days=days)).isoformat(), end.isoformat()
+
+SEARCH_WORDS = [word.lower() for word in datagen.PRODUCT_TYPES + datagen.PRODUCT_LINES + datagen.PRODUCT_VARIANTS]
+
+def catalog_search(ctx, i):
+    words = ctx.rng.sample(SEARCH_WORDS, ctx.rng.choice([1, 1, 2]))
+    # A veces se busca mientras se escribe (prefijo)
+    term = ' '.join(word[:ctx.rng.randint(3, len(word))] if len(word) > 3 else word for word in words)
+    scope = '&search_scope=all' if ctx.rng.random() < 0.3 else ''
+    return {'method': 'GET', 'url': f'/api/catalog?search_term={urllib.request.quote(term)}{scope}'}
+
+def client_search(ctx, i):
+    """Búsqueda del selector de clientes: lo que se lleva escrito de un nombre, con un error de tipeo o parte de un WhatsApp."""
+    kind = ctx.rng.choice(['prefix', 'prefix', 'full_name', 'typo', 'phone'])
+    if kind == 'phone':
+        term = str(ctx.rng.randint(1000, 9999))
+    elif kind == 'full_name':
+        term = f'{ctx.rng.choice(datagen.FIRST_NAMES)} {ctx.rng.choice(datagen.LAST_NAMES)[:3]}'
+    else:
+        word = ctx.rng.choice(datagen.FIRST_NAMES + datagen.LAST_NAMES)
+        if kind == 'typo':
+            position = ctx.rng.randrange(1, len(word))
+            term = word[:position] + word[position + 1:] # Una letra de menos
+        else:
+            term = word[:ctx.rng.randint(2, len(word))]
+    return {'method': 'GET', 'url': f'/api/clients/search?q={urllib.request.quote(term)}&fields=id,name,nickname,whatsapp'}
+
+def catalog_filters(ctx, i):
+    categories = ','.join(str(c) for c in ctx.rng.sample(range(1, datagen.CATEGORY_COUNT + 1), ctx.rng.randint(1, 3)))
+    tags = ','.join(str(t) for t in ctx.rng.sample(range(1, datagen.TAG_COUNT + 1), ctx.rng.randint(0, 2)))
+    mode = ctx.rng.choice(['any', 'all'])
+    return {'method': 'GET', 'url': f'/api/catalog?category_ids={categories}&tag_ids={tags}&category_mode={mode}&facets=true'}
+
+def new_product_body(ctx, i, prefix):
+    return {'name': f'{prefix} {i} {ctx.rng.choice(SEARCH_WORDS)}', 'priceShowroom': round(ctx.rng.uniform(5, 100), 2),
+            'stockActual': ctx.rng.randint(0, 100), 'category_ids': [ctx.rng.randint(1, datagen.CATEGORY_COUNT)],
+            'tag_ids': [ctx.rng.randint(1, datagen.TAG_COUNT)]}
+
+def create_records(url, body_for):
+    """prepare() que crea `count` registros por la API y retorna sus ids."""
+    def prepare(ctx, count):
+        ids = []
+        for i in range(count):
+            status, body = request_json(ctx.driver, 'POST', url, body_for(ctx, i))
+            if status != 201:
+                raise RuntimeError(f'No se pudo preparar {url}: HTTP {status}')
+            ids.append(body['id'])
+        return ids
+    return prepare
+
+def request_json(driver, method, url, body=None):
+    """Petición fuera de la medición que necesita el cuerpo de la respuesta."""
+    if isinstance(driver, TestClientDriver):
+        response = driver.app.test_client().open(url, method=method, json=body)
+        return response.status_code, response.get_json()
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    http_request = urllib.request.Request(driver.base_url + url, data=data, method=method,
+                                          headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request, timeout=120) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def prepared_id(ctx, i):
+    return ctx.prepared[i]
+
+def distinct_sale_ids(ctx, count):
+    return ctx.rng.sample(range(1, ctx.params['sales'] + 1), count)
+
+def report_request(ctx, i):
+    """Pedido de un reporte en segundo plano: estadísticas de un rango distinto cada vez (sin resultado guardado)."""
+    date_from, date_to = ctx.date_range(ctx.rng.choice([30, 90, 365]))
+    report = ctx.rng.choice(['sales_over_time', 'top_products', 'top_clients'])
+    return {'report': report, 'params': {'from': date_from, 'to': date_to, 'limit': i}}
+
+def finished_reports(ctx, count):
+    """prepare() que pide `count` reportes y espera a que terminen. Retorna sus ids."""
+    ids = []
+    for i in range(count):
+        status, body = request_json(ctx.driver, 'POST', '/api/reports', report_request(ctx, i))
+        if status not in (200, 202):
+            raise RuntimeError(f'No se pudo preparar /api/reports: HTTP {status}')
+        ids.append(body['id'])
+    for job_id in ids:
+        while request_json(ctx.driver, 'GET', f'/api/reports/{job_id}')[1]['status'] not in ('done', 'failed'):
+            time.sleep(0.05)
+    return ids
+
+def import_csv(ctx, i):
+    # Re-importa productos existentes por externalCode (actualiza precios) y agrega algunos nuevos
+    rows = ['externalCode,name,priceShowroom,stockActual']
+    for _ in range(200):
+        product_id = ctx.product_id()
+        rows.append(f'NAT-{product_id:06d},Producto importado {product_id},{ctx.rng.randint(5, 100)},{ctx.rng.randint(0, 50)}')
+    for j in range(20):
+        rows.append(f'NEW-{i:04d}-{j:02d},Producto nuevo {i}-{j},{ctx.rng.randint(5, 100)},10')
+    return {'method': 'POST', 'url': '/api/products/import?format=csv', 'data': '\n'.join(rows).encode('utf-8'),
+            'headers': {'Content-Type': 'text/csv'}}
+
+def new_sale(ctx, i):
+    items = [{'product_id': ctx.product_id(), 'quantity': 1} for _ in range(ctx.rng.randint(1, 3))]
+    return {'method': 'POST', 'url': '/api/sales', 'json': {'client_id': ctx.client_id(), 'items': items}}
+
+def get(url_for):
+    return lambda ctx, i: {'method': 'GET', 'url': url_for(ctx, i)}
+
+def export_range(kind):
+    def build(ctx, i):
+        date_from, date_to = ctx.date_range(30)
+        return {'method': 'GET', 'url': f'/api/export/{kind}?format={ctx.rng.choice(["csv", "ndjson"])}&from={date_from}&to={date_to}'}
+    return build
+
+def stats_range(path, extra=''):
+    def build(ctx, i):
+        if ctx.rng.random() < 0.5:
+            return {'method': 'GET', 'url': f'{path}?{extra}'}
+        date_from, date_to = ctx.date_range(ctx.rng.choice([7, 30, 90, 365]))
+        return {'method': 'GET', 'url': f'{path}?{extra}&from={date_from}&to={date_to}'}
+    return build
+
+SCENARIOS = [
+    Scenario('root', 'api.hello', get(lambda ctx, i: '/'), requests=200),
+    Scenario('metrics', 'api.get_metrics', get(lambda ctx, i: '/metrics'), requests=50),
+    Scenario('config.get', 'api.get_config', get(lambda ctx, i: '/api/config'), requests=200),
+    Scenario('config.update', 'api.update_config',
+             lambda ctx, i: {'method': 'PUT', 'url': '/api/config', 'json': {'siteName': f'Showroom {i}'}}, requests=50),
+    Scenario('events.connect', 'api.stream_events', get(lambda ctx, i: '/api/events'), requests=50, first_chunk_only=True),
+
+    # Catálogo público
+    Scenario('catalog.full', 'api.get_catalog', get(lambda ctx, i: '/api/catalog'), requests=50),
+    Scenario('catalog.search', 'api.get_catalog', catalog_search, requests=200),
+    Scenario('catalog.filters', 'api.get_catalog', catalog_filters, requests=200),
+    Scenario('catalog.concurrent', 'api.get_catalog', catalog_search, requests=400, threads=8),
+
+    # Productos
+    Scenario('products.page', 'api.get_products', get(lambda ctx, i: '/api/products?limit=50'), requests=100),
+    Scenario('products.page_fields', 'api.get_products',
+             get(lambda ctx, i: '/api/products?limit=500&fields=id,name,stockActual,priceShowroom'), requests=100),
+    Scenario('products.get', 'api.get_product', get(lambda ctx, i: f'/api/products/{ctx.product_id()}'), requests=200),
+    Scenario('products.create', 'api.create_product',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/products', 'json': new_product_body(ctx, i, 'Bench')},
+             requests=100, expected=(201,)),
+    Scenario('products.update', 'api.update_product',
+             lambda ctx, i: {'method': 'PUT', 'url': f'/api/products/{ctx.product_id()}',
+                             'json': {'priceShowroom': round(ctx.rng.uniform(5, 100), 2), 'stockActual': ctx.rng.randint(0, 100)}},
+             requests=100),
+    Scenario('products.delete', 'api.delete_product',
+             lambda ctx, i: {'method': 'DELETE', 'url': f'/api/products/{prepared_id(ctx, i)}'}, requests=50,
+             prepare=create_records('/api/products', lambda ctx, i: new_product_body(ctx, i, 'Borrar'))),
+    Scenario('products.import', 'api.import_products', import_csv, requests=10),
+
+    # Tags y categorías
+    Scenario('tags.list', 'api.get_tags', get(lambda ctx, i: '/api/tags'), requests=100),
+    Scenario('tags.create', 'api.create_tag',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/tags', 'json': {'name': f'bench-tag-{i}'}}, requests=50, expected=(201,)),
+    Scenario('tags.update', 'api.update_tag',
+             lambda ctx, i: {'method': 'PUT', 'url': f'/api/tags/{prepared_id(ctx, i)}', 'json': {'name': f'renombrado-{i}'}},
+             requests=20, prepare=create_records('/api/tags', lambda ctx, i: {'name': f'bench-tag-upd-{i}'})),
+    Scenario('tags.delete', 'api.delete_tag',
+             lambda ctx, i: {'method': 'DELETE', 'url': f'/api/tags/{prepared_id(ctx, i)}'},
+             requests=20, prepare=create_records('/api/tags', lambda ctx, i: {'name': f'bench-tag-del-{i}'})),
+    Scenario('categories.list', 'api.get_categories', get(lambda ctx, i: '/api/categories'), requests=100),
+    Scenario('categories.create', 'api.create_category',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/categories', 'json': {'name': f'Bench {i}'}}, requests=50, expected=(201,)),
+    Scenario('categories.update', 'api.update_category',
+             lambda ctx, i: {'method': 'PUT', 'url': f'/api/categories/{prepared_id(ctx, i)}', 'json': {'name': f'Renombrada {i}'}},
+             requests=20, prepare=create_records('/api/categories', lambda ctx, i: {'name': f'Bench upd {i}'})),
+    Scenario('categories.delete', 'api.delete_category',
+             lambda ctx, i: {'method': 'DELETE', 'url': f'/api/categories/{prepared_id(ctx, i)}'},
+             requests=20, prepare=create_records('/api/categories', lambda ctx, i: {'name': f'Bench del {i}'})),
+
+    # Clientes
+    Scenario('clients.page', 'api.get_clients', get(lambda ctx, i: '/api/clients?limit=50'), requests=100),
+    Scenario('clients.search', 'api.search_clients', client_search, requests=200),
+    Scenario('clients.reclassify', 'api.reclassify_clients',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/clients/reclassify'}, requests=10),
+    Scenario('clients.get', 'api.get_client', get(lambda ctx, i: f'/api/clients/{ctx.client_id()}'), requests=200),
+    Scenario('clients.create', 'api.create_client',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/clients',
+                             'json': {'name': f'Cliente Bench {i}', 'whatsapp': f'+5491100{i:06d}'}}, requests=100, expected=(201,)),
+    Scenario('clients.update', 'api.update_client',
+             lambda ctx, i: {'method': 'PUT', 'url': f'/api/clients/{ctx.client_id()}', 'json': {'name': f'Cliente Editado {i}', 'nickname': f'apodo{i}'}},
+             requests=100),
+    Scenario('clients.delete', 'api.delete_client',
+             lambda ctx, i: {'method': 'DELETE', 'url': f'/api/clients/{prepared_id(ctx, i)}'}, requests=50,
+             prepare=create_records('/api/clients', lambda ctx, i: {'name': f'Cliente Borrar {i}'})),
+
+    # Ventas
+    Scenario('sales.create_concurrent', 'api.create_sale', new_sale, requests=400, threads=8, expected=(201, 400)),
+    Scenario('sales.page', 'api.get_sales', get(lambda ctx, i: '/api/sales?limit=50'), requests=100),
+    Scenario('sales.page_status', 'api.get_sales',
+             get(lambda ctx, i: f'/api/sales?limit=50&status={ctx.rng.choice(["Contactado", "Armado", "Entregado"])}'), requests=100),
+    Scenario('sales.client_history', 'api.get_sales',
+             get(lambda ctx, i: f'/api/sales?all=true&client_id={ctx.client_id()}'), requests=100),
+    Scenario('sales.get', 'api.get_sale', get(lambda ctx, i: f'/api/sales/{ctx.sale_id()}'), requests=200),
+    Scenario('sales.update_status', 'api.update_sale_status',
+             lambda ctx, i: {'method': 'PUT', 'url': f'/api/sales/{ctx.sale_id()}',
+                             'json': {'status': ctx.rng.choice(['Armado', 'Entregado', 'Cobrado', 'Cancelado'])}},
+             requests=100, expected=(200, 400)),
+    Scenario('sales.bulk_status', 'api.bulk_update_sales_status',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/sales/status',
+                             'json': {'sale_ids': [ctx.sale_id() for _ in range(200)],
+                                      'status': ctx.rng.choice(['Armado', 'Entregado', 'Cobrado', 'Cancelado'])}},
+             requests=20),
+    Scenario('sales.delete', 'api.delete_sale',
+             lambda ctx, i: {'method': 'DELETE', 'url': f'/api/sales/{ctx.prepared[i]}'}, requests=50,
+             prepare=distinct_sale_ids),
+
+    # Dashboard y estadísticas
+    Scenario('dashboard.summary', 'api.get_dashboard_summary', get(lambda ctx, i: '/api/dashboard/summary'), requests=200),
+    Scenario('dashboard.sales_board', 'api.get_sales_board', get(lambda ctx, i: '/api/dashboard/sales_board'), requests=100),
+    Scenario('stats.sales_over_time', 'api.stats_sales_over_time',
+             stats_range('/api/stats/sales_over_time', 'period=month'), requests=100),
+    Scenario('stats.sales_by_day', 'api.stats_sales_over_time',
+             stats_range('/api/stats/sales_over_time', 'period=day'), requests=100),
+    Scenario('stats.top_products', 'api.stats_top_products',
+             stats_range('/api/stats/top_products', 'by=value&limit=10'), requests=100),
+    Scenario('stats.top_clients', 'api.stats_top_clients',
+             stats_range('/api/stats/top_clients', 'by=frequency&limit=10'), requests=100),
+    Scenario('stats.stock_summary', 'api.stats_stock_summary', get(lambda ctx, i: '/api/stats/stock_summary'), requests=50),
+
+    # Exportaciones (un mes de ventas; el catálogo completo)
+    Scenario('export.sales_month', 'api.export_sales', export_range('sales'), requests=10),
+    Scenario('export.sale_items_month', 'api.export_sale_items', export_range('sale_items'), requests=10),
+    Scenario('export.products', 'api.export_products', get(lambda ctx, i: '/api/export/products?format=csv'), requests=3),
+
+    # Reportes en segundo plano (al final: los jobs pedidos siguen corriendo después de responder)
+    Scenario('reports.submit', 'api.submit_report',
+             lambda ctx, i: {'method': 'POST', 'url': '/api/reports', 'json': report_request(ctx, i)},
+             requests=50, expected=(200, 202)),
+    Scenario('reports.status', 'api.get_report', get(lambda ctx, i: f'/api/reports/{ctx.prepared[i]}'),
+             requests=50, prepare=finished_reports),
+    Scenario('reports.result', 'api.get_report_result', get(lambda ctx, i: f'/api/reports/{ctx.prepared[i]}/result'),
+             requests=50, prepare=finished_reports),
+]
+
+# --- Ejecución y reporte ---
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_scenario(scenario, driver, params, seed):
+    ctx = Context(driver, params, seed ^ zlib.crc32(scenario.name.encode('utf-8')))
+    gc.collect() # Que la basura del escenario anterior no se cobre en este
+    if scenario.prepare:
+        # +1 para la petición extra que mide la memoria
+        ctx.prepared = scenario.prepare(ctx, scenario.requests + 1)
+    # Las peticiones se arman antes de medir (y en el mismo orden siempre, aunque haya varios hilos)
+    built = [scenario.build(ctx, i) for i in range(scenario.requests + 1)]
+    timed, memory_probe = built[:-1], built[-1]
+
+    latencies = []
+    unexpected = {}
+    lock = threading.Lock()
+    def send(spec):
+        started_at = time.perf_counter()
+        status, _ = driver.request(spec['method'], spec['url'], json_body=spec.get('json'), data=spec.get('data'),
+                                   headers=spec.get('headers'), first_chunk_only=scenario.first_chunk_only)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            if status not in scenario.expected:
+                unexpected[status] = unexpected.get(status, 0) + 1
+
+    started_at = time.perf_counter()
+    if scenario.threads == 1:
+        for spec in timed:
+            send(spec)
+    else:
+        queue = iter(timed)
+        queue_lock = threading.Lock()
+        def worker():
+            while True:
+                with queue_lock:
+                    spec = next(queue, None)
+                if spec is None:
+                    return
+                send(spec)
+        workers = [threading.Thread(target=worker) for _ in range(scenario.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    wall_seconds = time.perf_counter() - started_at
+
+    # Pico de memoria de Python de una petición, fuera de la medición de tiempos (tracemalloc la hace más lenta)
+    peak_kb = None
+    if isinstance(driver, TestClientDriver):
+        tracemalloc.start()
+        driver.request(memory_probe['method'], memory_probe['url'], json_body=memory_probe.get('json'),
+                       data=memory_probe.get('data'), headers=memory_probe.get('headers'),
+                       first_chunk_only=scenario.first_chunk_only)
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'endpoint': scenario.endpoint,
+        'requests': len(latencies),
+        'threads': scenario.threads,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 2),
+        'peak_request_memory_kb': round(peak_kb, 1) if peak_kb is not None else None,
+        'unexpected_statuses': unexpected,
+    }
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Lista de regresiones (texto) de `results` respecto de `baseline`."""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        # La cola (p95) varía bastante más entre corridas que la mediana: se le da el doble de tolerancia
+        for key, key_tolerance in (('p50_ms', tolerance), ('p95_ms', tolerance * 2)):
+            if result[key] > base[key] * (1 + key_tolerance) and result[key] - base[key] >= MIN_LATENCY_REGRESSION_MS:
+                regressions.append(f"{name}: {key[:3]} {base[key]:.1f} -> {result[key]:.1f} ms")
+        # Throughput en ms por petición, para aplicar el mismo umbral de ruido que a la latencia
+        ms_per_request, base_ms_per_request = 1000 / result['throughput_rps'], 1000 / base['throughput_rps']
+        if (result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance)
+                and ms_per_request - base_ms_per_request >= MIN_LATENCY_REGRESSION_MS):
+            regressions.append(f"{name}: throughput {base['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        memory, base_memory = result['peak_request_memory_kb'], base.get('peak_request_memory_kb')
+        if (memory is not None and base_memory is not None and memory > base_memory * (1 + tolerance)
+                and memory - base_memory >= MIN_MEMORY_REGRESSION_KB):
+            regressions.append(f"{name}: memoria {base_memory:.0f} -> {memory:.0f} KB")
+    return regressions
+
+def print_report(results, baseline):
+    print(f"\n{'escenario':<28} {'n':>5} {'hilos':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'mem KB':>9} {'Δp95':>7}")
+    for name, result in results['scenarios'].items():
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        delta = f"{(result['p95_ms'] / base['p95_ms'] - 1) * 100:+.0f}%" if base and base['p95_ms'] else ''
+        memory = f"{result['peak_request_memory_kb']:.0f}" if result['peak_request_memory_kb'] is not None else '-'
+        print(f"{name:<28} {result['requests']:>5} {result['threads']:>5} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['throughput_rps']:>9.1f} {memory:>9} {delta:>7}")
+        if result['unexpected_statuses']:
+            print(f"    respuestas inesperadas: {result['unexpected_statuses']}")
+    if results.get('max_rss_mb') is not None:
+        print(f"\nPico de memoria del proceso (RSS): {results['max_rss_mb']:.0f} MB")
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024 # bytes en macOS, KiB en Linux
+
+def check_route_coverage(app, scenarios):
+    covered = {scenario.endpoint for scenario in scenarios}
+    return sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                  if rule.endpoint != 'static' and rule.endpoint not in covered)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    datagen.add_arguments(parser)
+    parser.add_argument('--db', help='Base generada por datagen.py a usar (por defecto, una en el directorio temporal)')
+    parser.add_argument('--base-url', help='Medir un servidor ya levantado (ej. http://127.0.0.1:5000) en lugar del test client')
+    parser.add_argument('--only', help='Solo los escenarios cuyo nombre empieza con alguno de estos prefijos (separados por coma)')
+    parser.add_argument('--output', help='Guardar los resultados en este archivo JSON')
+    parser.add_argument('--baseline', help='Comparar contra esta línea base (JSON) y fallar si hay regresiones')
+    parser.add_argument('--save-baseline', help='Guardar los resultados como línea base en este archivo')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Empeoramiento tolerado respecto de la línea base (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    params = datagen.params_from_args(args)
+    scenarios = SCENARIOS
+    if args.only:
+        prefixes = tuple(prefix.strip() for prefix in args.only.split(','))
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name.startswith(prefixes)]
+
+    if args.base_url:
+        driver = HttpDriver(args.base_url)
+        app = None
+    else:
+        db_path = args.db or os.path.join(tempfile.gettempdir(), 'ojitos-bench',
+                                          f"bench-{params['seed']}-{params['products']}-{params['clients']}-{params['sales']}.db")
+        datagen.ensure_database(db_path, params)
+        # Las rutas que escriben trabajan sobre una copia: la base generada queda intacta para la próxima corrida
+        work_dir = tempfile.mkdtemp(prefix='ojitos-bench-run-')
+        work_db = os.path.join(work_dir, 'bench.db')
+        shutil.copyfile(db_path, work_db)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from app import create_app, analytics_snapshot
+        # Con reglas de nivel de cliente, para medir el recálculo en las ventas y en /api/clients/reclassify
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + work_db, 'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+                          'REPORTS_DIR': os.path.join(work_dir, 'reports'),
+                          'CLIENT_LEVEL_RULES': [{'level': 'VIP', 'min_orders': 10, 'min_total_spent': 1000},
+                                                 {'level': 'Frecuente', 'min_orders': 3}]})
+        with app.app_context():
+            snapshot = analytics_snapshot()
+            if snapshot is not None:
+                snapshot.refresh(force=True) # Las estadísticas se miden sobre su copia, como en producción
+        missing = check_route_coverage(app, SCENARIOS)
+        if missing:
+            print('ERROR: rutas sin escenario en la suite: ' + ', '.join(missing))
+            return 1
+        driver = TestClientDriver(app)
+
+    results = {
+        'params': params,
+        'mode': 'http' if args.base_url else 'test_client',
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'scenarios': {},
+    }
+    for scenario in scenarios:
+        print(f'{scenario.name} ...', end=' ', flush=True)
+        result = run_scenario(scenario, driver, params, params['seed'])
+        results['scenarios'][scenario.name] = result
+        print(f"p95 {result['p95_ms']:.1f} ms")
+    results['max_rss_mb'] = max_rss_mb()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != params or baseline['mode'] != results['mode']:
+            print('ERROR: la línea base se generó con otros datos o en otro modo; no se puede comparar.')
+            return 1
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Línea base guardada en {args.save_baseline}')
+
+    failed = False
+    errors = {name: r['unexpected_statuses'] for name, r in results['scenarios'].items() if r['unexpected_statuses']}
+    if errors:
+        print(f'\nERROR: respuestas inesperadas en {len(errors)} escenario(s).')
+        failed = True
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\nREGRESIONES (tolerancia {args.tolerance:.0%}):')
+            for regression in regressions:
+                print('  ' + regression)
+            failed = True
+        else:
+            print(f'\nSin regresiones respecto de la línea base (tolerancia {args.tolerance:.0%}).')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Generador de datos sintéticos para benchmarks, reproducible a partir de una semilla.
+
+Crea una base de datos SQLite con el esquema de la aplicación y volúmenes realistas: productos con
+tags y categorías, clientes y ventas con items repartidas en varios años (las ventas viejas casi
+todas cobradas, las recientes en distintos estados del pipeline). Después recalcula los agregados
+de ventas (con los niveles de los clientes) y los índices de búsqueda, igual que `flask upgrade-db`
++ `rebuild-aggregates` + `rebuild-search-index` sobre una base real.
+
+La misma semilla y los mismos volúmenes generan siempre los mismos datos (las fechas son relativas
+a --end-date). Junto a la base se guarda `<db>.json` con los parámetros: si ya existe una base
+generada con los mismos parámetros se reutiliza.
+
+Uso (desde la raíz del proyecto):
+    python backend/benchmarks/datagen.py --db /tmp/ojitos-bench.db
+    python backend/benchmarks/datagen.py --db /tmp/ojitos-chica.db --scale 0.01
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+
+DEFAULT_PRODUCTS = 100_000
+DEFAULT_CLIENTS = 50_000
+DEFAULT_SALES = 1_000_000
+CATEGORY_COUNT = 30
+TAG_COUNT = 200
+INSERT_CHUNK = 20_000 # Filas por executemany
+# Cambia cuando el generador produce otra base con los mismos parámetros (ej. un índice nuevo):
+# las bases generadas con una versión anterior se vuelven a generar
+GENERATOR_VERSION = 3
+
+PRODUCT_TYPES = ['Crema', 'Perfume', 'Jabón', 'Aceite', 'Shampoo', 'Acondicionador', 'Desodorante', 'Labial',
+                 'Base', 'Máscara', 'Exfoliante', 'Colonia', 'Protector Solar', 'Sérum', 'Gel', 'Bruma']
+PRODUCT_LINES = ['Ekos', 'Chronos', 'Tododia', 'Kaiak', 'Essencial', 'Luna', 'Una', 'Mamá y Bebé', 'Humor',
+                 'Plant', 'Lumina', 'Faces', 'Homem', 'Biografía', 'Ilía', 'Sève']
+PRODUCT_VARIANTS = ['Castaña', 'Maracuyá', 'Açaí', 'Frambuesa', 'Pitanga', 'Cacao', 'Vainilla', 'Rosa',
+                    'Ciruela', 'Cedro', 'Jengibre', 'Lavanda', 'Limón', 'Durazno', 'Coco', 'Menta']
+PRODUCT_SIZES = ['30 ml', '50 ml', '75 ml', '100 ml', '150 ml', '200 ml', '400 ml', '1 u']
+FIRST_NAMES = ['Ana', 'María', 'Laura', 'Sofía', 'Lucía', 'Valentina', 'Camila', 'Julieta', 'Carla', 'Paula',
+               'Martina', 'Florencia', 'Agustina', 'Micaela', 'Daniela', 'Juan', 'Pedro', 'Lucas', 'Mateo',
+               'Diego', 'Nicolás', 'Martín', 'Sebastián', 'Federico', 'Gabriel']
+LAST_NAMES = ['González', 'Rodríguez', 'Gómez', 'Fernández', 'López', 'Díaz', 'Martínez', 'Pérez', 'García',
+              'Sánchez', 'Romero', 'Sosa', 'Torres', 'Álvarez', 'Ruiz', 'Ramírez', 'Flores', 'Benítez',
+              'Acosta', 'Medina', 'Herrera', 'Suárez', 'Aguirre', 'Giménez', 'Gutiérrez']
+
+def scaled_sizes(args):
+    return (max(1, round(args.products * args.scale)), max(1, round(args.clients * args.scale)),
+            max(1, round(args.sales * args.scale)))
+
+def skewed_index(rng, count):
+    """Índice en [0, count) con sesgo hacia los primeros (pocos productos y clientes concentran muchas ventas)."""
+    return int(count * rng.random() ** 2.5)
+
+def insert_rows(db, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(table.insert(), rows[start:start + INSERT_CHUNK])
+
+def generate(app, params):
+    """Llena la base de datos de `app` (vacía) con los datos descritos por `params`."""
+    import app as app_module
+    db = app_module.db
+    rng = random.Random(params['seed'])
+    product_count, client_count, sale_count = params['products'], params['clients'], params['sales']
+    end_date = datetime.date.fromisoformat(params['end_date'])
+    start_date = end_date - datetime.timedelta(days=365 * params['years'])
+    total_seconds = int((end_date - start_date).total_seconds()) + 86400
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(app_module.Config(id=1))
+        insert_rows(db, app_module.Category.__table__,
+                    [{'id': i, 'name': f'Categoría {i:02d}'} for i in range(1, CATEGORY_COUNT + 1)])
+        insert_rows(db, app_module.Tag.__table__,
+                    [{'id': i, 'name': f'tag{i:03d}'} for i in range(1, TAG_COUNT + 1)])
+
+        products, product_tags, product_categories, prices = [], [], [], []
+        for product_id in range(1, product_count + 1):
+            name = (f'{rng.choice(PRODUCT_TYPES)} {rng.choice(PRODUCT_LINES)} {rng.choice(PRODUCT_VARIANTS)} '
+                    f'{rng.choice(PRODUCT_SIZES)}')
+            price_revista = round(rng.uniform(5, 150), 2)
+            price_showroom = round(price_revista * 0.8, 2)
+            prices.append(price_showroom)
+            products.append({
+                'id': product_id, 'name': name, 'priceRevista': price_revista, 'priceShowroom': price_showroom,
+                'priceFeria': round(price_revista * 0.65, 2) if rng.random() < 0.7 else None,
+                'stockActual': 0 if rng.random() < 0.03 else rng.randint(1, 200), 'stockCritico': rng.randint(1, 5),
+                'imageUrl': f'https://img.example.com/p/{product_id}.jpg', 'externalCode': f'NAT-{product_id:06d}',
+            })
+            for category_id in rng.sample(range(1, CATEGORY_COUNT + 1), rng.randint(1, 2)):
+                product_categories.append({'product_id': product_id, 'category_id': category_id})
+            for tag_id in rng.sample(range(1, TAG_COUNT + 1), rng.randint(0, 4)):
+                product_tags.append({'product_id': product_id, 'tag_id': tag_id})
+        insert_rows(db, app_module.Product.__table__, products)
+        insert_rows(db, app_module.product_categories_table, product_categories)
+        insert_rows(db, app_module.product_tags_table, product_tags)
+        del products, product_categories, product_tags
+
+        clients = []
+        for client_id in range(1, client_count + 1):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            clients.append({
+                'id': client_id, 'name': f'{first} {last}', 'nickname': first[:3].lower() if rng.random() < 0.3 else '',
+                'whatsapp': f'+54911{rng.randint(10_000_000, 99_999_999)}',
+                'email': f'{first.lower()}.{last.lower()}{client_id}@example.com', 'gender': rng.choice(['F', 'F', 'F', 'M']),
+                'clientLevel': 'Nuevo',
+            })
+        insert_rows(db, app_module.Client.__table__, clients)
+        del clients
+        db.session.commit()
+
+        # Ventas en orden cronológico (como se cargarían en la realidad), en bloques para acotar la memoria
+        recent_cutoff = datetime.datetime.combine(end_date, datetime.time()) - datetime.timedelta(days=30)
+        offsets = sorted(rng.randrange(total_seconds) for _ in range(sale_count))
+        start_datetime = datetime.datetime.combine(start_date, datetime.time())
+        item_id = 1
+        for block_start in range(0, sale_count, INSERT_CHUNK):
+            sales, items = [], []
+            for sale_id in range(block_start + 1, min(block_start + INSERT_CHUNK, sale_count) + 1):
+                sale_date = start_datetime + datetime.timedelta(seconds=offsets[sale_id - 1])
+                if sale_date < recent_cutoff:
+                    status = rng.choices(['Cobrado', 'Cancelado', 'Entregado'], [92, 5, 3])[0]
+                else:
+                    status = rng.choice(['Contactado', 'Armado', 'Entregado', 'Cobrado', 'Cancelado'])
+                total = 0.0
+                for product_index in {skewed_index(rng, product_count) for _ in range(rng.randint(1, 4))}:
+                    quantity = rng.randint(1, 3)
+                    price = prices[product_index]
+                    subtotal = round(price * quantity, 2)
+                    total += subtotal
+                    items.append({'id': item_id, 'sale_id': sale_id, 'product_id': product_index + 1,
+                                  'quantity': quantity, 'price_at_sale': price, 'subtotal': subtotal})
+                    item_id += 1
+                sales.append({'id': sale_id, 'client_id': skewed_index(rng, client_count) + 1,
+                              'saleDate': sale_date, 'totalAmount': round(total, 2), 'status': status})
+            insert_rows(db, app_module.Sale.__table__, sales)
+            insert_rows(db, app_module.SaleItem.__table__, items)
+            db.session.commit()
+
+        app_module.rebuild_sale_aggregates()
+        app_module.rebuild_product_search_index()
+        app_module.rebuild_client_search_index()
+        app_module.upgrade_db() # Índices que falten y PRAGMA optimize (estadísticas del planificador)
+
+def ensure_database(db_path, params, quiet=False):
+    """Genera la base en `db_path` salvo que ya exista una generada con los mismos `params`."""
+    meta_path = db_path + '.json'
+    if os.path.exists(db_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == params:
+                return False
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    for suffix in ('', '-wal', '-shm', '.json'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import create_app
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(db_path)})
+    started_at = time.perf_counter()
+    if not quiet:
+        print(f"Generando {params['products']:,} productos, {params['clients']:,} clientes y "
+              f"{params['sales']:,} ventas en {db_path} ...")
+    generate(app, params)
+    with app.app_context():
+        app_module = sys.modules['app']
+        app_module.db.engine.dispose()
+    with open(meta_path, 'w') as f:
+        json.dump(params, f, indent=2)
+    if not quiet:
+        print(f"Listo en {time.perf_counter() - started_at:.1f}s.")
+    return True
+
+def add_arguments(parser):
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--products', type=int, default=DEFAULT_PRODUCTS, help='Productos (con --scale 1)')
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help='Clientes (con --scale 1)')
+    parser.add_argument('--sales', type=int, default=DEFAULT_SALES, help='Ventas (con --scale 1)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplica los tres volúmenes (ej. 0.01 para una corrida rápida)')
+    parser.add_argument('--years', type=int, default=4, help='Años de historial de ventas')
+    parser.add_argument('--end-date', default=datetime.date.today().isoformat(), help='Fecha de la última venta (YYYY-MM-DD)')
+
+def params_from_args(args):
+    products, clients, sales = scaled_sizes(args)
+    return {'seed': args.seed, 'products': products, 'clients': clients, 'sales': sales,
+            'years': args.years, 'end_date': args.end_date, 'generator_version': GENERATOR_VERSION}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', required=True, help='Archivo SQLite a generar')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if not ensure_database(args.db, params_from_args(args)):
+        print(f'{args.db} ya estaba generada con estos parámetros.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Verifica que los listados no hagan consultas por fila (N+1).
+
+Cuenta las sentencias SQL que ejecuta cada petición (con un listener before_cursor_execute)
+sobre una base de datos temporal con N productos, clientes y ventas, agrega datos hasta tener
+10×N y vuelve a contar. Si alguna ruta ejecuta más sentencias con más datos, informa la
+diferencia y termina con código 1.
+
+Las páginas son de pocas filas a propósito: selectinload reparte los ids en consultas de a 500,
+así que una página (o un listado completo) de más de 500 filas suma una consulta por cada 500.
+
+Uso (desde la raíz del proyecto):
+    python backend/benchmarks/query_counts.py --base 300
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+PAGE = 'limit=20'
+
+URLS = [
+    f'/api/sales?{PAGE}',
+    f'/api/sales?{PAGE}&fields=id,client_id,saleDate,totalAmount,status',
+    f'/api/sales?{PAGE}&fields=id,client_name,items',
+    f'/api/sales?{PAGE}&status=Contactado',
+    f'/api/products?{PAGE}',
+    f'/api/products?{PAGE}&fields=id,name,stockActual',
+    f'/api/products?{PAGE}&fields=id,name,tags,categories',
+    f'/api/clients?{PAGE}',
+    f'/api/clients?{PAGE}&fields=id,name,purchaseStats',
+    '/api/stats/stock_summary',
+]
+
+STATUSES = ['Contactado', 'Armado', 'Entregado', 'Cobrado']
+
+def seed(app, db, models, count, rng):
+    """Agrega `count` productos, clientes y ventas (3 items cada una) y recalcula los agregados."""
+    Client, Product, Tag, Category, Sale, SaleItem, rebuild_sale_aggregates = models
+    with app.app_context():
+        tags = Tag.query.all()
+        categories = Category.query.all()
+        if not tags:
+            tags = [Tag(name=f'Tag {i}') for i in range(20)]
+            categories = [Category(name=f'Categoría {i}') for i in range(10)]
+            db.session.add_all(tags + categories)
+        start = Product.query.count()
+        products = []
+        for i in range(start, start + count):
+            # Uno de cada diez con stock crítico o sin stock, para que stock_summary tenga filas
+            stock = rng.randint(0, 5) if i % 10 == 0 else rng.randint(10, 100)
+            product = Product(name=f'Producto {i:06d}', priceShowroom=15.0, stockActual=stock, stockCritico=5)
+            product.tags = rng.sample(tags, 2)
+            product.categories = rng.sample(categories, 1)
+            products.append(product)
+        clients = [Client(name=f'Cliente {i:06d}') for i in range(start, start + count)]
+        db.session.add_all(products + clients)
+        db.session.flush()
+        for _ in range(count):
+            sale = Sale(client_id=rng.choice(clients).id, status=rng.choice(STATUSES), totalAmount=0.0)
+            for product in rng.sample(products, 3):
+                sale.items.append(SaleItem(product_id=product.id, quantity=1, price_at_sale=15.0, subtotal=15.0))
+                sale.totalAmount += 15.0
+            db.session.add(sale)
+        db.session.commit()
+        rebuild_sale_aggregates()
+
+def count_statements(test_client, counter, url):
+    counter['value'] = 0
+    counter['active'] = True
+    try:
+        response = test_client.get(url)
+    finally:
+        counter['active'] = False
+    assert response.status_code == 200, (url, response.status_code)
+    return counter['value']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base', type=int, default=300, help='Productos, clientes y ventas de la primera medición (N)')
+    parser.add_argument('--seed', type=int, default=1, help='Semilla del generador')
+    args = parser.parse_args()
+
+    # La base de datos temporal se configura antes de importar la aplicación
+    db_dir = tempfile.mkdtemp(prefix='ojitos-query-counts-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'query_counts.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import create_app, db, rebuild_sale_aggregates, Client, Product, Tag, Category, Sale, SaleItem
+    # Sin la copia para estadísticas: stock_summary lee la base principal y no hay hilo de refresco
+    app = create_app({'ANALYTICS_SNAPSHOT_SECONDS': 0})
+    models = (Client, Product, Tag, Category, Sale, SaleItem, rebuild_sale_aggregates)
+
+    counter = {'value': 0, 'active': False}
+
+    # Se escucha en Engine (todas las conexiones), no solo en db.engine
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if counter['active']:
+            counter['value'] += 1
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+    test_client = app.test_client()
+
+    seed(app, db, models, args.base, rng)
+    for url in URLS:
+        count_statements(test_client, counter, url) # Calentamiento (configuración, cachés)
+    small = {url: count_statements(test_client, counter, url) for url in URLS}
+
+    seed(app, db, models, args.base * 9, rng)
+    large = {url: count_statements(test_client, counter, url) for url in URLS}
+
+    failures = 0
+    print(f"{'ruta':<70} {'N':>4} {'10×N':>5}")
+    for url in URLS:
+        mark = '' if small[url] == large[url] else '  <-- crece con los datos'
+        failures += bool(mark)
+        print(f"{url:<70} {small[url]:>4} {large[url]:>5}{mark}")
+    if failures:
+        print(f"{failures} ruta(s) ejecutan más consultas con más datos.")
+        return 1
+    print('La cantidad de consultas no depende de la cantidad de filas.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Benchmark de serialización de listados: proyección de campos, codificador JSON y compresión.
+
+Carga productos (con tags y categorías) y ventas (con items) en una base de datos temporal y
+mide, para GET /api/products?all=true y GET /api/sales?all=true, el tamaño de la respuesta y la
+mediana de latencia en estas variantes:
+    - respuesta completa vs. solo algunos campos (?fields=)
+    - módulo json estándar vs. orjson (si está instalado)
+    - sin comprimir vs. gzip
+
+Uso (desde la raíz del proyecto):
+    python backend/benchmarks/serialization.py --products 5000 --sales 5000 --repeat 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+ENDPOINTS = [
+    ('/api/products?all=true', 'id,name,stockActual,priceShowroom'),
+    ('/api/sales?all=true', 'id,client_id,saleDate,totalAmount,status'),
+]
+
+def seed(app, db, models, args):
+    Client, Product, Tag, Category, Sale, SaleItem = models
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+        tags = [Tag(name=f'Tag {i}') for i in range(20)]
+        categories = [Category(name=f'Categoría {i}') for i in range(10)]
+        clients = [Client(name=f'Cliente {i}') for i in range(200)]
+        db.session.add_all(tags + categories + clients)
+        products = []
+        for i in range(args.products):
+            product = Product(name=f'Producto {i:06d}', priceRevista=20.0, priceShowroom=15.0, priceFeria=12.0,
+                              stockActual=rng.randint(0, 100), stockCritico=5,
+                              imageUrl=f'/img/{i}.jpg', externalCode=f'EXT-{i}')
+            product.tags = rng.sample(tags, 2)
+            product.categories = rng.sample(categories, 1)
+            products.append(product)
+        db.session.add_all(products)
+        db.session.flush()
+        for i in range(args.sales):
+            sale = Sale(client_id=rng.choice(clients).id, totalAmount=0.0, status='Pendiente')
+            for product in rng.sample(products, 3):
+                sale.items.append(SaleItem(product_id=product.id, quantity=1, price_at_sale=15.0))
+                sale.totalAmount += 15.0
+            db.session.add(sale)
+        db.session.commit()
+
+def measure(test_client, url, repeat, headers=None):
+    """(bytes de la respuesta, mediana de latencia en ms)."""
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        response = test_client.get(url, headers=headers or {})
+        timings.append((time.perf_counter() - started_at) * 1000)
+        assert response.status_code == 200, response.status_code
+    return len(response.data), statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=5000, help='Productos a generar')
+    parser.add_argument('--sales', type=int, default=5000, help='Ventas a generar (3 items cada una)')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeticiones por variante')
+    parser.add_argument('--seed', type=int, default=1, help='Semilla del generador')
+    args = parser.parse_args()
+
+    # La base de datos temporal se configura antes de importar la aplicación
+    db_dir = tempfile.mkdtemp(prefix='ojitos-serialization-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'serialization.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from flask.json.provider import DefaultJSONProvider
+    from app import create_app, db, orjson, OrjsonJSONProvider, Client, Product, Tag, Category, Sale, SaleItem
+    app = create_app()
+
+    seed(app, db, (Client, Product, Tag, Category, Sale, SaleItem), args)
+
+    encoders = [('json', DefaultJSONProvider(app))]
+    if orjson is not None:
+        encoders.append(('orjson', OrjsonJSONProvider(app)))
+    else:
+        print('orjson no está instalado: solo se mide el módulo json estándar.')
+
+    test_client = app.test_client()
+    print(f"{'endpoint':<40} {'variante':<28} {'bytes':>12} {'mediana ms':>11}")
+    for url, fields in ENDPOINTS:
+        for encoder_name, provider in encoders:
+            app.json = provider
+            variants = [
+                ('completo', url, None),
+                ('completo + gzip', url, {'Accept-Encoding': 'gzip'}),
+                ('fields', f'{url}&fields={fields}', None),
+                ('fields + gzip', f'{url}&fields={fields}', {'Accept-Encoding': 'gzip'}),
+            ]
+            measure(test_client, url, 1) # Calentamiento
+            for variant_name, variant_url, headers in variants:
+                size, median_ms = measure(test_client, variant_url, args.repeat, headers)
+                print(f"{url:<40} {encoder_name + ' ' + variant_name:<28} {size:>12,} {median_ms:>11.1f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Prueba de estrés de creación de ventas concurrentes sobre un mismo producto.
+
+Muchos hilos crean ventas al mismo tiempo contra una base de datos temporal y al final se
+verifica que no haya sobreventa: el stock nunca queda negativo y las unidades vendidas
+coinciden exactamente con lo que se descontó. También informa el throughput.
+
+Uso (desde la raíz del proyecto):
+    python backend/benchmarks/stress_sales.py --threads 16 --requests 50 --stock 300
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help='Hilos concurrentes')
+    parser.add_argument('--requests', type=int, default=50, help='Ventas que intenta crear cada hilo')
+    parser.add_argument('--stock', type=int, default=300, help='Stock inicial del producto')
+    parser.add_argument('--max-quantity', type=int, default=3, help='Cantidad máxima por venta')
+    args = parser.parse_args()
+
+    # La base de datos temporal se configura antes de importar la aplicación
+    db_dir = tempfile.mkdtemp(prefix='ojitos-stress-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'stress.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import create_app, db, Client, Product, SaleItem
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        client = Client(name='Cliente Stress')
+        product = Product(name='Producto Stress', priceShowroom=10.0, stockActual=args.stock, stockCritico=1)
+        db.session.add_all([client, product])
+        db.session.commit()
+        client_id, product_id = client.id, product.id
+
+    results = {'created': 0, 'units_sold': 0, 'rejected': 0, 'errors': 0}
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.threads)
+
+    def worker(worker_index):
+        test_client = app.test_client()
+        start_barrier.wait() # Todos los hilos arrancan juntos
+        for request_index in range(args.requests):
+            quantity = (worker_index + request_index) % args.max_quantity + 1
+            response = test_client.post('/api/sales', json={
+                'client_id': client_id,
+                'items': [{'product_id': product_id, 'quantity': quantity}]
+            })
+            with results_lock:
+                if response.status_code == 201:
+                    results['created'] += 1
+                    results['units_sold'] += quantity
+                elif response.status_code == 400:
+                    results['rejected'] += 1
+                else:
+                    results['errors'] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    with app.app_context():
+        final_stock = db.session.get(Product, product_id).stockActual
+        sold_in_db = db.session.query(db.func.coalesce(db.func.sum(SaleItem.quantity), 0)).scalar()
+
+    total_requests = args.threads * args.requests
+    print(f"Peticiones: {total_requests} en {elapsed:.2f}s ({total_requests / elapsed:.1f} req/s)")
+    print(f"Ventas creadas: {results['created']} ({results['created'] / elapsed:.1f} ventas/s), "
+          f"rechazadas por stock: {results['rejected']}, errores: {results['errors']}")
+    print(f"Stock inicial: {args.stock}, unidades vendidas: {results['units_sold']}, stock final: {final_stock}")
+
+    oversold = final_stock < 0 or args.stock - final_stock != results['units_sold'] or sold_in_db != results['units_sold']
+    if oversold:
+        print("ERROR: el stock final no coincide con las unidades vendidas (sobreventa).")
+        return 1
+    print("OK: sin sobreventa.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Configuración de gunicorn (Linux/macOS). Uso desde la raíz del proyecto:
+
+    gunicorn --chdir backend -c backend/gunicorn.conf.py wsgi:app
+
+Variables de entorno:
+    WEB_CONCURRENCY  procesos worker (por defecto, uno por núcleo)
+    WEB_THREADS      hilos por worker (por defecto 8)
+    BIND             dirección de escucha (por defecto 0.0.0.0:5000)
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Workers con hilos: cada conexión abierta de /api/events (SSE) ocupa un hilo mientras dura,
+# así que conviene que sobren hilos respecto de los dashboards abiertos. Cada conexión recibe también
+# los eventos de los otros workers (los workers los comparten en instance/changes.log).
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+# Con gthread el timeout controla que el worker siga vivo, no la duración de cada petición
+# (las exportaciones y el feed de eventos pueden durar mucho más).
+timeout = 60
+graceful_timeout = 30
+# Cada worker crea su app después del fork: ninguna conexión SQLite se comparte entre procesos.
+preload_app = False
+accesslog = '-'
+
+def on_starting(server):
+    """Las métricas de /metrics (un archivo por worker) empiezan de cero en cada arranque del servidor."""
+    from app import reset_metrics_files
+    reset_metrics_files(os.environ.get('FLASK_METRICS_DIR') or
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
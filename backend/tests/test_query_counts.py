@@ -0,0 +1,15 @@
+"""
+Corre backend/benchmarks/query_counts.py con pytest (desde la raíz del proyecto):
+    pip install pytest
+    python -m pytest backend/tests
+"""
+import os
+import sys
+import subprocess
+
+QUERY_COUNTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'query_counts.py')
+
+def test_listados_sin_consultas_por_fila():
+    # En un proceso aparte: el script configura DATABASE_URL antes de importar la aplicación
+    result = subprocess.run([sys.executable, QUERY_COUNTS, '--base', '50'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
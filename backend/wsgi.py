@@ -0,0 +1,10 @@
+"""
+Punto de entrada WSGI para servidores de producción.
+
+    gunicorn --chdir backend -c backend/gunicorn.conf.py wsgi:app
+
+Cada worker importa este módulo y crea su propia app (con su propio pool de conexiones SQLite).
+"""
+from app import create_app
+
+app = create_app()
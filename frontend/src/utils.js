@@ -0,0 +1,12 @@
+// frontend/src/utils.js
+// Funciones compartidas entre las vistas
+
+// Debounce function para no llamar a la API en cada tecleo
+export function debounce(func, delay) {
+    let timeout;
+    return function(...args) {
+        const context = this;
+        clearTimeout(timeout);
+        timeout = setTimeout(() => func.apply(context, args), delay);
+    };
+}
@@ -1,5 +1,7 @@
 // frontend/src/views/catalogView.js
 
+import { debounce } from '../utils.js';
+
 let allAvailableCategories = [];
 let allAvailableTags = [];
 let currentFilters = {
@@ -8,19 +10,26 @@ let currentFilters = {
     tag_ids: []
 };
 
-async function fetchFilterData() {
-    try {
-        const [categoriesRes, tagsRes] = await Promise.all([
-            fetch('/api/categories'),
-            fetch('/api/tags')
-        ]);
-        allAvailableCategories = categoriesRes.ok ? await categoriesRes.json() : [];
-        allAvailableTags = tagsRes.ok ? await tagsRes.json() : [];
-    } catch (error) {
-        console.error("Error fetching filter data:", error);
-        allAvailableCategories = [];
-        allAvailableTags = [];
+// Pide el catálogo con los filtros actuales. Las categorías y tags (con la cantidad de productos de
+// cada uno) vienen en la misma respuesta (facets=true): no hace falta otra petición para los filtros.
+function fetchCatalog() {
+    const params = new URLSearchParams();
+    params.append('facets', 'true');
+    if (currentFilters.searchTerm) {
+        params.append('search_term', currentFilters.searchTerm);
+    }
+    if (currentFilters.category_ids.length > 0) {
+        params.append('category_ids', currentFilters.category_ids.join(','));
+    }
+    if (currentFilters.tag_ids.length > 0) {
+        params.append('tag_ids', currentFilters.tag_ids.join(','));
     }
+
+    return fetch(`/api/catalog?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`Error ${response.status}: ${response.statusText}`);
+            return response.json();
+        });
 }
 
 function renderProductCard(product) {
@@ -75,7 +84,7 @@ function renderFilterControls() {
     if (allAvailableCategories.length > 0) {
         allAvailableCategories.forEach(cat => {
             categoriesHtml += `
-                <md-filter-chip label="${cat.name}" data-filter-type="category" data-id="${cat.id}"
+                <md-filter-chip label="${cat.name} (${cat.count})" data-filter-type="category" data-id="${cat.id}"
                                 ${currentFilters.category_ids.includes(cat.id) ? 'selected' : ''}>
                 </md-filter-chip>
             `;
@@ -89,7 +98,7 @@ function renderFilterControls() {
     if (allAvailableTags.length > 0) {
         allAvailableTags.forEach(tag => {
             tagsHtml += `
-                <md-filter-chip label="${tag.name}" data-filter-type="tag" data-id="${tag.id}"
+                <md-filter-chip label="${tag.name} (${tag.count})" data-filter-type="tag" data-id="${tag.id}"
                                 ${currentFilters.tag_ids.includes(tag.id) ? 'selected' : ''}>
                 </md-filter-chip>
             `;
@@ -135,36 +144,35 @@ function renderFilterControls() {
     return filterControlsContainer;
 }
 
+// Actualiza el conteo de cada chip con las facetas de la última respuesta
+function updateFacetCounts(facets) {
+    const facetsByType = { category: facets.categories, tag: facets.tags };
+    document.querySelectorAll('#catalog-filters md-filter-chip').forEach(chip => {
+        const facet = facetsByType[chip.dataset.filterType].find(f => f.id === parseInt(chip.dataset.id));
+        if (facet) chip.label = `${facet.name} (${facet.count})`;
+    });
+}
+
+function renderCatalogProducts(catalogGrid, products) {
+    catalogGrid.innerHTML = ''; // Limpiar "Cargando..."
+    if (products && products.length > 0) {
+        products.forEach(product => {
+            catalogGrid.appendChild(renderProductCard(product));
+        });
+    } else {
+        catalogGrid.innerHTML = '<p>No se encontraron productos con los filtros aplicados.</p>';
+    }
+}
+
 function fetchAndRenderCatalog() {
     const catalogGrid = document.getElementById('catalog-grid');
     if (!catalogGrid) return;
     catalogGrid.innerHTML = '<p>Cargando productos...</p>';
 
-    const params = new URLSearchParams();
-    if (currentFilters.searchTerm) {
-        params.append('search_term', currentFilters.searchTerm);
-    }
-    if (currentFilters.category_ids.length > 0) {
-        params.append('category_ids', currentFilters.category_ids.join(','));
-    }
-    if (currentFilters.tag_ids.length > 0) {
-        params.append('tag_ids', currentFilters.tag_ids.join(','));
-    }
-
-    fetch(`/api/catalog?${params.toString()}`)
-        .then(response => {
-            if (!response.ok) throw new Error(`Error ${response.status}: ${response.statusText}`);
-            return response.json();
-        })
-        .then(products => {
-            catalogGrid.innerHTML = ''; // Limpiar "Cargando..."
-            if (products && products.length > 0) {
-                products.forEach(product => {
-                    catalogGrid.appendChild(renderProductCard(product));
-                });
-            } else {
-                catalogGrid.innerHTML = '<p>No se encontraron productos con los filtros aplicados.</p>';
-            }
+    fetchCatalog()
+        .then(data => {
+            updateFacetCounts(data.facets);
+            renderCatalogProducts(catalogGrid, data.products);
         })
         .catch(error => {
             console.error('Error cargando el catálogo:', error);
@@ -172,17 +180,6 @@ function fetchAndRenderCatalog() {
         });
 }
 
-// Debounce function para no llamar a la API en cada tecleo
-function debounce(func, delay) {
-    let timeout;
-    return function(...args) {
-        const context = this;
-        clearTimeout(timeout);
-        timeout = setTimeout(() => func.apply(context, args), delay);
-    };
-}
-
-
 export function renderCatalogView() {
     const viewContainer = document.createElement('div');
     viewContainer.id = "catalog-view-container";
@@ -196,13 +193,27 @@ export function renderCatalogView() {
         </div>
     `;
 
+    // Carga inicial: una sola petición trae los productos y las facetas con las que se arman los filtros
     async function initializeView() {
         const filterControlsContainer = viewContainer.querySelector('#catalog-filter-controls-container');
+        const catalogGrid = viewContainer.querySelector('#catalog-grid');
         filterControlsContainer.innerHTML = '<p>Cargando filtros...</p>';
-        await fetchFilterData();
+        let data;
+        try {
+            data = await fetchCatalog();
+        } catch (error) {
+            console.error('Error cargando el catálogo:', error);
+            data = null;
+        }
+        allAvailableCategories = data ? data.facets.categories : [];
+        allAvailableTags = data ? data.facets.tags : [];
         filterControlsContainer.innerHTML = ''; // Clear loading
         filterControlsContainer.appendChild(renderFilterControls());
-        fetchAndRenderCatalog(); // Carga inicial de productos (sin filtros o con filtros por defecto)
+        if (data) {
+            renderCatalogProducts(catalogGrid, data.products);
+        } else {
+            catalogGrid.innerHTML = '<p>Error al cargar el catálogo. Intente más tarde.</p>';
+        }
     }
 
     initializeView();
@@ -1,8 +1,15 @@
 // frontend/src/views/clientsView.js
 
-let clients = [];
+import { debounce } from '../utils.js';
+
+let clients = []; // Clientes mostrados: una o más páginas del listado, o los resultados de la búsqueda
+let clientsNextCursor = null; // Cursor de la siguiente página de clientes (null si no hay más)
 let editingClient = null;
 let searchTerm = '';
+let searchRequestId = 0; // Para descartar respuestas de búsquedas que ya no son la última
+
+const SEARCH_MIN_LENGTH = 2;
+const SEARCH_LIMIT = 50;
 
 const genderOptions = [
     { value: '', label: 'No especificado' },
@@ -32,6 +39,7 @@ function renderClientForm(client = {}) {
                 ${genderOptions.map(opt => `<md-select-option value="${opt.value}" ${client.gender === opt.value ? 'selected' : ''}>${opt.label}</md-select-option>`).join('')}
             </md-outlined-select>
 
+            <!-- Con reglas de nivel en el backend (CLIENT_LEVEL_RULES) el nivel se calcula solo y no se puede cambiar a mano -->
             <md-outlined-select label="Nivel de Cliente" name="clientLevel" value="${client.clientLevel || 'Nuevo'}">
                  ${clientLevelOptions.map(opt => `<md-select-option value="${opt.value}" ${client.clientLevel === opt.value ? 'selected' : ''}>${opt.label}</md-select-option>`).join('')}
             </md-outlined-select>
@@ -48,13 +56,9 @@ function renderClientForm(client = {}) {
 
 function renderClientsTable(clientsToRender) {
     if (!clientsToRender || clientsToRender.length === 0) {
-        return '<p>No hay clientes para mostrar.</p>';
+        return searchTerm ? '<p>Ningún cliente coincide con la búsqueda.</p>' : '<p>No hay clientes para mostrar.</p>';
     }
     let tableHtml = `
-        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 16px;">
-            <h4>Listado de Clientes</h4>
-            <md-outlined-text-field id="clientSearch" label="Buscar cliente..." value="${searchTerm}" style="width: 250px;"></md-outlined-text-field>
-        </div>
         <div style="overflow-x: auto;">
         <table>
             <thead>
@@ -109,6 +113,24 @@ function renderClientsTable(clientsToRender) {
     return tableHtml;
 }
 
+// Resumen de compras precalculado por el backend (purchaseStats): no hace falta sumar las ventas
+function renderPurchaseStats(stats) {
+    if (!stats || stats.orderCount === 0) {
+        return '';
+    }
+    const formatDate = isoDate => new Date(`${isoDate}T00:00:00`).toLocaleDateString();
+    return `
+        <p>
+            <strong>Compras:</strong> ${stats.orderCount} &middot;
+            <strong>Total:</strong> $${stats.lifetimeValue.toFixed(2)} &middot;
+            <strong>Ticket promedio:</strong> $${stats.averageTicket.toFixed(2)}<br>
+            <strong>Primera compra:</strong> ${formatDate(stats.firstPurchase)} &middot;
+            <strong>Última compra:</strong> ${formatDate(stats.lastPurchase)}
+        </p>
+        <p style="font-size: 0.9em;">No incluye ventas canceladas.</p>
+    `;
+}
+
 async function showClientSalesHistory(clientId, clientName) {
     const modal = document.getElementById('clientSalesHistoryModal');
     const contentDiv = document.getElementById('clientSalesHistoryContent');
@@ -119,14 +141,18 @@ async function showClientSalesHistory(clientId, clientName) {
     modal.style.display = 'block';
 
     try {
-        const response = await fetch(`/api/sales?client_id=${clientId}`);
-        if (!response.ok) throw new Error('Error al cargar el historial de ventas.');
-        const salesHistory = await response.json();
+        const [salesRes, clientRes] = await Promise.all([
+            fetch(`/api/sales?client_id=${clientId}&all=true`),
+            fetch(`/api/clients/${clientId}`)
+        ]);
+        if (!salesRes.ok || !clientRes.ok) throw new Error('Error al cargar el historial de ventas.');
+        const salesHistory = await salesRes.json();
+        const client = await clientRes.json();
 
         if (salesHistory.length === 0) {
             contentDiv.innerHTML = '<p>Este cliente no tiene ventas registradas.</p>';
         } else {
-            let historyHtml = '<table><thead><tr><th>ID Venta</th><th>Fecha</th><th>Total</th><th>Estado</th><th>Items</th></tr></thead><tbody>';
+            let historyHtml = renderPurchaseStats(client.purchaseStats) + '<table><thead><tr><th>ID Venta</th><th>Fecha</th><th>Total</th><th>Estado</th><th>Items</th></tr></thead><tbody>';
             salesHistory.forEach(sale => {
                 historyHtml += `
                     <tr>
@@ -166,38 +192,98 @@ export function renderClientsView() {
     formContainer.id = "client-form-container";
     formContainer.innerHTML = renderClientForm();
 
+    // El buscador queda fuera de la tabla: al volver a dibujar los resultados no pierde el foco
+    const searchContainer = document.createElement('div');
+    searchContainer.style.cssText = 'display: flex; justify-content: space-between; align-items: center; margin-bottom: 16px;';
+    searchContainer.innerHTML = `
+        <h4>Listado de Clientes</h4>
+        <div style="display: flex; align-items: center; gap: 8px;">
+            <md-outlined-button id="reclassifyClientsBtn" title="Recalcula el nivel de todos los clientes según sus compras">Recalcular niveles</md-outlined-button>
+            <md-outlined-text-field id="clientSearch" type="search" label="Buscar (nombre, apodo, WhatsApp, email)" value="${searchTerm}" style="width: 320px;"></md-outlined-text-field>
+        </div>
+    `;
+
     const tableContainer = document.createElement('div');
     tableContainer.id = "clients-table-container";
     tableContainer.innerHTML = '<p>Cargando clientes...</p>';
 
     viewContainer.appendChild(formContainer);
+    viewContainer.appendChild(searchContainer);
     viewContainer.appendChild(tableContainer);
 
-    function filterClients() {
-        const lowerSearchTerm = searchTerm.toLowerCase();
-        const filtered = clients.filter(client =>
-            (client.name && client.name.toLowerCase().includes(lowerSearchTerm)) ||
-            (client.nickname && client.nickname.toLowerCase().includes(lowerSearchTerm)) ||
-            (client.whatsapp && client.whatsapp.includes(lowerSearchTerm)) ||
-            (client.email && client.email.toLowerCase().includes(lowerSearchTerm))
-        );
-        tableContainer.innerHTML = renderClientsTable(filtered);
-        attachTableEventListeners(); // Re-attach listeners for table and search
+    function renderClientsTableWithPager() {
+        tableContainer.innerHTML = renderClientsTable(clients);
+        if (clientsNextCursor && !searchTerm) {
+            tableContainer.innerHTML += `<md-outlined-button id="loadMoreClientsBtn" style="margin-top: 12px;">Cargar más clientes</md-outlined-button>`;
+        }
+        attachTableEventListeners();
     }
 
-    function refreshClientsList() {
-        fetch('/api/clients')
+    // Sin búsqueda, el listado se carga por páginas (cursor). "Cargar más" agrega la página siguiente.
+    function fetchClientsPage(cursor) {
+        const params = new URLSearchParams({ limit: '50' });
+        if (cursor) params.append('after', cursor);
+        return fetch(`/api/clients?${params.toString()}`)
             .then(response => response.json())
-            .then(data => {
-                clients = data;
-                filterClients(); // Render with current search term
-            })
-            .catch(error => {
-                console.error('Error cargando clientes:', error);
-                tableContainer.innerHTML = '<p>Error al cargar clientes.</p>';
+            .then(page => {
+                clients = cursor ? clients.concat(page.items) : page.items;
+                clientsNextCursor = page.next_cursor;
+                renderClientsTableWithPager();
             });
     }
 
+    // Con búsqueda, el servidor devuelve los clientes más relevantes (índice de búsqueda, tolera errores de tipeo)
+    function searchClients() {
+        const requestId = ++searchRequestId;
+        const params = new URLSearchParams({ q: searchTerm, limit: String(SEARCH_LIMIT) });
+        return fetch(`/api/clients/search?${params.toString()}`)
+            .then(response => response.json())
+            .then(results => {
+                if (requestId !== searchRequestId) return; // Llegó tarde: ya hay otra búsqueda en curso
+                clients = results;
+                clientsNextCursor = null;
+                renderClientsTableWithPager();
+            });
+    }
+
+    function refreshClientsList() {
+        const request = searchTerm.trim().length >= SEARCH_MIN_LENGTH ? searchClients() : fetchClientsPage(null);
+        request.catch(error => {
+            console.error('Error cargando clientes:', error);
+            tableContainer.innerHTML = '<p>Error al cargar clientes.</p>';
+        });
+    }
+
+    searchContainer.querySelector('#reclassifyClientsBtn').addEventListener('click', (e) => {
+        const button = e.currentTarget;
+        button.disabled = true;
+        fetch('/api/clients/reclassify', { method: 'POST' })
+            .then(response => response.json().then(data => ({ ok: response.ok, body: data })))
+            .then(res => {
+                if (res.ok) {
+                    const levels = Object.entries(res.body.levels).map(([level, count]) => `${level}: ${count}`).join(', ');
+                    alert(`Niveles recalculados. ${res.body.changed} clientes cambiaron de nivel (${levels}).`);
+                    refreshClientsList();
+                } else {
+                    alert(`Error: ${res.body.error || 'No se pudieron recalcular los niveles.'}`);
+                }
+            })
+            .catch(error => {
+                console.error('Error recalculando niveles:', error);
+                alert('Error al recalcular los niveles.');
+            })
+            .finally(() => { button.disabled = false; });
+    });
+
+    searchContainer.querySelector('#clientSearch').addEventListener('input', debounce(e => {
+        const previousTerm = searchTerm;
+        searchTerm = e.target.value;
+        // Con menos de 2 caracteres se muestra el listado (si antes había una búsqueda)
+        if (searchTerm.trim().length >= SEARCH_MIN_LENGTH || previousTerm.trim().length >= SEARCH_MIN_LENGTH) {
+            refreshClientsList();
+        }
+    }, 250));
+
     function attachFormEventListeners() {
         const clientForm = formContainer.querySelector('#clientForm');
         const clientMessage = formContainer.querySelector('#clientMessage');
@@ -248,6 +334,18 @@ export function renderClientsView() {
     }
 
     function attachTableEventListeners() {
+        const loadMoreBtn = tableContainer.querySelector('#loadMoreClientsBtn');
+        if (loadMoreBtn) {
+            loadMoreBtn.addEventListener('click', () => {
+                loadMoreBtn.disabled = true;
+                fetchClientsPage(clientsNextCursor)
+                    .catch(error => {
+                        console.error('Error cargando más clientes:', error);
+                        loadMoreBtn.disabled = false;
+                    });
+            });
+        }
+
         tableContainer.querySelectorAll('.edit-client-btn').forEach(button => {
             button.addEventListener('click', (e) => {
                 const clientId = parseInt(e.currentTarget.dataset.id, 10);
@@ -292,14 +390,6 @@ export function renderClientsView() {
                 }
             });
         });
-
-        const searchInput = tableContainer.querySelector('#clientSearch');
-        if (searchInput) {
-            searchInput.addEventListener('input', (e) => {
-                searchTerm = e.target.value;
-                filterClients();
-            });
-        }
     }
 
     refreshClientsList();
@@ -48,7 +48,10 @@ function renderDashboardCard(cardDef, summaryData) {
     return card;
 }
 
-function renderKanbanBoard(salesByStatus) {
+// Ventas más recientes que se muestran por columna (el resto se ve en la vista de Ventas)
+const KANBAN_SALES_PER_STATUS = 10;
+
+function renderKanbanBoard(board) {
     const boardContainer = document.createElement('div');
     boardContainer.id = 'kanban-board';
     boardContainer.innerHTML = '<h3>Pipeline de Ventas (Kanban)</h3>';
@@ -62,18 +65,21 @@ function renderKanbanBoard(salesByStatus) {
     kanbanStatuses.forEach(status => {
         const column = document.createElement('div');
         column.classList.add('kanban-column');
-        column.innerHTML = `<h4>${status} (${(salesByStatus[status] || []).length})</h4>`;
+        const columnData = board[status] || { count: 0, sales: [] };
+        column.innerHTML = `<h4>${status} (${columnData.count})</h4>`;
 
         const cardsContainer = document.createElement('div');
         cardsContainer.classList.add('kanban-cards-container');
 
-        (salesByStatus[status] || []).forEach(sale => {
+        columnData.sales.forEach(sale => {
+            const itemsSummary = sale.items.map(item => `${item.quantity}x ${item.product_name}`).join(', ');
             const card = document.createElement('md-outlined-card'); // Usar outlined para las tarjetas de venta
             card.classList.add('kanban-sale-card');
             card.innerHTML = `
                 <div style="padding: 8px 12px;">
                     <p style="font-weight: bold; margin-bottom: 4px;">Venta #${sale.id} - ${sale.client_name}</p>
                     <p style="font-size: 0.9em; margin-bottom: 4px;">Total: $${sale.totalAmount.toFixed(2)}</p>
+                    <p style="font-size: 0.8em; margin-bottom: 4px;">${itemsSummary}</p>
                     <p style="font-size: 0.8em; color: #666;">Fecha: ${new Date(sale.saleDate).toLocaleDateString()}</p>
                     <!-- Podríamos añadir más detalles o un botón para ver la venta completa -->
                 </div>
@@ -81,6 +87,12 @@ function renderKanbanBoard(salesByStatus) {
             // Aquí se podría añadir drag-and-drop si se quisiera mover entre estados (requiere más lógica)
             cardsContainer.appendChild(card);
         });
+        if (columnData.count > columnData.sales.length) {
+            const more = document.createElement('p');
+            more.style.cssText = 'font-size: 0.8em; color: #666; text-align: center;';
+            more.textContent = `y ${columnData.count - columnData.sales.length} más...`;
+            cardsContainer.appendChild(more);
+        }
         column.appendChild(cardsContainer);
         columnsContainer.appendChild(column);
     });
@@ -89,6 +101,32 @@ function renderKanbanBoard(salesByStatus) {
     return boardContainer;
 }
 
+// Una sola conexión al feed de cambios por pestaña: se cierra al volver a renderizar el dashboard
+// o, en el siguiente evento o heartbeat, si la vista ya no está en la página.
+let changeFeed = null;
+
+function subscribeToChanges(viewContainer, handlers) {
+    if (changeFeed) changeFeed.close();
+    const source = new EventSource('/api/events');
+    changeFeed = source;
+
+    const isViewGone = () => {
+        if (viewContainer.isConnected) return false;
+        source.close();
+        if (changeFeed === source) changeFeed = null;
+        return true;
+    };
+
+    source.addEventListener('open', () => { if (!isViewGone()) handlers.open(); });
+    source.addEventListener('resync', () => { if (!isViewGone()) handlers.open(); });
+    source.addEventListener('heartbeat', isViewGone);
+    ['summary_updated', 'sale_created', 'sale_status_changed', 'sale_deleted'].forEach(eventType => {
+        source.addEventListener(eventType, event => {
+            if (!isViewGone()) handlers[eventType](JSON.parse(event.data));
+        });
+    });
+    source.addEventListener('error', () => console.warn('Feed de cambios desconectado, reintentando...'));
+}
 
 export function renderDashboardView() {
     const viewContainer = document.createElement('div');
@@ -107,38 +145,57 @@ export function renderDashboardView() {
     viewContainer.appendChild(kanbanContainer);
 
 
-    // Fetch summary data
-    fetch('/api/dashboard/summary')
-        .then(response => response.json())
-        .then(summary => {
-            summaryCardsContainer.innerHTML = ''; // Clear loading
-            cardDefinitions.forEach(def => {
-                summaryCardsContainer.appendChild(renderDashboardCard(def, summary));
-            });
-        })
-        .catch(error => {
-            console.error('Error cargando resumen del dashboard:', error);
-            summaryCardsContainer.innerHTML = '<p>Error al cargar resumen.</p>';
+    function renderSummary(summary) {
+        summaryCardsContainer.innerHTML = ''; // Clear loading
+        cardDefinitions.forEach(def => {
+            summaryCardsContainer.appendChild(renderDashboardCard(def, summary));
         });
+    }
+
 
-    // Fetch all sales for Kanban (o por estados)
-    fetch('/api/sales') // Podríamos tener un endpoint que ya las agrupe por estado
-        .then(response => response.json())
-        .then(allSales => {
-            const salesByStatus = {};
-            allSales.forEach(sale => {
-                if (!salesByStatus[sale.status]) {
-                    salesByStatus[sale.status] = [];
-                }
-                salesByStatus[sale.status].push(sale);
+    function loadSummary() {
+        fetch('/api/dashboard/summary')
+            .then(response => response.json())
+            .then(renderSummary)
+            .catch(error => {
+                console.error('Error cargando resumen del dashboard:', error);
+                summaryCardsContainer.innerHTML = '<p>Error al cargar resumen.</p>';
             });
-            kanbanContainer.innerHTML = ''; // Clear loading
-            kanbanContainer.appendChild(renderKanbanBoard(salesByStatus));
-        })
-        .catch(error => {
-            console.error('Error cargando ventas para Kanban:', error);
-            kanbanContainer.innerHTML = '<p>Error al cargar pipeline de ventas.</p>';
-        });
+    }
+
+    // El servidor ya agrupa por estado y limita las ventas por columna: la respuesta no crece con el historial
+    function loadKanban() {
+        fetch(`/api/dashboard/sales_board?limit=${KANBAN_SALES_PER_STATUS}`)
+            .then(response => response.json())
+            .then(data => {
+                kanbanContainer.innerHTML = ''; // Clear loading
+                kanbanContainer.appendChild(renderKanbanBoard(data.board));
+            })
+            .catch(error => {
+                console.error('Error cargando ventas para Kanban:', error);
+                kanbanContainer.innerHTML = '<p>Error al cargar pipeline de ventas.</p>';
+            });
+    }
+
+    // Varias ventas seguidas (ej. una carga rápida en feria) generan una sola recarga del tablero
+    let kanbanReloadTimer = null;
+    function scheduleKanbanReload() {
+        clearTimeout(kanbanReloadTimer);
+        kanbanReloadTimer = setTimeout(loadKanban, 300);
+    }
+
+    // Cambios en vivo (Server-Sent Events): las cards se actualizan con los datos del evento y el
+    // tablero (acotado) se vuelve a pedir solo cuando cambia alguna venta
+    subscribeToChanges(viewContainer, {
+        // La primera carga se hace al abrir la conexión (así no se pierden cambios entre la carga y la
+        // suscripción). Al reconectar, o si el servidor pide resincronizar, se recargan los datos completos
+        // una vez, por si hubo cambios mientras no había conexión
+        open: () => { loadSummary(); loadKanban(); },
+        summary_updated: renderSummary,
+        sale_created: scheduleKanbanReload,
+        sale_status_changed: scheduleKanbanReload,
+        sale_deleted: scheduleKanbanReload,
+    });
 
     const style = document.createElement('style');
     style.textContent = `
@@ -162,7 +162,7 @@ export function renderProductsView() {
     viewContainer.appendChild(tableContainer);
 
     function refreshTable() {
-        fetch('/api/products')
+        fetch('/api/products?all=true')
             .then(response => response.json())
             .then(data => {
                 products = data;
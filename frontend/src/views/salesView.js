@@ -1,10 +1,15 @@
 // frontend/src/views/salesView.js
 
+import { debounce } from '../utils.js';
+
 let sales = [];
-let allClients = [];
+let salesNextCursor = null; // Cursor de la siguiente página de ventas (null si no hay más)
 let allProducts = [];
 let editingSale = null;
 let currentSaleItems = []; // Para el formulario de nueva venta/edición
+let clientSearchRequestId = 0; // Para descartar respuestas de búsquedas de clientes que ya no son la última
+
+const CLIENT_PICKER_LIMIT = 8;
 
 const saleStatusOptions = ["Contactado", "Armado", "Entregado", "Cobrado", "Cancelado"];
 const saleStatusColors = {
@@ -25,18 +30,15 @@ const saleStatusIcons = {
 
 async function fetchDataForSalesForm() {
     try {
-        const [clientsRes, productsRes] = await Promise.all([
-            fetch('/api/clients'),
-            fetch('/api/products')
-        ]);
-        if (!clientsRes.ok || !productsRes.ok) {
+        // Solo los campos que usa el formulario (?fields=): respuestas más livianas.
+        // Los clientes no se descargan: el selector los busca en el servidor mientras se escribe.
+        const productsRes = await fetch('/api/products?all=true&fields=id,name,stockActual,priceShowroom');
+        if (!productsRes.ok) {
             throw new Error('Error al cargar datos maestros para ventas.');
         }
-        allClients = await clientsRes.json();
         allProducts = await productsRes.json();
     } catch (error) {
         console.error("Error fetching data for sales form:", error);
-        allClients = [];
         allProducts = [];
     }
 }
@@ -54,9 +56,12 @@ function renderSaleForm(sale = {}) {
         <form id="saleForm" style="display: flex; flex-direction: column; gap: 16px; margin-bottom: 16px;">
             <input type="hidden" name="id" value="${sale.id || ''}">
 
-            <md-outlined-select label="Cliente" name="client_id" value="${sale.client_id || ''}" required>
-                ${allClients.map(c => `<md-select-option value="${c.id}" ${sale.client_id === c.id ? 'selected' : ''}>${c.name}</md-select-option>`).join('')}
-            </md-outlined-select>
+            <div class="client-picker">
+                <md-outlined-text-field label="Cliente (buscar por nombre, apodo o WhatsApp)" id="saleClientSearch" type="search"
+                    value="${sale.client_name || ''}" ${editingSale ? 'disabled' : ''} required></md-outlined-text-field>
+                <input type="hidden" name="client_id" value="${sale.client_id || ''}">
+                <div id="saleClientResults" class="client-picker-results"></div>
+            </div>
 
             <h5>Items del Pedido</h5>
             <div id="saleItemsContainer" style="display: flex; flex-direction: column; gap: 10px; border: 1px solid #ccc; padding:10px; border-radius:4px;">
@@ -173,6 +178,20 @@ export function renderSalesView() {
             padding-bottom: 8px;
             margin-bottom: 8px; /* Espacio entre items */
         }
+        .client-picker { position: relative; }
+        .client-picker md-outlined-text-field { width: 100%; }
+        .client-picker-results {
+            position: absolute;
+            z-index: 10;
+            left: 0;
+            right: 0;
+            background: var(--md-sys-color-surface-container, #fff);
+            box-shadow: 0 2px 6px rgba(0,0,0,0.2);
+            border-radius: 4px;
+        }
+        .client-picker-option { padding: 8px 12px; cursor: pointer; }
+        .client-picker-option:hover { background: var(--md-sys-color-surface-container-highest, #eee); }
+        .client-picker-option small { color: var(--md-sys-color-on-surface-variant, #666); }
         .sale-item-form-row > * { /* Todos los hijos directos */
             margin-bottom: 0; /* Resetear margen si los text-fields lo tienen */
         }
@@ -209,14 +228,29 @@ export function renderSalesView() {
         attachFormEventListeners();
     }
 
-    function refreshSalesList() {
-        fetch('/api/sales')
+    function renderSalesTableWithPager() {
+        tableContainer.innerHTML = renderSalesTable(sales);
+        if (salesNextCursor) {
+            tableContainer.innerHTML += `<md-outlined-button id="loadMoreSalesBtn" style="margin-top: 12px;">Cargar más ventas</md-outlined-button>`;
+        }
+        attachTableEventListeners();
+    }
+
+    // Las ventas se cargan por páginas (cursor). "Cargar más" agrega la página siguiente.
+    function fetchSalesPage(cursor) {
+        const params = new URLSearchParams({ limit: '50' });
+        if (cursor) params.append('after', cursor);
+        return fetch(`/api/sales?${params.toString()}`)
             .then(response => response.json())
-            .then(data => {
-                sales = data;
-                tableContainer.innerHTML = renderSalesTable(sales);
-                attachTableEventListeners();
-            })
+            .then(page => {
+                sales = cursor ? sales.concat(page.items) : page.items;
+                salesNextCursor = page.next_cursor;
+                renderSalesTableWithPager();
+            });
+    }
+
+    function refreshSalesList() {
+        fetchSalesPage(null)
             .catch(error => {
                 console.error('Error cargando ventas:', error);
                 tableContainer.innerHTML = '<p>Error al cargar ventas.</p>';
@@ -270,10 +304,56 @@ export function renderSalesView() {
     }
 
 
+    // Selector de cliente: busca en el servidor (GET /api/clients/search) mientras se escribe
+    function attachClientPickerListeners() {
+        const searchField = formContainer.querySelector('#saleClientSearch');
+        const clientIdInput = formContainer.querySelector('[name="client_id"]');
+        const resultsContainer = formContainer.querySelector('#saleClientResults');
+        if (!searchField || searchField.disabled) return;
+
+        function showResults(results) {
+            if (results.length === 0) {
+                resultsContainer.innerHTML = '<div class="client-picker-option"><small>Ningún cliente coincide.</small></div>';
+                return;
+            }
+            resultsContainer.innerHTML = results.map(c => `
+                <div class="client-picker-option" data-id="${c.id}" data-name="${c.name}">
+                    ${c.name}${c.nickname ? ` (${c.nickname})` : ''} <small>${c.whatsapp || ''}</small>
+                </div>
+            `).join('');
+            resultsContainer.querySelectorAll('.client-picker-option[data-id]').forEach(option => {
+                option.addEventListener('click', () => {
+                    clientIdInput.value = option.dataset.id;
+                    searchField.value = option.dataset.name;
+                    resultsContainer.innerHTML = '';
+                });
+            });
+        }
+
+        searchField.addEventListener('input', debounce(e => {
+            const term = e.target.value.trim();
+            clientIdInput.value = ''; // El texto cambió: hay que volver a elegir un cliente de la lista
+            const requestId = ++clientSearchRequestId;
+            if (term.length < 2) {
+                resultsContainer.innerHTML = '';
+                return;
+            }
+            const params = new URLSearchParams({ q: term, limit: String(CLIENT_PICKER_LIMIT), fields: 'id,name,nickname,whatsapp' });
+            fetch(`/api/clients/search?${params.toString()}`)
+                .then(response => response.json())
+                .then(results => {
+                    if (requestId === clientSearchRequestId) showResults(results); // Descarta respuestas viejas
+                })
+                .catch(error => console.error('Error buscando clientes:', error));
+        }, 200));
+    }
+
     function attachFormEventListeners() {
         const saleForm = formContainer.querySelector('#saleForm');
         const saleMessage = formContainer.querySelector('#saleMessage');
 
+        attachClientPickerListeners();
+
         document.getElementById('addSaleItemBtn')?.addEventListener('click', () => {
             currentSaleItems.push({ product_id: '', quantity: 1, price_at_sale: 0, subtotal: 0 });
             document.getElementById('saleItemsContainer').innerHTML = renderCurrentSaleItemsForm();
@@ -297,6 +377,12 @@ export function renderSalesView() {
                     }))
                 };
 
+                if (!editingSale && !dataToSave.client_id) {
+                    saleMessage.textContent = 'Error: Debe elegir un cliente de la lista.';
+                    saleMessage.style.color = 'red';
+                    return;
+                }
+
                 if (dataToSave.items.length === 0) {
                     saleMessage.textContent = 'Error: Debe añadir al menos un producto a la venta.';
                     saleMessage.style.color = 'red';
@@ -355,6 +441,18 @@ export function renderSalesView() {
     }
 
     function attachTableEventListeners() {
+        const loadMoreBtn = tableContainer.querySelector('#loadMoreSalesBtn');
+        if (loadMoreBtn) {
+            loadMoreBtn.addEventListener('click', () => {
+                loadMoreBtn.disabled = true;
+                fetchSalesPage(salesNextCursor)
+                    .catch(error => {
+                        console.error('Error cargando más ventas:', error);
+                        loadMoreBtn.disabled = false;
+                    });
+            });
+        }
+
         tableContainer.querySelectorAll('.edit-sale-btn').forEach(button => {
             button.addEventListener('click', async (e) => {
                 const saleId = parseInt(e.currentTarget.dataset.id, 10);
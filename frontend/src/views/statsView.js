@@ -21,6 +21,7 @@ function renderSalesOverTime(data) {
     content += `
         <md-outlined-select id="salesPeriodSelect" label="Periodo">
             <md-select-option value="day" selected>Diario</md-select-option>
+            <md-select-option value="week">Semanal</md-select-option>
             <md-select-option value="month">Mensual</md-select-option>
             <md-select-option value="year">Anual</md-select-option>
         </md-outlined-select>